@@ -0,0 +1,70 @@
+"""Broadcast load test: hundreds of healthy fake clients plus one that never finishes a send
+
+usage: python benchmarks/bench_broadcast.py [--clients 500] [--slides 50]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from google_photos_slideshow import Slideshow
+
+
+class FakeWebsocket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.received = []
+
+    async def send(self, message):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received.append((time.perf_counter(), message))
+
+    async def close(self):
+        pass
+
+
+class BenchSlideshow(Slideshow):
+    async def _fetch_urls(self):
+        return [f"https://example.com/{i}.jpg" for i in range(100)]
+
+    async def _get_content_type(self, url):
+        return None
+
+
+async def bench(n_clients, slides, stall=3600, send_timeout=0.5):
+    s = BenchSlideshow("bench", support_casting=False)
+    s.client_send_timeout = send_timeout
+    await s._refresh()
+    healthy = [FakeWebsocket() for _ in range(n_clients)]
+    slow = FakeWebsocket(delay=stall)
+    for ws in healthy + [slow]:
+        await s._register(ws)
+
+    broadcast_times = []
+    latencies = []
+    for i in range(slides):
+        message = json.dumps({'url': f"https://example.com/{i}.jpg", 'content-type': None})
+        t = time.perf_counter()
+        await s._send_to_all(message, key='slide')
+        broadcast_times.append(time.perf_counter() - t)
+        await asyncio.sleep(0.02)
+        latencies.extend(ws.received[-1][0] - t for ws in healthy if ws.received[-1][1] == message)
+
+    await asyncio.sleep(send_timeout * 2)
+    per_client = statistics.mean(broadcast_times) / (n_clients + 1)
+    print(f"{n_clients} healthy clients + 1 stalled: broadcast {statistics.mean(broadcast_times) * 1000:.2f}ms "
+          f"({per_client * 1e6:.2f}us/client), delivery p50 {statistics.median(latencies) * 1000:.2f}ms "
+          f"max {max(latencies) * 1000:.2f}ms, stalled client dropped: {slow not in s.clients}, "
+          f"clients left: {len(s.clients)}")
+    for ws in list(s.clients):
+        await s._unregister(ws)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--slides", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(bench(args.clients, args.slides))
@@ -0,0 +1,127 @@
+"""Leader/follower fan-out: clients per process and end to end broadcast latency
+
+Runs one slideshow process holding every client, then a leader with --followers follower processes sharing the
+clients over the unix socket bus and over the redis bus (against benchmarks/redis_standin.py). Client connections are
+opened from separate processes. The lead before show_at is pinned, so a client can tell how long after the leader's
+broadcast a slide arrived: latency = received - (show_at - lead).
+
+usage: python benchmarks/bench_fanout.py [--clients 1000] [--followers 4] [--slides 5]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+import aiohttp
+
+from google_photos_slideshow import Slideshow
+from google_photos_slideshow.sync import DisplaySync
+from redis_standin import RedisStandIn
+
+LEAD = 1.0
+
+
+class BenchSlideshow(Slideshow):
+    async def _fetch_urls(self):
+        return [f"https://example.com/{i}.jpg" for i in range(100)]
+
+    async def _get_content_type(self, url):
+        return None
+
+    def launch(self):
+        pass
+
+
+def server(port, bus=None, role='leader'):
+    DisplaySync.min_lead = DisplaySync.max_lead = LEAD
+    s = BenchSlideshow("bench", state_path='', port=port, host='127.0.0.1', single_port=True, support_casting=False,
+                       image_duration=1, bus=bus, role=role)
+    s.serve()  # closes the slideshow on SIGTERM
+
+
+def redis_server(port):
+    async def main():
+        server = await RedisStandIn().start(port=port)
+        await server.serve_forever()
+    asyncio.run(main())
+
+
+def clients(port, n, slides, conn):
+    async def one(session, latencies):
+        async with session.ws_connect(f"ws://127.0.0.1:{port}/ws") as ws:
+            seen = 0
+            async for msg in ws:
+                data = json.loads(msg.data)
+                if data.get('show_at'):
+                    # the first broadcast can overlap with other clients still connecting, skip it
+                    if seen:
+                        latencies.append(time.time() * 1000 - (data['show_at'] - LEAD * 1000))
+                    seen += 1
+                    if seen > slides:
+                        return
+
+    async def main():
+        latencies = []
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            await asyncio.gather(*[one(session, latencies) for _ in range(n)])
+        conn.send(latencies)
+
+    asyncio.run(main())
+
+
+def start(target, *args):
+    p = multiprocessing.Process(target=target, args=args, daemon=True)
+    p.start()
+    return p
+
+
+def run(name, n_clients, slides, ports):
+    """Connect n_clients spread over the servers on ports and collect their latencies"""
+    pipes, procs = [], []
+    for port in ports:
+        parent, child = multiprocessing.Pipe()
+        procs.append(start(clients, port, n_clients // len(ports), slides, child))
+        pipes.append(parent)
+    latencies = sorted(x for parent in pipes for x in parent.recv())
+    for p in procs:
+        p.join()
+    print(f"{name:34} {n_clients // len(ports):5} clients per process | latency p50 {statistics.median(latencies):6.1f}ms "
+          f"p99 {latencies[int(len(latencies) * 0.99)]:6.1f}ms max {latencies[-1]:6.1f}ms")
+
+
+def main(n_clients, followers, slides, port=18300):
+    servers = [start(server, port)]
+    time.sleep(1)
+    run("single process", n_clients, slides, [port])
+    for p in servers:
+        p.terminate()
+        p.join()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        buses = [("unix socket bus", f"unix://{os.path.join(tmp, 'bus.sock')}", []),
+                 ("redis bus (stand-in)", f"redis://127.0.0.1:{port + 99}/0", [start(redis_server, port + 99)])]
+        for name, bus, extra in buses:
+            time.sleep(0.5)
+            servers = extra + [start(server, port, bus)]
+            time.sleep(0.5)
+            ports = [port + 1 + i for i in range(followers)]
+            servers += [start(server, p, bus, 'follower') for p in ports]
+            time.sleep(1)
+            run(f"leader + {followers} followers, {name}", n_clients, slides, ports)
+            # followers first, then the leader, then the bus they talk over
+            for p in reversed(servers):
+                p.terminate()
+                p.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--followers", type=int, default=4)
+    parser.add_argument("--slides", type=int, default=5)
+    args = parser.parse_args()
+    main(args.clients, args.followers, args.slides)
@@ -0,0 +1,54 @@
+"""Hundreds of albums in one SlideshowHost: memory per album and how late the shared scheduler fires slides
+
+usage: python benchmarks/bench_host.py [--albums 100 500] [--seconds 5]
+"""
+import argparse
+import asyncio
+import gc
+import statistics
+import tracemalloc
+
+from google_photos_slideshow import SlideshowHost
+
+
+async def bench(n, seconds, duration=0.5):
+    host = SlideshowHost(state_path='', port=0)
+    loop = asyncio.get_running_loop()
+    lateness = []
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(n):
+        s = await host.add(f"album{i}", 'urls', urls=[f"https://example.com/{i}/{j}.jpg" for j in range(100)],
+                           image_duration=duration * (1 + i % 5 / 10), support_casting=False)
+        advance = s._advance
+
+        async def timed(deadline, advance=advance, started=[]):
+            if started:  # the first slide of an album starts its clock, it has no meaningful deadline
+                lateness.append(loop.time() - deadline)
+            started.append(True)
+            await advance(deadline)
+
+        s._advance = timed
+    await asyncio.sleep(0.5)
+    gc.collect()
+    per_album = (tracemalloc.get_traced_memory()[0] - before) / n
+    tracemalloc.stop()
+    lateness.clear()
+    task = asyncio.create_task(host.scheduler.run())
+    await asyncio.sleep(seconds)
+    task.cancel()
+    await host.close()
+    lateness.sort()
+    print(f"{n} albums: {per_album / 1024:.1f}KB per album (100 urls each), {len(lateness) / seconds:.0f} slides/s, "
+          f"lateness p50 {statistics.median(lateness) * 1000:.2f}ms p99 {lateness[int(len(lateness) * 0.99)] * 1000:.2f}ms "
+          f"max {lateness[-1] * 1000:.2f}ms, {len(asyncio.all_tasks())} tasks left")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--albums", type=int, nargs="*", default=[100, 500])
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+    for n in args.albums:
+        asyncio.run(bench(n, args.seconds))
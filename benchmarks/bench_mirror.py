@@ -0,0 +1,124 @@
+"""Album mirror: how fast a whole album is copied to disk, and what resuming and budgets cost
+
+A fake album server (its own process) serves --items photos of --size KB with --latency seconds per request, with
+Range support. The mirror downloads them over a session configured like the slideshow's, and reports, for each
+--concurrency level, the time to mirror the whole album, photos/s and MB/s. Then:
+
+- resume: a mirror of 16 photos of 4MB is stopped halfway and a new one started on the same folder, it should only
+  download the half that was missing
+- rate limit: a run with --rate KB/s should take size / rate
+- re-sync: the cost of sync() on every refresh once everything is mirrored
+
+Failing over to the mirror when the album can't be fetched is checked by tests/test_mirror.py.
+
+usage: python benchmarks/bench_mirror.py [--items 2000] [--size 64] [--latency 0.02] [--concurrency 1 4 8]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from google_photos_slideshow import Slideshow
+from google_photos_slideshow.mirror import AlbumMirror
+
+def album_server(port, folder, latency):
+    async def main():
+        @web.middleware
+        async def slow(request, handler):
+            await asyncio.sleep(latency)
+            return await handler(request)
+
+        app = web.Application(middlewares=[slow])
+        app.router.add_static('/photos', folder)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def session():
+    connector = aiohttp.TCPConnector(limit=Slideshow.http_connection_limit,
+                                     limit_per_host=Slideshow.http_connections_per_host)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=Slideshow.http_timeout))
+
+
+async def mirror_all(urls, folder, concurrency, rate=None, stop_at=None):
+    """Mirror urls into folder, returns (seconds, mirror), stopping early once stop_at bytes are downloaded"""
+    async with session() as s:
+        mirror = AlbumMirror(folder, lambda: s, rate=rate, concurrency=concurrency)
+        t = time.perf_counter()
+        mirror.sync(urls)
+        while len(mirror.files) < len(urls) and (stop_at is None or mirror.downloaded_bytes < stop_at):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - t
+        mirror.close()
+    return elapsed, mirror
+
+
+def main(items, size, latency, levels, rate, port=18800):
+    with tempfile.TemporaryDirectory() as tmp:
+        photos = Path(tmp) / 'photos'
+        photos.mkdir()
+        for i in range(items):
+            (photos / f"{i:06d}.jpg").write_bytes(os.urandom(size * 1024))
+        (photos / 'big').mkdir()
+        for i in range(16):
+            (photos / 'big' / f"{i:06d}.jpg").write_bytes(os.urandom(4 * 1024 ** 2))
+        server = multiprocessing.Process(target=album_server, args=(port, photos, latency), daemon=True)
+        server.start()
+        time.sleep(0.5)
+        urls = [f"http://127.0.0.1:{port}/photos/{i:06d}.jpg" for i in range(items)]
+        total = items * size * 1024
+        print(f"{items} photos of {size}KB, {latency * 1000:.0f}ms per request")
+        for concurrency in levels:
+            folder = Path(tmp) / f"mirror-{concurrency}"
+            elapsed, mirror = asyncio.run(mirror_all(urls, folder, concurrency))
+            print(f"  concurrency {concurrency:3} | {elapsed:6.2f}s, {items / elapsed:7.1f} photos/s, "
+                  f"{total / elapsed / 1024 ** 2:6.1f}MB/s | failures {mirror.failures}")
+
+        folder = Path(tmp) / 'mirror-resume'
+        big = [f"http://127.0.0.1:{port}/photos/big/{i:06d}.jpg" for i in range(16)]
+        # rate limited so it is stopped in the middle of files
+        asyncio.run(mirror_all(big, folder, 4, rate=16 * 1024 ** 2, stop_at=30 * 1024 ** 2))
+        parts = len(list(folder.glob('*.part')))
+        elapsed, mirror = asyncio.run(mirror_all(big, folder, 4))
+        print(f"  resume after half | {parts} partial files resumed, downloaded {mirror.downloaded_bytes / 1024 ** 2:.0f}MB "
+              f"of 64MB in {elapsed:.2f}s, {len(mirror.files)}/16 mirrored")
+
+        if rate:
+            subset = urls[:max(1, rate * 3 // size)]  # about 3s of downloads at the limit
+            elapsed, mirror = asyncio.run(mirror_all(subset, Path(tmp) / 'mirror-rate', 4, rate=rate * 1024))
+            print(f"  rate limit {rate}KB/s | {mirror.downloaded_bytes / 1024 / elapsed:.0f}KB/s measured "
+                  f"over {elapsed:.1f}s")
+
+        async def resync():
+            async with session() as s:
+                mirror = AlbumMirror(Path(tmp) / f"mirror-{levels[-1]}", lambda: s)
+                t = time.perf_counter()
+                mirror.sync(urls)
+                elapsed = time.perf_counter() - t
+                mirror.close()
+                return elapsed, mirror.queue.qsize()
+
+        elapsed, queued = asyncio.run(resync())
+        print(f"  re-sync of a mirrored album | {elapsed * 1000:.1f}ms, {queued} queued")
+        server.kill()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=64, help="KB per photo")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the album server waits per request")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--rate", type=int, default=2048, help="KB/s for the rate limited run, 0 to skip it")
+    args = parser.parse_args()
+    main(args.items, args.size, args.latency, args.concurrency, args.rate)
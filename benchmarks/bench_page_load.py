@@ -0,0 +1,104 @@
+"""Page load: bytes and requests for a screen to open the slideshow, and the time until it shows a slide
+
+A slideshow runs in its own process, the parent loads the page like a browser would: index.html, then every
+stylesheet, script and icon it links to in parallel, then the websocket until the first slide. Bytes are counted as
+sent on the wire (compressed bodies are not decompressed). The page is loaded a second time with a browser cache:
+assets with a max-age are not requested again, the others are revalidated with If-None-Match. Resources on other
+hosts (CDNs) can't be loaded offline, they are only counted.
+
+usage: python benchmarks/bench_page_load.py [--loads 10]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import re
+import statistics
+import time
+from urllib.parse import urljoin
+
+import aiohttp
+
+from google_photos_slideshow import Slideshow
+
+
+class BenchSlideshow(Slideshow):
+    async def _fetch_urls(self):
+        return [f"https://example.com/{i}.jpg" for i in range(100)]
+
+    async def _get_content_type(self, url):
+        return None
+
+    def launch(self):
+        pass
+
+
+def server(port):
+    s = BenchSlideshow("bench", state_path='', port=port, host='127.0.0.1', single_port=True, image_duration=3600)
+    s.serve()  # closes the slideshow on SIGTERM
+
+
+async def get(session, url, cache):
+    """Fetch url through a dict acting as the browser cache, returns the bytes on the wire (None when not requested)"""
+    cached = cache.get(url, None)
+    if cached is not None and cached['fresh']:
+        return None
+    headers = {'Accept-Encoding': 'gzip, deflate, br'}
+    if cached is not None and cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+    async with session.get(url, headers=headers) as response:
+        body = await response.read()
+        if response.status == 200:
+            cache_control = response.headers.get('Cache-Control', '')
+            cache[url] = {'etag': response.headers.get('ETag', None), 'body': body,
+                          'encoding': response.headers.get('Content-Encoding', None),
+                          'fresh': 'max-age' in cache_control and 'max-age=0' not in cache_control}
+        return len(body) + sum(len(k) + len(v) + 4 for k, v in response.raw_headers)
+
+
+async def load(session, base, cache):
+    t = time.perf_counter()
+    wire = await get(session, base + '/', cache) or 0
+    requests = 1
+    entry = cache[base + '/']
+    html = entry['body']
+    if entry['encoding'] is not None:
+        import gzip
+        html = gzip.decompress(html) if entry['encoding'] == 'gzip' else __import__('brotli').decompress(html)
+    links = re.findall(r'<(?:link|script)[^>]+(?:href|src)="([^"]+)"', html.decode())
+    local = [urljoin(base + '/', link) for link in links if not link.startswith('http')]
+    external = [link for link in links if link.startswith('http')]
+    sizes = await asyncio.gather(*[get(session, url, cache) for url in local])
+    wire += sum(size for size in sizes if size is not None)
+    requests += sum(size is not None for size in sizes)
+    async with session.ws_connect(base.replace('http', 'ws') + '/ws') as ws:
+        async for msg in ws:
+            if 'slide' in json.loads(msg.data) or 'url' in json.loads(msg.data):
+                break
+    return wire, requests, len(external), time.perf_counter() - t
+
+
+async def bench(port, loads):
+    base = f"http://127.0.0.1:{port}"
+    first, repeat = [], []
+    async with aiohttp.ClientSession(auto_decompress=False) as session:
+        for _ in range(loads):
+            cache = {}
+            first.append(await load(session, base, cache))
+            repeat.append(await load(session, base, cache))
+    for name, results in [("first load", first), ("repeat load", repeat)]:
+        wire, requests, external, _ = results[-1]
+        print(f"{name:12} {requests} requests, {wire / 1024:6.1f}KB on the wire, {external} requests to other hosts | "
+              f"first slide after median {statistics.median(r[3] for r in results) * 1000:5.1f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loads", type=int, default=10)
+    args = parser.parse_args()
+    p = multiprocessing.Process(target=server, args=(18900,), daemon=True)
+    p.start()
+    time.sleep(1)
+    asyncio.run(bench(18900, args.loads))
+    p.terminate()
+    p.join()
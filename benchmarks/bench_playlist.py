@@ -0,0 +1,59 @@
+"""Compare the old list based url diffing with Playlist.update
+
+usage: python benchmarks/bench_playlist.py
+"""
+import random
+import time
+
+from google_photos_slideshow.playlist import Playlist
+
+
+def list_record_urls(old, current_index, urls):
+    """The list based Slideshow._record_urls this replaced"""
+    new_urls = [url for url in urls if url not in old]
+    removed_urls = [url for url in old if url not in urls]
+    random.shuffle(new_urls)
+    old = old[:current_index + 1] + new_urls + old[current_index + 1:]
+    for url in removed_urls:
+        if url in old:
+            if current_index > old.index(url):
+                current_index -= 1
+            old.remove(url)
+    return old, current_index
+
+
+def refreshes(n):
+    """An album of n urls, then the same album with 1% of the urls swapped for new ones"""
+    before = [f"https://lh3.googleusercontent.com/pw/{i:08d}" for i in range(n)]
+    after = before[n // 100:] + [f"https://lh3.googleusercontent.com/pw/new{i:08d}" for i in range(n // 100)]
+    return before, after
+
+
+def bench(n, max_list_n=20_000):
+    before, after = refreshes(n)
+    t = time.perf_counter()
+    p = Playlist(before)
+    p.cursor = n // 2
+    p.update(after)
+    playlist_t = time.perf_counter() - t
+
+    if n <= max_list_n:
+        t = time.perf_counter()
+        list_record_urls(list(before), n // 2, after)
+        list_t = time.perf_counter() - t
+    else:
+        list_t = None
+
+    t = time.perf_counter()
+    for _ in range(10_000):
+        p.next()
+    next_t = (time.perf_counter() - t) / 10_000
+
+    ls = f"{list_t * 1000:10.1f}ms" if list_t is not None else "   (skipped)"
+    speedup = f"{list_t / playlist_t:8.0f}x" if list_t is not None else ""
+    print(f"{n:>8} urls   list: {ls}   playlist: {playlist_t * 1000:8.1f}ms {speedup}   next(): {next_t * 1e6:.1f}us")
+
+
+if __name__ == '__main__':
+    for n in [1_000, 10_000, 100_000]:
+        bench(n)
@@ -0,0 +1,99 @@
+"""Conditional polling against a local album: what an unchanged and a changed refresh cost
+
+A fixture album server on localhost serves --photos urls, with or without ETag support, and changes its page between
+refreshes. A RegexSlideshow refreshes against it --rounds times, timing unchanged refreshes (a 304 with ETags, the page
+hashed as it downloads without) and changed ones, and counting the scanner's feed calls of each. What the refreshes do
+is checked by tests/test_poll.py.
+
+usage: python benchmarks/bench_poll.py [--photos 3000] [--rounds 10]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiohttp import web
+
+from google_photos_slideshow import RegexSlideshow
+from google_photos_slideshow.scanner import StreamScanner
+
+
+class Album:
+    """The fixture album's page and how it answers"""
+
+    def __init__(self, photos, port):
+        self.port = port
+        self.version = 0
+        self.photos = photos
+        self.etags = True
+
+    def urls(self):
+        return [f"http://127.0.0.1:{self.port}/p/{self.version}-{i}.jpg" for i in range(self.photos)]
+
+    def body(self):
+        return ("<title>Poll Album</title>" + "".join(f'<img src="{url}">' for url in self.urls())).encode()
+
+    async def handle(self, request):
+        etag = f'"v{self.version}"'
+        headers = {'ETag': etag} if self.etags else {}
+        if self.etags and request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=self.body(), headers=headers, content_type='text/html')
+
+
+def count_feeds():
+    """Patch StreamScanner.feed to count calls, returns the counter"""
+    calls = [0]
+    feed = StreamScanner.feed
+
+    def counted(self, text):
+        calls[0] += 1
+        return feed(self, text)
+
+    StreamScanner.feed = counted
+    return calls
+
+
+async def refreshes(album, feeds, etags, rounds):
+    """Time unchanged and changed refreshes, with or without ETags"""
+    album.etags = etags
+    album.version += 1
+    s = RegexSlideshow(f"http://127.0.0.1:{album.port}/", state_path='', support_casting=False)
+    await s._refresh()
+    unchanged, changed = [], []
+    for _ in range(rounds):
+        before = feeds[0]
+        t = time.perf_counter()
+        await s._refresh()
+        unchanged.append((time.perf_counter() - t, feeds[0] - before))
+        album.version += 1
+        before = feeds[0]
+        t = time.perf_counter()
+        await s._refresh()
+        changed.append((time.perf_counter() - t, feeds[0] - before))
+    await s.close()
+    for name, times in (("unchanged", unchanged), ("changed", changed)):
+        print(f"  {'etag' if etags else 'no etag':7} {name:9} | p50 {statistics.median(t for t, _ in times) * 1000:7.1f}ms, "
+              f"{statistics.median(f for _, f in times):.0f} feed calls")
+
+
+async def main(photos, rounds, port=18290):
+    album = Album(photos, port)
+    app = web.Application()
+    app.router.add_get('/', album.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    feeds = count_feeds()
+    print(f"album of {photos} photos")
+    await refreshes(album, feeds, True, rounds)
+    await refreshes(album, feeds, False, rounds)
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.photos, args.rounds))
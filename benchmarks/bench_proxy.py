@@ -0,0 +1,98 @@
+"""Image proxy against a fake upstream: what a miss, a hit, a revalidation and a shared download cost
+
+A fake upstream on localhost serves photos of --size KB after --latency seconds, the proxy is mounted on a second
+local server like in the slideshow and screens fetch /proxy/<key> from it. Timed: the first request for a photo (a
+miss, it goes upstream), the next ones (hits from the cache), a request with the ETag in If-None-Match (a 304), and
+--screens screens asking for a new photo at once (they share one download). What the proxy does is checked by
+tests/test_proxy.py.
+
+usage: python benchmarks/bench_proxy.py [--size 256] [--latency 0.05] [--screens 50]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from google_photos_slideshow.proxy import ImageProxy
+
+
+class Upstream:
+    """The photo host behind the proxy"""
+
+    def __init__(self, size, latency):
+        self.photo = os.urandom(size * 1024)
+        self.latency = latency
+        self.requests = Counter()  # path -> requests
+
+    async def photos(self, request):
+        self.requests[request.path] += 1
+        await asyncio.sleep(self.latency)
+        return web.Response(body=self.photo, content_type='image/jpeg')
+
+
+async def serve(app, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def main(size, latency, screens, port=18850):
+    upstream = Upstream(size, latency)
+    app = web.Application()
+    app.router.add_get('/photos/{name}', upstream.photos)
+    upstream_runner = await serve(app, port)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        session = aiohttp.ClientSession()
+        proxy = ImageProxy(Path(tmp) / 'cache', lambda: session)
+        app = web.Application()
+        proxy.setup_routes(app)
+        proxy_runner = await serve(app, port + 1)
+        base = f"http://127.0.0.1:{port + 1}"
+
+        def photo(i):
+            return f"http://127.0.0.1:{port}/photos/{i}.jpg"
+
+        async def get(url, client, headers=None):
+            t = time.perf_counter()
+            async with client.get(base + proxy.url_for(url), headers=headers) as response:
+                await response.read()
+            return time.perf_counter() - t, response.headers.get('ETag')
+
+        def p50(results):
+            return f"p50 {statistics.median(elapsed for elapsed, _ in results) * 1000:.1f}ms"
+
+        print(f"photos of {size}KB, upstream answers after {latency * 1000:.0f}ms")
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as client:
+            misses = [await get(photo(i), client) for i in range(10)]
+            hits = [await get(photo(i), client) for i in range(10) for _ in range(5)]
+            revalidations = [await get(photo(i), client, {'If-None-Match': etag})
+                             for i, (_, etag) in enumerate(misses)]
+            print(f"  miss {p50(misses)}, hit {p50(hits)}, 304 {p50(revalidations)} | "
+                  f"{sum(upstream.requests.values())} upstream requests")
+
+            t = time.perf_counter()
+            await asyncio.gather(*[get(photo('shared'), client) for _ in range(screens)])
+            print(f"  {screens} screens asking for a new photo at once | all served after "
+                  f"{(time.perf_counter() - t) * 1000:.1f}ms, {upstream.requests['/photos/shared.jpg']} upstream requests")
+
+        await proxy_runner.cleanup()
+        await session.close()
+    await upstream_runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=256, help="KB per photo")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the upstream waits per request")
+    parser.add_argument("--screens", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.size, args.latency, args.screens))
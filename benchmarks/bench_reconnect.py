@@ -0,0 +1,116 @@
+"""Reconnect storm: N screens drop and reconnect at the same moment
+
+The slideshow runs in its own process (websocket route on the http port), a second process connects --clients screens,
+waits until every screen shows a slide, then closes them all and reconnects them all at once, like after a wifi blip.
+Reported: the time from the reconnect until each screen got its first slide (max = every screen shows a slide) and
+how late the slideshow's event loop ran a 10ms timer meanwhile, for each connection rate limit in --rates (0 for none).
+
+usage: python benchmarks/bench_reconnect.py [--clients 200] [--rates 0 100 400]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import statistics
+import time
+
+import aiohttp
+
+from google_photos_slideshow import Slideshow
+
+
+class BenchSlideshow(Slideshow):
+    async def _fetch_urls(self):
+        return [f"https://example.com/{i}.jpg" for i in range(100)]
+
+    async def _get_content_type(self, url):
+        return None
+
+    def launch(self):
+        pass
+
+
+def server(port, rate, conn):
+    async def probe(lags):
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(0.01)
+            lags.append(loop.time() - t - 0.01)
+
+    async def main():
+        s = BenchSlideshow("bench", state_path='', port=port, host='127.0.0.1', single_port=True, image_duration=2,
+                           connect_rate=rate or None)
+        task = asyncio.create_task(s.run_servers())
+        lags = []
+        prober = asyncio.create_task(probe(lags))
+        conn.send('ready')
+        await asyncio.to_thread(conn.recv)
+        lags.clear()
+        await asyncio.to_thread(conn.recv)
+        conn.send(sorted(lags))
+        prober.cancel()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+
+
+async def first_slide(session, url, times, t0):
+    ws = await session.ws_connect(url)
+    async for msg in ws:
+        data = json.loads(msg.data)
+        if 'slide' in data:
+            times.append(time.perf_counter() - t0)
+            return ws
+
+
+async def storm(port, n, conn):
+    url = f"ws://127.0.0.1:{port}/ws"
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        sockets = await asyncio.gather(*[first_slide(session, url, [], time.perf_counter()) for _ in range(n)])
+        await asyncio.gather(*[ws.close() for ws in sockets])
+        await asyncio.sleep(0.5)
+        conn.send('storm')
+        times = []
+        t0 = time.perf_counter()
+        sockets = await asyncio.gather(*[first_slide(session, url, times, t0) for _ in range(n)])
+        conn.send(sorted(times))
+        await asyncio.gather(*[ws.close() for ws in sockets])
+
+
+def clients(port, n, conn):
+    asyncio.run(storm(port, n, conn))
+
+
+def bench(n, rate, port):
+    server_parent, server_child = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=server, args=(port, rate, server_child))
+    p.start()
+    server_parent.recv()
+    time.sleep(1)
+    parent, child = multiprocessing.Pipe()
+    c = multiprocessing.Process(target=clients, args=(port, n, child))
+    c.start()
+    parent.recv()
+    server_parent.send('storm')
+    times = parent.recv()
+    server_parent.send('done')
+    lags = server_parent.recv()
+    c.join()
+    p.join()
+    print(f"rate limit {rate or 'none':>5} | {n} screens reconnected, slide after p50 {statistics.median(times) * 1000:6.0f}ms "
+          f"p95 {times[int(len(times) * 0.95)] * 1000:6.0f}ms all {times[-1] * 1000:6.0f}ms | event loop lag "
+          f"p99 {lags[int(len(lags) * 0.99)] * 1000:5.1f}ms max {lags[-1] * 1000:5.1f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--rates", type=float, nargs="*", default=[0, 100, 400])
+    args = parser.parse_args()
+    for i, rate in enumerate(args.rates):
+        bench(args.clients, rate, 18700 + i)
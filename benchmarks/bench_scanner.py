@@ -0,0 +1,100 @@
+"""Whole-document regex vs the streaming scanner on synthetic album pages
+
+Serves pages of 1, 10 and 50 MB of inline JSON with photo urls scattered through them on localhost and compares
+`await response.text()` + re.findall with RegexSlideshow._fetch_urls: total time, time until the first url is known
+and peak python memory. The streaming peak includes the playlist it fills, the whole document peak does not.
+
+usage: python benchmarks/bench_scanner.py [--sizes 1 10 50]
+"""
+import argparse
+import asyncio
+import random
+import re
+import time
+import tracemalloc
+
+import aiohttp
+from aiohttp import web
+
+from google_photos_slideshow import GooglePhotosSlideshow
+
+
+def synthetic_page(megabytes, seed=0):
+    rng = random.Random(seed)
+    parts = ["<html><head><title>Bench Album</title></head><body><script>var data = ["]
+    size = len(parts[0])
+    i = 0
+    while size < megabytes * 1024 ** 2:
+        filler = '{"k":"%s","v":%d},' % ("x" * rng.randint(50, 400), i)
+        url = '"https://lh3.googleusercontent.com/pw/%s",' % "".join(rng.choices("abcdefghijklmnopqrstuvwxyz0123456789_-", k=120))
+        parts.append(filler + url)
+        size += len(filler) + len(url)
+        i += 1
+    parts.append("]</script></body></html>")
+    return "".join(parts).encode()
+
+
+async def serve(pages, port):
+    app = web.Application()
+    for mb, body in pages.items():
+        app.router.add_get(f'/{mb}', lambda request, body=body: web.Response(body=body, content_type='text/html'))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def whole_document(url, regex):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            text = await response.text()
+            return set(re.findall(regex, text)), None
+
+
+async def streaming(url):
+    s = GooglePhotosSlideshow(url, state_path='')
+    first = []
+    record = s._record_urls
+
+    async def record_urls(urls):
+        if not first:
+            first.append(time.perf_counter())
+        return await record(urls)
+
+    s._record_urls = record_urls
+    urls = await s._fetch_urls()
+    await s.close()
+    return set(urls), first[0] if first else None
+
+
+async def measure(make):
+    """Time one run, then measure peak memory in a second run (tracemalloc slows allocation heavy code down)"""
+    t = time.perf_counter()
+    urls, first = await make()
+    total = time.perf_counter() - t
+    tracemalloc.start()
+    await make()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return urls, total, (first - t) if first else total, peak
+
+
+async def main(sizes, port=18191):
+    pages = {mb: synthetic_page(mb) for mb in sizes}
+    runner = await serve(pages, port)
+    for mb in sizes:
+        url = f"http://127.0.0.1:{port}/{mb}"
+        old_urls, old_t, old_first, old_peak = await measure(lambda: whole_document(url, GooglePhotosSlideshow.default_regex))
+        new_urls, new_t, new_first, new_peak = await measure(lambda: streaming(url))
+        assert old_urls == new_urls
+        print(f"{mb:>3} MB, {len(new_urls)} urls | whole document: {old_t * 1000:7.0f}ms, first url {old_first * 1000:7.0f}ms, "
+              f"peak {old_peak / 1024 ** 2:6.1f}MB | streaming: {new_t * 1000:7.0f}ms, first url {new_first * 1000:5.0f}ms, "
+              f"peak {new_peak / 1024 ** 2:6.1f}MB")
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1, 10, 50])
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes))
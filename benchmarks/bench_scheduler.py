@@ -0,0 +1,55 @@
+"""Check that the slide scheduler does not drift over 1000 slides
+
+Each simulated broadcast takes 2ms, which the old send-then-sleep loop added to every slide period.
+
+usage: python benchmarks/bench_scheduler.py [--slides 1000] [--duration 0.01]
+"""
+import argparse
+import asyncio
+
+from google_photos_slideshow import Slideshow
+
+
+class BenchSlideshow(Slideshow):
+    async def _fetch_urls(self):
+        return [f"https://example.com/{i}.jpg" for i in range(100)]
+
+    async def _get_content_type(self, url):
+        return None
+
+    def launch(self):
+        pass
+
+
+async def bench(slides, duration, send_time=0.002):
+    s = BenchSlideshow("bench", state_path='', image_duration=duration, support_casting=False)
+    loop = asyncio.get_running_loop()
+    times = []
+
+    async def send(url, clients=None):
+        times.append(loop.time())
+        await asyncio.sleep(send_time)
+
+    s._send_slide = send
+    task = asyncio.create_task(s.run())
+    while len(times) <= slides:
+        await asyncio.sleep(duration)
+    task.cancel()
+    s.refresh_task.cancel()
+
+    periods = [b - a for a, b in zip(times, times[1:slides + 1])]
+    drift = times[slides] - times[0] - slides * duration
+    jitter = max(abs(p - duration) for p in periods)
+    print(f"{slides} slides of {duration * 1000:.0f}ms: cumulative drift {drift * 1000:.2f}ms, "
+          f"max period error {jitter * 1000:.2f}ms, old loop would drift ~{slides * (send_time + 0.1) * 1000:.0f}ms")
+    return drift
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slides", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=0.01)
+    args = parser.parse_args()
+    drift = asyncio.run(bench(args.slides, args.duration))
+    # a drifting scheduler accumulates at least the send time per slide
+    raise SystemExit(0 if abs(drift) < args.duration else 1)
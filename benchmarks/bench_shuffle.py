@@ -0,0 +1,161 @@
+"""Playlist shuffling: is the lazy shuffle uniform, and what does each slide cost on a huge album
+
+Uniformity (chi-square tests, the script exits 1 if a p-value is below 0.001 or an epoch repeats a recent slide):
+- permutations: with no repeat gap, every epoch of a --small url playlist is one of its n! orders, each as likely
+- positions: with the default repeat gap, each url is as likely at each position after the guarded start of an epoch,
+  and none of the last slides of an epoch is among the first of the next
+- fresh: uploads added mid-epoch are shown at about fresh_boost of the slides until they are all shown
+
+Cost: --items urls (1M by default) in a Playlist and a CompactPlaylist, the time of next() + upcoming() per slide as
+the slideshow calls them (p50, p99 and max, the max includes a wrap around), of a wrap around on its own, and of
+inserting and removing a url mid-epoch. For comparison, the time the old wrap around took: one random.shuffle of
+every url.
+
+usage: python benchmarks/bench_shuffle.py [--items 1000000] [--steps 200000] [--epochs 24000] [--small 4]
+"""
+import argparse
+import itertools
+import math
+import random
+import statistics
+import time
+from collections import Counter
+
+from google_photos_slideshow.playlist import Playlist
+from google_photos_slideshow.urlstore import CompactPlaylist, UrlStore
+
+LOOKAHEAD = 10  # the slideshow looks up to content_type_lookahead slides ahead
+
+
+def chi2_p(statistic, dof):
+    """Upper tail p-value of a chi-square statistic (Wilson-Hilferty approximation, good for dof >= 3)"""
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def chi2(counts, expected):
+    return sum((c - expected) ** 2 / expected for c in counts)
+
+
+def play_epochs(p, epochs):
+    """The orders next() plays in, one list per epoch, starting after the first epoch"""
+    n = len(p)
+    for _ in range(n - 1 - p.cursor):
+        p.next()
+    orders = []
+    for _ in range(epochs):
+        orders.append([(p.upcoming(LOOKAHEAD), p.next())[1] for _ in range(n)])
+    return orders
+
+
+def uniformity(small, epochs):
+    """Prints the tests, returns whether the shuffle passed them"""
+    urls = [f"u{i}" for i in range(small)]
+    p = Playlist()
+    p.repeat_gap = 0
+    p.apply(urls, [])
+    counts = Counter(tuple(order) for order in play_epochs(p, epochs))
+    perms = math.factorial(small)
+    stat = chi2([counts[perm] for perm in itertools.permutations(urls)], epochs / perms)
+    permutations_p = chi2_p(stat, perms - 1)
+    print(f"  permutations of {small} urls, {epochs} epochs | chi2 {stat:.1f} dof {perms - 1}, p={permutations_p:.3f}")
+
+    n = 40
+    urls = [f"u{i}" for i in range(n)]
+    p = Playlist()
+    p.apply(urls, [])
+    gap = min(p.repeat_gap, n // 2)
+    orders = play_epochs(p, epochs // 4)
+    table = Counter((url, i) for order in orders for i, url in enumerate(order) if i >= gap)
+    cells = [table[url, i] for url in urls for i in range(gap, n)]
+    dof = (n - 1) * (n - gap - 1)
+    stat = chi2(cells, len(orders) / n)
+    positions_p = chi2_p(stat, dof)
+    repeats = sum(bool(set(a[-gap:]) & set(b[:gap])) for a, b in zip(orders, orders[1:]))
+    print(f"  positions {gap}-{n - 1} of {n} urls, {len(orders)} epochs | chi2 {stat:.1f} dof {dof}, "
+          f"p={positions_p:.3f} | epochs starting with one of the last {gap} slides: {repeats}")
+
+    for boost in (0.25, 0.5, 0.9):
+        shares = []
+        for _ in range(200):
+            p = Playlist(fresh_boost=boost)
+            p.apply([f"u{i}" for i in range(1000)], [])
+            for _ in range(random.randrange(100)):
+                p.next()
+            p.apply([f"new{i}" for i in range(20)], [])
+            slides = 0
+            while p._fresh:
+                p.next()
+                slides += 1
+            shares.append(20 / slides)
+        print(f"  fresh boost {boost} | share of slides that were fresh until all 20 were shown: "
+              f"{statistics.mean(shares):.2f}")
+    return permutations_p >= 0.001 and positions_p >= 0.001 and not repeats
+
+
+def percentiles(times):
+    times = sorted(times)
+    return (f"p50 {times[len(times) // 2] * 1e6:6.1f}us p99 {times[int(len(times) * 0.99)] * 1e6:6.1f}us "
+            f"max {times[-1] * 1e6:8.1f}us")
+
+
+def cost(items, steps):
+    urls = [f"https://photos.example.com/album/{i:08d}.jpg" for i in range(items)]
+    t = time.perf_counter()
+    random.sample(urls, len(urls))
+    print(f"  old wrap around, shuffling all {items} urls | {(time.perf_counter() - t) * 1000:.0f}ms")
+
+    store = UrlStore.from_urls(urls)
+    for name, p in (('Playlist', Playlist(urls)), ('CompactPlaylist', CompactPlaylist(store))):
+        # start just before a wrap around, so the steps include one
+        p.cursor = len(p) - steps // 2
+        times = []
+        for _ in range(steps):
+            t = time.perf_counter()
+            p.next()
+            p.upcoming(LOOKAHEAD)
+            times.append(time.perf_counter() - t)
+        print(f"  {name:15} next + upcoming({LOOKAHEAD}) | {percentiles(times)}")
+        wraps = []
+        for _ in range(20):
+            p.cursor = len(p) - 1
+            p.drawn, p.ahead = len(p), 0
+            t = time.perf_counter()
+            p.next()
+            wraps.append(time.perf_counter() - t)
+        print(f"  {name:15} wrap around | {percentiles(wraps)}")
+
+    p = Playlist(urls)
+    p.cursor = 1000
+    inserts, removes = [], []
+    for i in range(2000):
+        url = f"https://photos.example.com/album/new{i:08d}.jpg"
+        t = time.perf_counter()
+        p.apply([url], [])
+        inserts.append(time.perf_counter() - t)
+        gone = p[random.randrange(len(p))]
+        t = time.perf_counter()
+        p.apply([], [gone])
+        removes.append(time.perf_counter() - t)
+    print(f"  Playlist insert mid-epoch | {percentiles(inserts)}")
+    print(f"  Playlist remove mid-epoch | {percentiles(removes)}")
+
+
+def main(items, steps, epochs, small):
+    print("uniformity")
+    uniform = uniformity(small, epochs)
+    print(f"per slide cost, {items} urls")
+    cost(items, steps)
+    return uniform
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("--steps", type=int, default=200_000)
+    parser.add_argument("--epochs", type=int, default=24_000, help="Epochs played for the permutation test")
+    parser.add_argument("--small", type=int, default=4, help="Urls in the permutation test")
+    args = parser.parse_args()
+    uniform = main(args.items, args.steps, args.epochs, args.small)
+    # a biased shuffle shows up as a tiny p-value
+    raise SystemExit(0 if uniform else 1)
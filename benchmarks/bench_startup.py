@@ -0,0 +1,119 @@
+"""Cold start: import time of the package, and how long the CLI takes to serve index.html and the first slide
+
+Import time is the cumulative time python -X importtime reports for the package, the median of --runs fresh
+interpreters. Then the regex mode is started through its CLI entry point (with launch() stubbed out) against a fake
+album server that takes --latency seconds to answer, and the parent polls until index.html is served and until a
+websocket client gets its first slide, both timed from spawning the process.
+
+usage: python benchmarks/bench_startup.py [--runs 5] [--latency 2]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+CHILD = """
+from google_photos_slideshow import RegexSlideshow
+RegexSlideshow.launch = lambda self: None
+RegexSlideshow.main()
+"""
+
+
+def import_time():
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import google_photos_slideshow'],
+                         capture_output=True, text=True, check=True).stderr
+    line = next(line for line in out.splitlines() if line.rstrip().endswith('| google_photos_slideshow'))
+    return int(line.split('|')[1]) / 1e6
+
+
+def heavy_modules():
+    modules = ('aiohttp', 'websockets', 'yaml', 'sqlite3', 'multiprocessing', 'google_photos_slideshow.host',
+               'google_photos_slideshow.bus', 'google_photos_slideshow.metrics', 'google_photos_slideshow.state')
+    code = f"import sys, google_photos_slideshow; print(' '.join(m for m in {modules!r} if m in sys.modules))"
+    return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()
+
+
+def album_server(port, latency):
+    async def main():
+        async def page(request):
+            await asyncio.sleep(latency)
+            body = "<html><head><title>Startup</title></head><body>"
+            body += "".join(f'<img src="https://example.com/{i}.jpg">' for i in range(100))
+            return web.Response(text=body + "</body></html>", content_type='text/html')
+
+        app = web.Application()
+        app.router.add_get('/album', page)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+async def cli_startup(album_port, port, websocket_port, tmp):
+    args = ['--url', f"http://127.0.0.1:{album_port}/album", '--host', '127.0.0.1', '--port', str(port),
+            '--websocket-port', str(websocket_port), '--state-path', '', '--cfg', os.path.join(tmp, 'config.yaml')]
+    t = time.perf_counter()
+    child = subprocess.Popen([sys.executable, '-c', CHILD, *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    index = slide = None
+    try:
+        async with aiohttp.ClientSession() as session:
+            while index is None:
+                try:
+                    async with session.get(f"http://127.0.0.1:{port}/") as response:
+                        if response.status == 200:
+                            index = time.perf_counter() - t
+                except aiohttp.ClientError:
+                    if child.poll() is not None:
+                        raise RuntimeError(f"the slideshow exited with {child.returncode}")
+                    await asyncio.sleep(0.005)
+            while slide is None:
+                try:
+                    async with session.ws_connect(f"ws://127.0.0.1:{websocket_port}/") as ws:
+                        async for msg in ws:
+                            if 'slide' in json.loads(msg.data):
+                                slide = time.perf_counter() - t
+                                break
+                except aiohttp.ClientError:
+                    await asyncio.sleep(0.005)
+    finally:
+        # SIGTERM closes the slideshow, like Ctrl+C
+        child.terminate()
+        child.wait(10)
+    return index, slide
+
+
+def main(runs, latency, port=18600):
+    imports = [import_time() for _ in range(runs)]
+    print(f"import google_photos_slideshow: median {statistics.median(imports) * 1000:.0f}ms "
+          f"(min {min(imports) * 1000:.0f}ms), heavy modules loaded: {' '.join(heavy_modules()) or 'none'}")
+    album = multiprocessing.Process(target=album_server, args=(port, latency), daemon=True)
+    album.start()
+    time.sleep(0.5)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(runs):
+            results.append(asyncio.run(cli_startup(port, port + 1 + 2 * i, port + 2 + 2 * i, tmp)))
+    album.kill()
+    index = [r[0] for r in results]
+    slide = [r[1] for r in results]
+    print(f"regex CLI, album answers after {latency}s: index.html served after median "
+          f"{statistics.median(index) * 1000:.0f}ms, first slide after {statistics.median(slide) * 1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=2)
+    args = parser.parse_args()
+    main(args.runs, args.latency)
@@ -0,0 +1,64 @@
+"""Cold vs warm startup: time until the first slide is ready, with and without the album state cache
+
+Serves a fake album with a slow page load on localhost, starts a RegexSlideshow against it twice (first with an
+empty state file, then with the state the first run left behind).
+
+usage: python benchmarks/bench_state.py [--photos 20000] [--latency 2]
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+from google_photos_slideshow import RegexSlideshow
+
+
+async def start_album(photos, latency, port):
+    page = "<title>Bench Album</title>" + "".join(f'<img src="http://127.0.0.1:{port}/p/{i}.jpg">' for i in range(photos))
+
+    async def album(request):
+        await asyncio.sleep(latency)
+        return web.Response(text=page, content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/', album)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def startup(url, state_path):
+    s = RegexSlideshow(url, state_path=state_path)
+    s.launch = lambda: None
+    task = asyncio.create_task(s.run())
+    while not s.urls:
+        await asyncio.sleep(0.001)
+    ready = time.perf_counter() - s.started_at
+    await asyncio.sleep(0.5)  # let the state be written
+    task.cancel()
+    if s.refresh_task is not None:
+        s.refresh_task.cancel()
+    await s.close()
+    return ready
+
+
+async def main(photos, latency, port=18190):
+    runner = await start_album(photos, latency, port)
+    with tempfile.TemporaryDirectory() as d:
+        state_path = Path(d) / 'state.sqlite'
+        cold = await startup(f"http://127.0.0.1:{port}/", state_path)
+        warm = await startup(f"http://127.0.0.1:{port}/", state_path)
+    await runner.cleanup()
+    print(f"{photos} photos, {latency}s album latency: cold start {cold:.3f}s, warm start {warm:.3f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=20_000)
+    parser.add_argument("--latency", type=float, default=2)
+    args = parser.parse_args()
+    asyncio.run(main(args.photos, args.latency))
@@ -0,0 +1,80 @@
+"""Loading a huge url list: one str per url in a Playlist vs a UrlStore behind a CompactPlaylist
+
+Writes a file of CDN style urls (a few hundred folders) and loads it both ways, and once more into a UrlStore from a
+list of strs the way --urls given as a list is. Time is measured without tracing,
+memory (what stays allocated, and the peak while loading) in a second run under tracemalloc.
+
+usage: python benchmarks/bench_urlstore.py [--sizes 1000000 5000000]
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from google_photos_slideshow.google_photos_slideshow import content_types_by_extension
+from google_photos_slideshow.playlist import Playlist
+from google_photos_slideshow.urlstore import CompactPlaylist, UrlStore
+
+
+def write_urls(path, n):
+    with open(path, 'w') as f:
+        for i in range(n):
+            f.write(f"https://cdn{i % 8}.example.com/archive/{i // 100000:03d}/photo_{i:08d}.jpg\n")
+
+
+def str_playlist(path):
+    """What URLListSlideshow did before"""
+    urls = [v.strip() for v in Path(path).read_text().splitlines()]
+    return Playlist(urls)
+
+
+def compact_playlist(path):
+    return CompactPlaylist(UrlStore.from_file(path, content_types_by_extension))
+
+
+def compact_from_list(path):
+    """--urls given on the command line or in the config, the strs are there before the store"""
+    urls = [v.strip() for v in Path(path).read_text().splitlines()]
+    return CompactPlaylist(UrlStore.from_urls(urls, None, content_types_by_extension))
+
+
+def measure(load, path):
+    gc.collect()
+    t = time.perf_counter()
+    playlist = load(path)
+    elapsed = time.perf_counter() - t
+    t = time.perf_counter()
+    for _ in range(1000):
+        playlist.next()
+    step = (time.perf_counter() - t) / 1000
+    del playlist
+    gc.collect()
+    tracemalloc.start()
+    playlist = load(path)
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del playlist
+    return elapsed, step, kept, peak
+
+
+def main(sizes):
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = os.path.join(tmp, f"{n}.txt")
+            write_urls(path, n)
+            print(f"{n} urls, {os.path.getsize(path) / 1024 ** 2:.0f}MB file")
+            for name, load in [("str per url + Playlist", str_playlist), ("UrlStore + CompactPlaylist", compact_playlist),
+                               ("str list -> UrlStore", compact_from_list)]:
+                elapsed, step, kept, peak = measure(load, path)
+                print(f"  {name:27} load {elapsed:6.2f}s, next() {step * 1e6:5.1f}us, "
+                      f"memory {kept / 1024 ** 2:7.0f}MB (peak {peak / 1024 ** 2:.0f}MB)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1_000_000, 5_000_000])
+    args = parser.parse_args()
+    main(args.sizes)
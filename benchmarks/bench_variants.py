@@ -0,0 +1,54 @@
+"""Resized photo variants of a folder: resize time and cache hits
+
+Makes --photos JPEGs of --pixels on the long side in a temporary folder and asks for their variants the way screens
+do, then asks again and times the cache hits. What the cache keeps and deletes is checked by tests/test_variants.py.
+
+usage: python benchmarks/bench_variants.py [--photos 20] [--pixels 2000]
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from google_photos_slideshow.variants import ImageVariants
+
+
+def write_photos(folder, n, pixels):
+    photos = []
+    for i in range(n):
+        path = folder / f"{i}.jpg"
+        Image.new('RGB', (pixels, pixels * 3 // 4), ((i * 37) % 256, 80, 160)).save(path, quality=90)
+        photos.append(path)
+    return photos
+
+
+async def main(n, pixels):
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp, 'photos')
+        folder.mkdir()
+        photos = write_photos(folder, n, pixels)
+        variants = ImageVariants(folder, Path(tmp, 'cache'))
+
+        t = time.perf_counter()
+        await asyncio.gather(*[variants.get(photo, 1024) for photo in photos])
+        made = time.perf_counter() - t
+        times = []
+        for photo in photos:
+            t = time.perf_counter()
+            await variants.get(photo, 1024)
+            times.append(time.perf_counter() - t)
+        print(f"{n} photos of {pixels}px: resized in {made * 1000:.0f}ms, "
+              f"cache hit p50 {statistics.median(times) * 1e6:.0f}us")
+        variants.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=20)
+    parser.add_argument("--pixels", type=int, default=2000, help="Long side of the photos")
+    args = parser.parse_args()
+    asyncio.run(main(args.photos, args.pixels))
@@ -0,0 +1,102 @@
+"""Separate websockets server vs a websocket route on the aiohttp server: connect latency and memory per connection
+
+Each mode runs the slideshow in its own process, this process opens the connections with the same aiohttp client
+(permessage-deflate on) and times each one from connect until the first slide arrives. The server reports how much
+its python heap and RSS grew with all the connections open.
+
+usage: python benchmarks/bench_websocket.py [--clients 200]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import statistics
+import time
+import tracemalloc
+
+import aiohttp
+
+from google_photos_slideshow import Slideshow
+
+
+class BenchSlideshow(Slideshow):
+    async def _fetch_urls(self):
+        return [f"https://example.com/{i}.jpg" for i in range(100)]
+
+    async def _get_content_type(self, url):
+        return None
+
+    def launch(self):
+        pass
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * 4096
+
+
+def server(single_port, port, websocket_port, conn):
+    async def main():
+        s = BenchSlideshow("bench", state_path='', port=port,
+                           websocket_port=websocket_port, host='127.0.0.1', single_port=single_port,
+                           support_casting=False, image_duration=3600)
+        task = asyncio.create_task(s.run_servers())
+        await asyncio.sleep(0.5)
+        conn.send('ready')
+        baseline = None
+        while True:
+            command = await asyncio.to_thread(conn.recv)
+            if command == 'baseline':
+                tracemalloc.start()
+                baseline = tracemalloc.get_traced_memory()[0], rss()
+                conn.send(len(s.clients))
+            elif command == 'measure':
+                conn.send((len(s.clients), tracemalloc.get_traced_memory()[0] - baseline[0], rss() - baseline[1]))
+            else:
+                break
+        task.cancel()
+
+    asyncio.run(main())
+
+
+async def connect_all(url, n):
+    latencies = []
+    sockets = []
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        for _ in range(n):
+            t = time.perf_counter()
+            ws = await session.ws_connect(url, compress=15)
+            await ws.receive()
+            latencies.append(time.perf_counter() - t)
+            sockets.append(ws)
+        yield latencies
+        for ws in sockets:
+            await ws.close()
+
+
+async def bench(single_port, n, port=18200, websocket_port=18201):
+    parent, child = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=server, args=(single_port, port, websocket_port, child))
+    p.start()
+    parent.recv()
+    parent.send('baseline')
+    parent.recv()
+    url = f"ws://127.0.0.1:{port}/ws" if single_port else f"ws://127.0.0.1:{websocket_port}/"
+    async for latencies in connect_all(url, n):
+        await asyncio.sleep(0.5)
+        parent.send('measure')
+        clients, heap, resident = parent.recv()
+    parent.send('stop')
+    p.join()
+    latencies.sort()
+    name = "single port (aiohttp route)" if single_port else "separate websockets server"
+    print(f"{name:28} {clients} clients | connect p50 {statistics.median(latencies) * 1000:.2f}ms "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f}ms | per connection: python heap "
+          f"{heap / clients / 1024:.1f}KB, rss {resident / clients / 1024:.1f}KB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(bench(False, args.clients))
+    asyncio.run(bench(True, args.clients))
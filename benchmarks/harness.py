@@ -0,0 +1,284 @@
+"""End to end benchmark of every slideshow mode against local fixtures, with results saved as JSON
+
+Starts a fake album server (configurable album size, page filler and per request latency) and synthetic fixtures
+(a folder of photos, a url list file), then for each mode runs the real slideshow class in its own process with
+launch() stubbed out, and measures:
+
+- startup: construction until the first slide is ready
+- refresh: the cost of a full refresh (fetch + parse + record) once running, p50 and max over --refreshes
+- connect: N websocket clients opening at once, connect until their first slide arrives, p50/p95/max
+- broadcast latency: leader broadcast until a client received the slide, p50/p95/p99/max. The lead before show_at is
+  pinned, so latency = received - (show_at - lead)
+- cpu seconds the slideshow process spent while broadcasting to the clients, and its RSS (and peak RSS) with them
+
+Nothing leaves localhost. The google_photos mode can't resolve content types without googleusercontent.com, so it runs
+with casting support off, the other modes point at urls whose content type is known from their extension.
+
+Results are written to benchmarks/results/<commit>.json by default, --compare prints the change against an earlier run:
+
+usage: python benchmarks/harness.py [--modes google_photos regex folder urls] [--photos 1000] [--latency 0.05]
+                                    [--clients 100] [--slides 5] [--output results.json] [--compare old.json]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from google_photos_slideshow import FolderSlideshow, GooglePhotosSlideshow, RegexSlideshow, URLListSlideshow
+from google_photos_slideshow.sync import DisplaySync
+
+LEAD = 1.0  # seconds between a broadcast and its show_at
+IMAGE_DURATION = 1.0
+SHUTDOWN_TIMEOUT = 10  # seconds a slideshow may take to close once its task is cancelled
+modes = {
+    'google_photos': GooglePhotosSlideshow,
+    'regex': RegexSlideshow,
+    'folder': FolderSlideshow,
+    'urls': URLListSlideshow,
+}
+
+
+def album_page(photos, filler, google, seed=0):
+    """A page with photos urls in it, like a shared google photos album or a plain html gallery"""
+    rng = random.Random(seed)
+    parts = ["<html><head><title>Bench Album</title></head><body><script>var data = ["]
+    for i in range(photos):
+        parts.append('{"k":"%s","v":%d},' % ("x" * rng.randint(filler // 2, filler * 3 // 2), i))
+        if google:
+            parts.append('"https://lh3.googleusercontent.com/pw/%s",' % "".join(rng.choices("abcdefghijklmnopqrstuvwxyz0123456789_-", k=120)))
+    parts.append("]</script>")
+    if not google:
+        parts.extend(f'<img src="/photos/{i:06d}.jpg">' for i in range(photos))
+    parts.append("</body></html>")
+    return "".join(parts).encode()
+
+
+def album_server(port, photos, filler, latency):
+    async def main():
+        pages = {'google': album_page(photos, filler, True), 'regex': album_page(photos, filler, False)}
+
+        async def page(request):
+            await asyncio.sleep(latency)
+            return web.Response(body=pages[request.match_info['page']], content_type='text/html')
+
+        async def photo(request):
+            await asyncio.sleep(latency)
+            return web.Response(body=b'\xff\xd8\xff\xd9', content_type='image/jpeg')
+
+        app = web.Application()
+        app.router.add_get('/album/{page}', page)
+        app.router.add_get('/photos/{name}', photo)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def fixtures(tmp, photos, album_port):
+    """The first argument of each mode's slideshow, and the options that keep it offline"""
+    folder = Path(tmp) / 'folder'
+    folder.mkdir()
+    for i in range(photos):
+        (folder / f"{i:06d}.jpg").write_bytes(b'\xff\xd8\xff\xd9')
+    urls = Path(tmp) / 'urls.txt'
+    urls.write_text("".join(f"http://127.0.0.1:{album_port}/photos/{i:06d}.jpg\n" for i in range(photos)))
+    return {
+        'google_photos': ([f"http://127.0.0.1:{album_port}/album/google"], {'support_casting': False}),
+        'regex': ([f"http://127.0.0.1:{album_port}/album/regex"], {}),
+        'folder': ([folder], {'variants_cache': ''}),
+        'urls': ([[str(urls)]], {}),
+    }
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def slideshow_server(mode, args, options, port, refreshes, conn):
+    """Run one slideshow and answer the harness' commands"""
+    DisplaySync.min_lead = DisplaySync.max_lead = LEAD
+    cls = modes[mode]
+    cls.launch = lambda self: None  # never open a browser
+
+    async def main():
+        t = time.perf_counter()
+        s = cls(*args, state_path='', port=port, host='127.0.0.1', single_port=True, image_duration=IMAGE_DURATION,
+                refresh_interval=3600, **options)
+        task = asyncio.create_task(s.run_servers())
+        while s._current_slide()[0] is None:
+            if task.done():
+                task.result()
+            await asyncio.sleep(0.005)
+        startup = time.perf_counter() - t
+        durations = []
+        for _ in range(refreshes):
+            t = time.perf_counter()
+            await s._refresh()
+            durations.append(time.perf_counter() - t)
+        conn.send({'startup_s': startup, 'urls': len(s.urls), 'refresh_p50_s': statistics.median(durations),
+                   'refresh_max_s': max(durations)})
+        await asyncio.to_thread(conn.recv)
+        before = cpu()
+        await asyncio.to_thread(conn.recv)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        conn.send({'cpu_s': cpu() - before, 'clients': len(s.clients), 'rss_mb': rss() / 1024 ** 2,
+                   'peak_rss_mb': peak / 1024 ** 2})
+        # run_servers closes the slideshow when cancelled, the process exits once everything has stopped
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+
+
+def websocket_clients(port, n, slides, conn):
+    async def one(session, connects, latencies):
+        t = time.perf_counter()
+        async with session.ws_connect(f"ws://127.0.0.1:{port}/ws") as ws:
+            seen = 0
+            async for msg in ws:
+                data = json.loads(msg.data)
+                if data.get('action') == 'snapshot':
+                    data = data['slide']
+                if 'url' not in data:
+                    continue
+                if t is not None:
+                    connects.append(time.perf_counter() - t)
+                    t = None
+                if data.get('show_at'):
+                    # the first broadcast can overlap with other clients still connecting, skip it
+                    if seen:
+                        latencies.append(time.time() - (data['show_at'] / 1000 - LEAD))
+                    seen += 1
+                    if seen > slides:
+                        return
+
+    async def main():
+        connects, latencies = [], []
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            await asyncio.gather(*[one(session, connects, latencies) for _ in range(n)])
+        conn.send((connects, latencies))
+
+    asyncio.run(main())
+
+
+def percentiles(values, *ps):
+    values = sorted(values)
+    return {f"p{p}": values[min(len(values) - 1, int(len(values) * p / 100))] for p in ps} | {'max': values[-1]}
+
+
+def bench_mode(mode, args, options, port, n_clients, slides, refreshes):
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=slideshow_server, args=(mode, args, options, port, refreshes, child))
+    server.start()
+    result = parent.recv()
+    parent.send('clients')
+    client_parent, client_child = multiprocessing.Pipe()
+    clients = multiprocessing.Process(target=websocket_clients, args=(port, n_clients, slides, client_child))
+    clients.start()
+    connects, latencies = client_parent.recv()
+    clients.join()
+    parent.send('measure')
+    result |= parent.recv()
+    server.join(SHUTDOWN_TIMEOUT)
+    if server.is_alive():
+        server.kill()
+        raise RuntimeError(f"the {mode} slideshow did not shut down within {SHUTDOWN_TIMEOUT}s")
+    result['connect_s'] = percentiles(connects, 50, 95)
+    result['broadcast_latency_s'] = percentiles(latencies, 50, 95, 99)
+    return result
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def flatten(d, prefix=''):
+    for k, v in d.items():
+        if isinstance(v, dict):
+            yield from flatten(v, f"{prefix}{k}.")
+        else:
+            yield f"{prefix}{k}", v
+
+
+def compare(old, new):
+    """Print every number that changed by more than 5% between two result files"""
+    print(f"\n{old['commit']} -> {new['commit']}")
+    for mode, results in new['results'].items():
+        before = dict(flatten(old['results'].get(mode, {})))
+        for key, value in flatten(results):
+            was = before.get(key, None)
+            if isinstance(value, (int, float)) and isinstance(was, (int, float)) and was:
+                change = (value - was) / was
+                if abs(change) > 0.05:
+                    print(f"  {mode:14} {key:28} {was:12.4f} -> {value:12.4f} ({change:+.0%})")
+
+
+def main(selected, photos, filler, latency, n_clients, slides, refreshes, output, previous, port=18500):
+    params = {'photos': photos, 'filler': filler, 'latency_s': latency, 'clients': n_clients, 'slides': slides,
+              'refreshes': refreshes, 'lead_s': LEAD, 'image_duration_s': IMAGE_DURATION}
+    album = multiprocessing.Process(target=album_server, args=(port, photos, filler, latency), daemon=True)
+    album.start()
+    time.sleep(0.5)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        available = fixtures(tmp, photos, port)
+        for i, mode in enumerate(selected):
+            args, options = available[mode]
+            r = results[mode] = bench_mode(mode, args, options, port + 1 + i, n_clients, slides, refreshes)
+            print(f"{mode:14} {r['urls']:6} urls | startup {r['startup_s'] * 1000:7.1f}ms refresh {r['refresh_p50_s'] * 1000:7.1f}ms "
+                  f"| connect p95 {r['connect_s']['p95'] * 1000:6.1f}ms | broadcast p50 "
+                  f"{r['broadcast_latency_s']['p50'] * 1000:5.1f}ms p99 {r['broadcast_latency_s']['p99'] * 1000:5.1f}ms "
+                  f"| cpu {r['cpu_s']:.2f}s rss {r['rss_mb']:.0f}MB")
+    album.kill()
+    run = {'commit': commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': sys.version.split()[0],
+           'platform': platform.platform(), 'cpus': os.cpu_count(), 'params': params, 'results': results}
+    output = Path(output or Path(__file__).parent / 'results' / f"{run['commit']}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(run, indent=2))
+    print(f"results written to {output}")
+    if previous:
+        compare(json.loads(Path(previous).read_text()), run)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="*", choices=list(modes), default=list(modes))
+    parser.add_argument("--photos", type=int, default=1000, help="Photos in each fixture")
+    parser.add_argument("--filler", type=int, default=300, help="Average bytes of other page content per photo")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the fake album server waits per request")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--slides", type=int, default=5)
+    parser.add_argument("--refreshes", type=int, default=5)
+    parser.add_argument("--output", help="Where to write the JSON results (default benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="A previous results file to compare against")
+    args = parser.parse_args()
+    main(args.modes, args.photos, args.filler, args.latency, args.clients, args.slides, args.refreshes, args.output,
+         args.compare)
@@ -0,0 +1,80 @@
+"""A tiny in-memory stand-in for redis, just enough of the protocol (PING, SELECT, GET, SET, PUBLISH, SUBSCRIBE) to
+run RedisBus without a redis server.
+
+usage: python benchmarks/redis_standin.py [--port 6379]
+"""
+import argparse
+import asyncio
+
+
+class RedisStandIn:
+    def __init__(self):
+        self.values = {}
+        self.subscribers = {}  # channel -> set of writers
+
+    @staticmethod
+    def bulk(value):
+        if value is None:
+            return b'$-1\r\n'
+        value = value.encode() if isinstance(value, str) else value
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    async def read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        n = int(line[1:-2])
+        args = []
+        for _ in range(n):
+            size = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    async def handle(self, reader, writer):
+        channels = set()
+        try:
+            while (args := await self.read_command(reader)) is not None:
+                command = args[0].upper()
+                if command == b'PING':
+                    writer.write(b'+PONG\r\n')
+                elif command == b'SELECT':
+                    writer.write(b'+OK\r\n')
+                elif command == b'SET':
+                    self.values[args[1]] = args[2]
+                    writer.write(b'+OK\r\n')
+                elif command == b'GET':
+                    writer.write(self.bulk(self.values.get(args[1], None)))
+                elif command == b'PUBLISH':
+                    receivers = self.subscribers.get(args[1], set())
+                    message = b'*3\r\n' + self.bulk(b'message') + self.bulk(args[1]) + self.bulk(args[2])
+                    for w in receivers:
+                        w.write(message)
+                    writer.write(b':%d\r\n' % len(receivers))
+                elif command == b'SUBSCRIBE':
+                    for i, channel in enumerate(args[1:], 1):
+                        channels.add(channel)
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        writer.write(b'*3\r\n' + self.bulk(b'subscribe') + self.bulk(channel) + b':%d\r\n' % i)
+                else:
+                    writer.write(b'-ERR unknown command\r\n')
+        except ConnectionError:
+            pass
+        finally:
+            for channel in channels:
+                self.subscribers[channel].discard(writer)
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=6379):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def main(port):
+    server = await RedisStandIn().start(port=port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=6379)
+    asyncio.run(main(parser.parse_args().port))
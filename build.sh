@@ -1 +1 @@
-pyinstaller --onefile --add-data "index.html;." google_photos_slideshow.py
+pyinstaller --onefile --add-data "index.html;." --add-data "static;static" google_photos_slideshow.py
@@ -1 +1,9 @@
-from .google_photos_slideshow import main, GooglePhotosSlideshow, RegexSlideshow, FolderSlideshow, URLListSlideshow, Slideshow
\ No newline at end of file
+from .google_photos_slideshow import main, GooglePhotosSlideshow, RegexSlideshow, FolderSlideshow, URLListSlideshow, Slideshow
+
+
+def __getattr__(name):
+    # the host (and what it imports) is only loaded by the programs that run one
+    if name == 'SlideshowHost':
+        from .host import SlideshowHost
+        return SlideshowHost
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
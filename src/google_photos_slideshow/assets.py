@@ -0,0 +1,156 @@
+import argparse
+import gzip
+import hashlib
+import importlib.util
+import mimetypes
+import re
+from pathlib import Path
+
+from aiohttp import web
+
+static_folder = Path(__file__).parent / 'static'
+index_template = Path(__file__).parent / 'index.html'
+compressible = {'.html', '.css', '.js', '.mjs', '.json', '.svg', '.txt', '.xml', '.map'}
+min_compress_size = 256  # bytes, smaller files don't gain enough to be worth a variant
+
+
+def brotli_available():
+    return importlib.util.find_spec("brotli") is not None
+
+
+def compress(body):
+    """The encodings of body worth serving: {content-encoding: bytes}, only those smaller than the original"""
+    variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli_available():
+        import brotli
+        variants['br'] = brotli.compress(body, quality=11)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(body)}
+
+
+def accepted_encodings(header):
+    """The content codings an Accept-Encoding header allows (q > 0)"""
+    accepted = set()
+    for part in header.lower().split(','):
+        name, _, params = part.partition(';')
+        q = re.search(r'q\s*=\s*([\d.]+)', params)
+        try:
+            if q is not None and float(q.group(1)) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip())
+    return accepted
+
+
+class Asset:
+    """A file kept in memory with its precompressed variants, served with an ETag and 304s for unchanged copies"""
+
+    def __init__(self, body, content_type, cache_control, compress_variants=True):
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.hash = hashlib.sha256(body).hexdigest()[:12]
+        self.etag = f'"{self.hash}"'
+        self.variants = compress(body) if compress_variants and len(body) >= min_compress_size else {}
+
+    def response(self, request, cache_control=None):
+        headers = {'ETag': self.etag, 'Cache-Control': cache_control or self.cache_control}
+        if self.variants:
+            headers['Vary'] = 'Accept-Encoding'
+        if any(e.value == self.hash or e.value == '*' for e in request.if_none_match or ()):
+            return web.Response(status=304, headers=headers)
+        body = self.body
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                headers['Content-Encoding'] = encoding
+                body = self.variants[encoding]
+                break
+        response = web.Response(body=body, headers=headers)
+        response.content_type = self.content_type
+        if self.content_type.startswith('text/') or self.content_type.endswith('javascript'):
+            response.charset = 'utf-8'
+        return response
+
+
+class StaticAssets:
+    """The front-end: the files in the static folder under content-hashed urls, and index.html pages linking to them.
+
+    Every file is read and compressed once per process (shared() is the loaded instance), its url has a hash of its
+    content in it, e.g. /assets/slideshow.3f2a1c9e0b4d.css, so browsers can cache it forever and a new version is a
+    new url. index.html is not hashed, browsers revalidate it on each load and get a 304 while it is unchanged.
+    """
+    route = '/assets'
+    max_age = 365 * 24 * 3600
+    favicon_max_age = 24 * 3600
+    _shared = None
+
+    def __init__(self, folder=static_folder, template=index_template):
+        self.assets = {}  # hashed name -> Asset
+        self.urls = {}  # file name -> its hashed url
+        for path in sorted(Path(folder).iterdir()):
+            if not path.is_file() or path.suffix in ('.gz', '.br'):
+                continue
+            content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+            asset = Asset(path.read_bytes(), content_type, f"public, max-age={self.max_age}, immutable",
+                          path.suffix in compressible)
+            name = f"{path.stem}.{asset.hash}{path.suffix}"
+            self.assets[name] = asset
+            self.urls[path.name] = f"{self.route}/{name}"
+        self.template = re.sub(r'\{\{asset:([^}]+)\}\}', lambda m: self.urls[m.group(1)], Path(template).read_text())
+
+    @classmethod
+    def shared(cls):
+        """The package's assets, loaded and compressed on first use"""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def render_index(self, **values):
+        """index.html with its {{name}} placeholders filled in"""
+        html = self.template
+        for name, value in values.items():
+            html = html.replace('{{' + name + '}}', value)
+        return Asset(html.encode(), 'text/html', 'no-cache')
+
+    async def handle(self, request):
+        asset = self.assets.get(request.match_info['name'], None)
+        if asset is None:
+            raise web.HTTPNotFound()
+        return asset.response(request)
+
+    async def serve_favicon(self, request):
+        # browsers ask for /favicon.ico by name, so it can't be cached forever like the hashed url
+        asset = self.assets[self.urls['favicon.ico'].rsplit('/', 1)[-1]]
+        return asset.response(request, f"public, max-age={self.favicon_max_age}")
+
+    def setup_routes(self, app):
+        app.router.add_get(self.route + '/{name}', self.handle)
+        app.router.add_get('/favicon.ico', self.serve_favicon)
+
+
+def precompress(folder):
+    """Write .gz (and .br if brotli is installed) files next to the compressible files in a folder, which the static
+    folder routes serve to browsers that accept them. Returns the number of files written."""
+    written = 0
+    for path in Path(folder).rglob('*'):
+        if not path.is_file() or path.suffix.lower() not in compressible or path.stat().st_size < min_compress_size:
+            continue
+        for encoding, data in compress(path.read_bytes()).items():
+            sidecar = path.with_name(path.name + ('.gz' if encoding == 'gzip' else '.br'))
+            if not sidecar.exists() or sidecar.stat().st_mtime < path.stat().st_mtime:
+                sidecar.write_bytes(data)
+                written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompress the text files of static folders (.gz and .br files)")
+    parser.add_argument("folders", nargs="+")
+    args = parser.parse_args()
+    for folder in args.folders:
+        print(f"{folder}: {precompress(folder)} files written")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+from abc import ABC, abstractmethod
+from urllib.parse import urlparse
+
+logger = logging.getLogger("slideshow")
+
+
+class Bus(ABC):
+    """Publish/subscribe messages (strings) on named channels between a leader and its followers.
+
+    A message published with retain=True is also kept as the channel's current value and delivered first to anyone
+    subscribing later, so a follower that joins late gets the current state right away.
+    """
+
+    @abstractmethod
+    async def publish(self, channel, message, retain=False):
+        pass
+
+    @abstractmethod
+    def subscribe(self, channel):
+        """An async iterator over the channel's messages, starting with its retained message if there is one"""
+
+    async def close(self):
+        pass
+
+
+class InProcessBus(Bus):
+    """A bus between slideshows in the same process, named buses are shared (memory://<name>)"""
+    named = {}
+
+    def __init__(self):
+        self.queues = {}  # channel -> set of subscriber queues
+        self.retained = {}
+
+    @classmethod
+    def get(cls, name):
+        if name not in cls.named:
+            cls.named[name] = cls()
+        return cls.named[name]
+
+    async def publish(self, channel, message, retain=False):
+        if retain:
+            self.retained[channel] = message
+        for queue in self.queues.get(channel, ()):
+            queue.put_nowait(message)
+
+    async def subscribe(self, channel):
+        queue = asyncio.Queue()
+        if channel in self.retained:
+            queue.put_nowait(self.retained[channel])
+        self.queues.setdefault(channel, set()).add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.queues[channel].discard(queue)
+
+
+class UnixSocketHub:
+    """Relays bus frames between the processes connected to a unix socket, keeping the retained messages.
+
+    Frames are lines of json: {"op": "sub", "channel": ...} or {"op": "pub", "channel": ..., "message": ..., "retain": ...}
+    The hub holds an exclusive lock on <path>.lock for as long as it runs, so only one process can be the hub, and a
+    socket file found by the next lock holder was left behind by a hub that died.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.subscribers = {}  # channel -> set of writers
+        self.retained = {}
+        self.server = None
+        self.connections = {}  # writer -> the task handling it
+        self._lock = None
+
+    async def start(self):
+        """Start serving the socket, returns False if another process is the hub (or is becoming it)"""
+        import fcntl  # unix sockets, and so this bus, are posix only
+        lock = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        try:
+            try:
+                os.unlink(self.path)  # left behind by a hub that is gone, it released the lock when it died
+            except FileNotFoundError:
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(self.path)
+            self.server = await asyncio.start_unix_server(self._handle, sock=sock, limit=UnixSocketBus.max_frame)
+        except BaseException:
+            lock.close()
+            raise
+        self._lock = lock
+        return True
+
+    async def _handle(self, reader, writer):
+        channels = set()
+        self.connections[writer] = asyncio.current_task()
+        try:
+            async for line in reader:
+                frame = json.loads(line)
+                channel = frame['channel']
+                if frame['op'] == 'sub':
+                    channels.add(channel)
+                    self.subscribers.setdefault(channel, set()).add(writer)
+                    if channel in self.retained:
+                        writer.write(self.retained[channel])
+                elif frame['op'] == 'pub':
+                    if frame.get('retain', False):
+                        self.retained[channel] = line
+                    for w in self.subscribers.get(channel, ()):
+                        w.write(line)
+        except (ConnectionError, ValueError) as e:
+            logger.debug(f"bus connection closed: {e!r}")
+        finally:
+            for channel in channels:
+                self.subscribers[channel].discard(writer)
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            handlers = list(self.connections.values())
+            for writer in list(self.connections):
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self.server.wait_closed()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+
+class UnixSocketBus(Bus):
+    """A bus between processes on one machine through a unix socket (unix:///path/to/socket).
+
+    A process that finds no hub listening on the socket starts one (UnixSocketHub) in its own event loop. When the
+    connection drops, most likely because the process running the hub exited, the bus reconnects with backoff (one of
+    the remaining processes becomes the hub), subscribes again and publishes its retained messages to the new hub.
+    """
+    max_frame = 2 ** 20
+    reconnect_delay = 0.05  # seconds, doubled after each failed attempt
+    max_reconnect_delay = 5
+
+    def __init__(self, path):
+        self.path = path
+        self.hub = None
+        self.writer = None
+        self.queues = {}  # channel -> set of subscriber queues
+        self.subscribed = set()  # channels subscribed to on the current connection
+        self.retained = {}  # channel -> the last frame this process published with retain
+        self._task = None
+        self._connected = None
+
+    async def _connect(self):
+        """Connect to the hub, starting it first if there is none, returns the reader"""
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path, limit=self.max_frame)
+                return reader
+            except (FileNotFoundError, ConnectionRefusedError):
+                if self.hub is not None:
+                    raise
+                hub = UnixSocketHub(self.path)
+                if not await hub.start():
+                    raise  # another process is starting the hub, try again in a moment
+                self.hub = hub
+                logger.info(f"started bus hub on {self.path}")
+
+    async def _run(self):
+        """Keep a connection to the hub, reconnecting with backoff, and hand incoming messages to the subscribers"""
+        delay = self.reconnect_delay
+        while True:
+            try:
+                reader = await self._connect()
+            except OSError as e:
+                delay = min(delay * 2, self.max_reconnect_delay)
+                logger.debug(f"bus can't connect to {self.path} ({e!r}), retrying")
+                await asyncio.sleep(delay * random.uniform(0.5, 1))
+                continue
+            delay = self.reconnect_delay
+            # before anything else is sent on the new connection
+            self.subscribed = {channel for channel, queues in self.queues.items() if queues}
+            for channel in self.subscribed:
+                self.writer.write(self._frame({'op': 'sub', 'channel': channel}))
+            for frame in self.retained.values():
+                self.writer.write(frame)
+            self._connected.set()
+            try:
+                await self._read(reader)
+            except (ConnectionError, ValueError) as e:
+                logger.debug(f"bus connection error: {e!r}")
+            self._connected.clear()
+            self.writer.close()
+            logger.warning(f"lost the bus connection to {self.path}, reconnecting")
+
+    async def _ensure_connected(self):
+        if self._task is None:
+            self._connected = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        await self._connected.wait()
+
+    async def _read(self, reader):
+        async for line in reader:
+            frame = json.loads(line)
+            for queue in self.queues.get(frame['channel'], ()):
+                queue.put_nowait(frame['message'])
+
+    @staticmethod
+    def _frame(frame):
+        return json.dumps(frame).encode() + b'\n'
+
+    async def _send(self, frame):
+        await self._ensure_connected()
+        self.writer.write(frame)
+        try:
+            await self.writer.drain()
+        except ConnectionError as e:
+            # _run reconnects, what this process retained is sent again then
+            logger.debug(f"bus frame lost: {e!r}")
+
+    async def publish(self, channel, message, retain=False):
+        frame = self._frame({'op': 'pub', 'channel': channel, 'message': message, 'retain': retain})
+        if retain:
+            self.retained[channel] = frame
+        await self._send(frame)
+
+    async def subscribe(self, channel):
+        queue = asyncio.Queue()
+        self.queues.setdefault(channel, set()).add(queue)
+        try:
+            await self._ensure_connected()
+            if channel not in self.subscribed:
+                self.subscribed.add(channel)
+                await self._send(self._frame({'op': 'sub', 'channel': channel}))
+            while True:
+                yield await queue.get()
+        finally:
+            self.queues[channel].discard(queue)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.writer is not None:
+            self.writer.close()
+        if self.hub is not None:
+            await self.hub.close()
+
+
+class RedisBus(Bus):
+    """A bus through a redis server (redis://host:port/db), speaking the redis protocol directly.
+
+    Messages go out with PUBLISH, retained messages are also SET under the channel name so late subscribers can GET
+    them. Each subscription uses its own connection, as redis requires. A dropped connection is opened again: commands
+    are retried once on a new connection, subscriptions reconnect with backoff and read the retained value again.
+    """
+    reconnect_delay = 0.05  # seconds, doubled after each failed attempt
+    max_reconnect_delay = 5
+    connection_errors = (ConnectionError, OSError, asyncio.IncompleteReadError)
+
+    def __init__(self, host='localhost', port=6379, db=0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self._connection = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(*args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    @classmethod
+    async def _reply(cls, reader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RuntimeError(f"redis error: {rest.decode()}")
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            n = int(rest)
+            return None if n < 0 else (await reader.readexactly(n + 2))[:-2].decode()
+        if kind == b'*':
+            n = int(rest)
+            return None if n < 0 else [await cls._reply(reader) for _ in range(n)]
+        raise RuntimeError(f"unexpected redis reply {line!r}")
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.db:
+            writer.write(self._encode('SELECT', self.db))
+            await self._reply(reader)
+        return reader, writer
+
+    async def _command(self, *args):
+        async with self._lock:
+            for attempt in range(2):
+                if self._connection is None:
+                    self._connection = await self._open()
+                reader, writer = self._connection
+                try:
+                    writer.write(self._encode(*args))
+                    return await self._reply(reader)
+                except self.connection_errors:
+                    # the server restarted or the connection was idle for too long, retry once on a new one
+                    writer.close()
+                    self._connection = None
+                    if attempt:
+                        raise
+
+    async def publish(self, channel, message, retain=False):
+        if retain:
+            await self._command('SET', channel, message)
+        await self._command('PUBLISH', channel, message)
+
+    async def subscribe(self, channel):
+        delay = self.reconnect_delay
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._open()
+                writer.write(self._encode('SUBSCRIBE', channel))
+                await self._reply(reader)  # the subscribe confirmation
+                delay = self.reconnect_delay
+                # read the retained value after subscribing, so nothing published in between is missed
+                retained = await self._command('GET', channel)
+                if retained is not None:
+                    yield retained
+                while True:
+                    reply = await self._reply(reader)
+                    if reply[0] == 'message':
+                        yield reply[2]
+            except self.connection_errors as e:
+                if delay == self.reconnect_delay:
+                    logger.warning(f"lost the redis subscription to {channel} ({e!r}), reconnecting")
+                delay = min(delay * 2, self.max_reconnect_delay)
+                await asyncio.sleep(delay * random.uniform(0.5, 1))
+            finally:
+                if writer is not None:
+                    writer.close()
+
+    async def close(self):
+        if self._connection is not None:
+            self._connection[1].close()
+            self._connection = None
+
+
+def open_bus(url):
+    """A bus from a url: memory://<name>, unix:///path/to/socket or redis://host:port/db"""
+    u = urlparse(url)
+    if u.scheme == 'memory':
+        return InProcessBus.get(u.netloc or u.path)
+    if u.scheme == 'unix':
+        return UnixSocketBus(u.path)
+    if u.scheme == 'redis':
+        return RedisBus(u.hostname or 'localhost', u.port or 6379, int(u.path.strip('/') or 0))
+    raise ValueError(f"Unsupported bus url: {url}")
@@ -0,0 +1,124 @@
+import asyncio
+import itertools
+import logging
+import time
+
+import aiohttp
+
+logger = logging.getLogger("slideshow")
+
+
+class Client:
+    """A connected websocket with its own writer task and a small bounded queue of outgoing messages.
+
+    Broadcasting only puts the message in the queue, so a slow screen never holds up the others. Messages sent with a
+    key replace any older queued message with the same key (e.g. a slide that was never delivered is replaced by the
+    newest slide). A client whose send is stuck for longer than send_timeout is closed and dropped.
+    """
+    default_max_queue = 8
+    default_send_timeout = 10
+
+    def __init__(self, websocket, max_queue=default_max_queue, send_timeout=default_send_timeout, on_close=None):
+        self.websocket = websocket
+        self.on_close = on_close
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.pending = {}
+        self.closed = False
+        self.dropped = 0
+        self.size = None  # the variant size this client asked for, None for originals
+        self.load_time = None  # moving average of how long this client takes to load a slide, in seconds
+        self._ids = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+
+    def send(self, message, key=None):
+        """Queue a message for this client without waiting"""
+        if self.closed:
+            return
+        if key is None:
+            key = next(self._ids)
+        else:
+            self.pending.pop(key, None)
+        self.pending[key] = message
+        if len(self.pending) > self.max_queue:
+            # the client is far behind, the oldest message is stale anyway
+            del self.pending[next(iter(self.pending))]
+            self.dropped += 1
+        self._wakeup.set()
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self.pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                key = next(iter(self.pending))
+                message = self.pending.pop(key)
+                await asyncio.wait_for(self.websocket.send(message), self.send_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"dropping client, send stalled for more than {self.send_timeout}s")
+        except Exception as e:
+            logger.debug(f"client writer stopped: {e!r}")
+        finally:
+            self.closed = True
+            self.pending.clear()
+            if self.on_close is not None:
+                self.on_close(self)
+        try:
+            await asyncio.wait_for(self.websocket.close(), 1)
+        except Exception:
+            pass
+
+    async def close(self):
+        self.closed = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class Admission:
+    """Lets new connections through at rate per second, in bursts of up to burst, the others wait their turn.
+
+    Each caller reserves the next free slot before sleeping, so waiters are let through in arrival order and a
+    reconnect storm is spread out instead of all landing on the event loop at once. rate None admits everyone.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def admit(self):
+        if self.rate is None:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class AiohttpWebSocket:
+    """Gives an aiohttp WebSocketResponse the small part of the websockets interface the slideshow uses
+    (send, close and iterating over incoming messages), so both servers share the same connection handling."""
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    async def send(self, message):
+        await self.ws.send_str(message)
+
+    async def close(self):
+        await self.ws.close()
+
+    async def __aiter__(self):
+        async for msg in self.ws:
+            if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                yield msg.data
+            else:
+                break
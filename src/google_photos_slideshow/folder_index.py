@@ -0,0 +1,58 @@
+import os
+from pathlib import Path
+
+
+class FolderIndex:
+    """The media files under a folder, kept up to date by rescanning only the directories whose mtime changed.
+
+    A directory's mtime changes whenever an entry is added, removed or renamed in it, so an unchanged directory can
+    reuse its previous listing and only costs one stat. scan() does blocking filesystem calls, run it in a worker thread.
+    """
+
+    def __init__(self, folder, extensions, recursive=False):
+        self.folder = Path(folder)
+        self.extensions = {e.lower() for e in extensions}
+        self.recursive = recursive
+        self.dirs = {}  # directory -> (mtime_ns, files, subdirectories)
+        self.files = set()  # paths relative to the folder, with / separators
+        self.scans = 0
+
+    def _list(self, path):
+        files, subdirs = set(), []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in self.extensions:
+                    files.add(entry.path)
+                elif self.recursive and entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+        return files, subdirs
+
+    def scan(self):
+        """Bring the index up to date, returns the sets of added and removed files"""
+        self.scans += 1
+        seen = {}
+        stack = [str(self.folder)]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            cached = self.dirs.get(path, None)
+            if cached is not None and cached[0] == mtime:
+                _, files, subdirs = cached
+            else:
+                try:
+                    files, subdirs = self._list(path)
+                except (FileNotFoundError, NotADirectoryError, PermissionError):
+                    continue
+            seen[path] = (mtime, files, subdirs)
+            stack.extend(subdirs)
+        self.dirs = seen
+
+        root = len(str(self.folder)) + 1
+        files = {f[root:].replace(os.sep, '/') for _, fs, _ in seen.values() for f in fs}
+        added = files - self.files
+        removed = self.files - files
+        self.files = files
+        return added, removed
@@ -7,15 +7,27 @@ import signal
 import socket
 import subprocess
 import time
+import types
+import contextlib
+import hashlib
 import logging
-import yaml
+from urllib.parse import quote, unquote
 from abc import ABC, abstractmethod
 from pathlib import Path
 import argparse
 
 import aiohttp
 from aiohttp import web
-import websockets
+
+from .assets import StaticAssets
+from .clients import Admission, AiohttpWebSocket, Client
+from .folder_index import FolderIndex
+from .playlist import Playlist, UrlChanges
+from .scanner import StreamScanner, decoder
+from .sync import DisplaySync, server_time
+from .urlstore import CompactPlaylist, ContentTypes, UrlStore
+# the optional subsystems (bus, metrics, mirror, placeholders, proxy, state, variants) are imported where the option
+# that needs them is turned on, a plain slideshow starts without loading them (or sqlite3)
 
 logger = logging.getLogger("slideshow")
 logger.setLevel(logging.INFO)
@@ -23,8 +35,11 @@ logger.setLevel(logging.INFO)
 default_cfg_path = Path(__file__).parent
 if "Temp" in str(default_cfg_path) or "tmp" in str(default_cfg_path):
     default_cfg_path = Path.home() / ".config" / "google_photos_slideshow"
-default_cfg_path.mkdir(parents=True, exist_ok=True)
+# created when something is first written there, not at import
 default_cfg = default_cfg_path / 'config.yaml'
+default_state = default_cfg_path / 'state.sqlite'
+default_proxy_cache = default_cfg_path / 'proxy_cache'
+default_variants_cache = default_cfg_path / 'variants'
 
 
 # Function to create a popup and get user input
@@ -38,6 +53,23 @@ def tkinput(prompt):
     return user_input
 
 
+content_types_by_extension = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.ogg': 'video/ogg',
+}
+
+
+def guess_content_type(url):
+    """Try to determine the content type from the url's extension, without any network access"""
+    return content_types_by_extension.get(Path(url.lower().split('?')[0]).suffix, None)
+
+
 class Default:
     def __init__(self, value):
         self.value = value
@@ -54,18 +86,57 @@ class Slideshow(ABC):
     default_refresh_interval = 5
     default_host = '0.0.0.0'
     default_websocket_port = 6789
+    default_single_port = False
+    default_bus = None
+    default_role = 'leader'
+    default_metrics = False
+    default_profiling = False
+    max_profile_seconds = 60
+    leader_actions = {'next', 'previous', 'pause', 'play', 'speed'}  # actions a follower passes on to the leader
+    remote_load_ttl = 60  # seconds a follower's reported load time counts towards the lead
+    websocket_route = '/ws'
+    websocket_heartbeat = 10  # seconds between pings, a client that misses a pong is dropped
+    websocket_compression = True  # negotiate permessage-deflate
+    default_connect_rate = None  # new websocket connections admitted per second, None for no limit
+    default_connect_burst = 50  # connections admitted at once before connect_rate applies
     default_port = 80
     default_support_casting = True
     default_static_folder = None
     default_static_route = '/'
     default_static_folders = None
+    static_max_age = 3600  # seconds browsers reuse a file from a static folder before revalidating it
+    default_state_path = default_state
+    persist_state = True
+    default_proxy = False
+    default_proxy_cache = default_proxy_cache
+    default_proxy_cache_size = 1024  # MB
+    default_mirror = None
+    default_mirror_size = 10240  # MB
+    default_mirror_rate = None  # KB/s
+    default_mirror_concurrency = 4
+    refresh_retries = 4
+    refresh_backoff = 0.5  # seconds before the first retry, doubled on each retry
+    quiet_refresh_factor = 1.5  # the refresh interval grows by this factor after each refresh with no changes
+    max_refresh_interval = 60
+    state_retry_after = 600  # seconds before saving the state is tried again after it failed
+    client_queue_size = Client.default_max_queue
+    client_send_timeout = Client.default_send_timeout
+    http_connection_limit = 100
+    http_connections_per_host = 8
+    http_timeout = 30
+    content_type_lookahead = 10  # how many upcoming slides to resolve content types for in the background
+    lookahead = 3  # how many upcoming slides each slide message lists so clients can preload them
+    default_placeholders = True
+    default_fresh_boost = Playlist.default_fresh_boost
+    placeholder_source_size = 64  # pixels, modes that resize photos on the fly fetch them this big for placeholders
+    placeholder_max_bytes = 20 * 1024 ** 2  # photos larger than this get no placeholder
 
     @classmethod
     def arg_parser(cls):
         # use argparse to parse command line arguments
 
         parser = argparse.ArgumentParser(description="Make a live slideshow from a publicly shared google photos album")
-        parser.add_argument("--cfg", help="A config to use as default values for all args", type=str, default=default_cfg)
+        parser.add_argument("--cfg", help="A config to use as default values for all args", type=Path, default=default_cfg)
         parser.add_argument("--title", help="The title of the slideshow", type=str, default=Default(Slideshow.default_title))
         parser.add_argument("--port", type=int, default=Default(Slideshow.default_port), help="The port for the http server")
         parser.add_argument("--image-duration", type=float, default=Default(Slideshow.default_image_duration),
@@ -75,12 +146,49 @@ class Slideshow(ABC):
         parser.add_argument("--host", default=Default(Slideshow.default_host), help="The host to serve the slideshow")
         parser.add_argument("--websocket-port", type=int, default=Default(Slideshow.default_websocket_port),
                             help="The port for the websocket server")
+        parser.add_argument("--single-port", action="store_true", default=Default(Slideshow.default_single_port),
+                            help=f"Serve the websocket on the http port at {Slideshow.websocket_route} instead of a separate server")
+        parser.add_argument("--bus", type=str, default=Default(Slideshow.default_bus),
+                            help="Share one slideshow between processes: unix:///path/to/socket or redis://host:port/db")
+        parser.add_argument("--role", choices=["leader", "follower"], default=Default(Slideshow.default_role),
+                            help="With --bus, the leader runs the playlist and timing, followers only serve screens")
+        parser.add_argument("--metrics", action="store_true", default=Default(Slideshow.default_metrics),
+                            help="Time the hot paths and serve the timings on /metrics for prometheus")
+        parser.add_argument("--profiling", action="store_true", default=Default(Slideshow.default_profiling),
+                            help="Serve a sampled profile of the event loop on /debug/profile?seconds=N")
+        parser.add_argument("--no-placeholders", dest="placeholders", action="store_false",
+                            default=Default(Slideshow.default_placeholders),
+                            help="Don't send screens a tiny preview to show while each photo downloads")
+        parser.add_argument("--fresh-boost", type=float, default=Default(Slideshow.default_fresh_boost),
+                            help="The share of slides given to new uploads until they have all been shown (0 to 1)")
+        parser.add_argument("--connect-rate", type=float, default=Default(Slideshow.default_connect_rate),
+                            help="Admit at most this many new screens per second, off by default. A limit keeps the "
+                                 "slideshow responsive for the screens already showing during a reconnect storm, but "
+                                 "the reconnecting screens get their first slide later")
+        parser.add_argument("--connect-burst", type=int, default=Default(Slideshow.default_connect_burst),
+                            help="With --connect-rate, how many screens are admitted at once before the rate applies")
         parser.add_argument("--static-folder", help="The folder to serve static files from", type=str,
                             default=Default(Slideshow.default_static_folder))
         parser.add_argument("--static-route", help="The route to serve static files from", type=str,
                             default=Default(Slideshow.default_static_route))
         parser.add_argument("--static-folders", nargs="*", help="The folders to serve static files from", type=str,
                             default=Default(Slideshow.default_static_folders))
+        parser.add_argument("--state-path", help="Where to cache the album state for fast restarts ('' to disable)",
+                            type=str, default=Default(Slideshow.default_state_path))
+        parser.add_argument("--proxy", action="store_true", default=Default(Slideshow.default_proxy),
+                            help="Download each photo once and serve it to all screens from a local cache")
+        parser.add_argument("--proxy-cache", type=str, default=Default(Slideshow.default_proxy_cache),
+                            help="The folder to cache proxied photos in")
+        parser.add_argument("--proxy-cache-size", type=int, default=Default(Slideshow.default_proxy_cache_size),
+                            help="The maximum size of the proxy cache in MB")
+        parser.add_argument("--mirror", type=str, default=Default(Slideshow.default_mirror),
+                            help="Download the whole album to this folder and show the copies when the album can't be fetched")
+        parser.add_argument("--mirror-size", type=int, default=Default(Slideshow.default_mirror_size),
+                            help="The maximum size of the mirror in MB")
+        parser.add_argument("--mirror-rate", type=int, default=Default(Slideshow.default_mirror_rate),
+                            help="Limit mirror downloads to this many KB/s")
+        parser.add_argument("--mirror-concurrency", type=int, default=Default(Slideshow.default_mirror_concurrency),
+                            help="How many photos the mirror downloads at once")
 
         parser.add_argument("--info", action="store_true", help="Enable info logging")
         parser.add_argument("--debug", action="store_true", help="Enable debug logging")
@@ -93,6 +201,7 @@ class Slideshow(ABC):
         args = parser.parse_args()
         if args.cfg is not None and args.cfg.exists() and not args.fresh:
             logger.warning(f"Loading config from {args.cfg}")
+            import yaml
             cfg = yaml.safe_load(args.cfg.read_text())
             for k, v in cfg.items():
                 if isinstance(getattr(args, k, Default(None)), Default):
@@ -114,6 +223,8 @@ class Slideshow(ABC):
         a['mode'] = cls.mode
         if cfg is not None:
             logger.debug(f"Saving config to {cfg}")
+            import yaml
+            Path(cfg).parent.mkdir(parents=True, exist_ok=True)
             with open(cfg, 'w') as f:
                 yaml.dump(a, f)
 
@@ -137,22 +248,79 @@ class Slideshow(ABC):
                  static_folder=default_static_folder,
                  static_route = default_static_route,
                  static_folders=default_static_folders,
+                 state_path=default_state_path,
+                 proxy=default_proxy,
+                 proxy_cache=default_proxy_cache,
+                 proxy_cache_size=default_proxy_cache_size,
+                 mirror=default_mirror,
+                 mirror_size=default_mirror_size,
+                 mirror_rate=default_mirror_rate,
+                 mirror_concurrency=default_mirror_concurrency,
+                 single_port=default_single_port,
+                 base_path='',
+                 session=None,
+                 content_types=None,
+                 bus=default_bus,
+                 role=default_role,
+                 metrics=default_metrics,
+                 profiling=default_profiling,
+                 placeholders=default_placeholders,
+                 fresh_boost=default_fresh_boost,
+                 connect_rate=default_connect_rate,
+                 connect_burst=default_connect_burst,
                  **extra
                  ):
         self.source = source
         self.host = host
         self.websocket_port = websocket_port
+        self.single_port = single_port
+        self.base_path = base_path  # the route this slideshow is served under, '' unless it shares a host
         self.port = port
         self.refresh_interval = refresh_interval
-        self.urls = []
+        self.poll_interval = refresh_interval  # the current interval, longer while the album is quiet
+        self.playlist_changes = 0
+        self.playlist = Playlist(fresh_boost=fresh_boost)
         self.last_url = []
-        self.content_types = {}
-        self.current_index = 0
-        self.clients = set()
+        self.content_types = {} if content_types is None else content_types
+        self.neighbours = ()  # on a host, its albums, which share content_types and the proxy with this one
+        self.content_type_futures = {}
+        self._session = session
+        self._owns_session = session is None
+        self._local_ip = None
+        self.clients = {}  # websocket -> Client
         self.paused = False
         self.last_refresh = time.time()
+        self.last_refresh_duration = None
+        self.refresh_task = None
+        self.runner = None  # the aiohttp AppRunner of our own http server, None when a host serves us
+        self._main_task = None
         self.speed = 1
         self.image_duration = image_duration  # Time in seconds for each image
+        self.slide_shown_at = 0  # loop.time() the current slide was (or was due to be) shown
+        self.schedule_changed = asyncio.Event()
+        self.ready = asyncio.Event()  # set when there may be a slide to show, screens that connected early wait on it
+        self.admission = Admission(connect_rate, connect_burst)
+        self._snapshot_state = None  # what the cached snapshots were built from
+        self._snapshots = {}  # variant size -> snapshot message
+        self._index = None  # (websocket target, casting), rendered index.html
+        self.scheduler = None  # a SlideScheduler advancing this slideshow together with others, instead of run()
+        if isinstance(bus, str):
+            from .bus import open_bus
+            bus = open_bus(bus)
+        self.bus = bus
+        self.role = role if self.bus is not None else 'leader'
+        self.remote = {}  # on a follower, the leader's latest state
+        self.remote_loads = {}  # on a leader, follower id -> the slowest load time among its screens
+        self.show_at = None  # server time in ms the current slide is shown at
+        self.bus_tasks = []
+        self.follower_id = hashlib.sha1(f"{socket.gethostname()}:{id(self)}:{time.time()}".encode()).hexdigest()[:12]
+        self._load_reported = None
+        self.sync = DisplaySync()
+        self.metrics = None  # None skips all the timing
+        if metrics:
+            from .metrics import Metrics
+            self.metrics = Metrics(self)
+        self.profiling = profiling
         self.title = title
         self.support_casting = support_casting
 
@@ -161,6 +329,36 @@ class Slideshow(ABC):
         if static_folder:
             self.static_folders[static_route] = static_folder
 
+        self.started_at = time.perf_counter()
+        self.state = None
+        if state_path and self.persist_state:
+            from .state import AlbumState
+            self.state = AlbumState(state_path, self.state_key)
+        self._state_dirty = False
+        self._saved_title = None
+        self._saved_cursor = None
+        self._state_failed_at = None  # time.monotonic() saving the state last failed at
+
+        self.proxy = None
+        if proxy:
+            from .proxy import ImageProxy
+            self.proxy = ImageProxy(proxy_cache, lambda: self.session, proxy_cache_size * 1024 ** 2)
+        self.mirror = None
+        if mirror:
+            from .mirror import AlbumMirror
+            self.mirror = AlbumMirror(mirror, lambda: self.session, mirror_size * 1024 ** 2 if mirror_size else None,
+                                      mirror_rate * 1024 if mirror_rate else None, mirror_concurrency)
+        self.placeholders = None  # None sends no placeholders
+        if placeholders:
+            from .placeholders import Placeholders
+            if Placeholders.available():
+                self.placeholders = Placeholders(self._placeholder_source)
+
+    @property
+    def state_key(self):
+        """Identifies this album in the state cache"""
+        return f"{self.mode}:{self.source}"
+
     @abstractmethod
     async def _fetch_urls(self):
         pass
@@ -169,141 +367,678 @@ class Slideshow(ABC):
     async def _get_content_type(self, url):
         pass
 
+    @property
+    def urls(self):
+        return self.playlist
+
+    @urls.setter
+    def urls(self, urls):
+        self.playlist.replace(urls)
+
+    @property
+    def current_index(self):
+        return self.playlist.cursor
+
+    @current_index.setter
+    def current_index(self, i):
+        self.playlist.cursor = i
+
     async def _record_urls(self, urls):
-        new_urls = [url for url in urls if url not in self.urls]
-        # await asyncio.gather(*(self.load_content_type(url) for url in new_urls))
+        """Make the playlist match the urls from _fetch_urls, either all current urls or UrlChanges.
+
+        None means the source knows nothing changed. Returns whether the playlist changed.
+        """
+        if urls is None:
+            return False
+        if isinstance(self.playlist, CompactPlaylist):
+            # passes over (and copies of) millions of urls, in a worker thread so the slides keep going meanwhile
+            if not isinstance(urls, UrlChanges):
+                urls = await asyncio.to_thread(self.playlist.diff, urls)
+            changes = await asyncio.to_thread(self.playlist.prepare, urls.added, urls.removed)
+            was_empty = not self.playlist
+            new_urls, removed_urls = self.playlist.commit(changes)
+        else:
+            if not isinstance(urls, UrlChanges):
+                urls = self.playlist.diff(urls)
+            was_empty = not self.playlist
+            new_urls, removed_urls = self.playlist.apply(urls.added, urls.removed)
+        if was_empty and self.playlist:
+            self._reschedule()
+            self.ready.set()
         if new_urls:
             logger.info(f"found {len(new_urls)} new urls")
-        removed_urls = [url for url in self.urls if url not in urls]
         if removed_urls:
             logger.info(f"removed {len(removed_urls)} urls")
-        random.shuffle(new_urls)
-
-        # insert new urls at the current index
-        self.urls = self.urls[:self.current_index + 1] + new_urls + self.urls[self.current_index + 1:]
-
-        # pop removed urls, if they already passed, decrement the current index
-        for url in removed_urls:
-            if url in self.urls:
-                if self.current_index > self.urls.index(url):
-                    self.current_index -= 1
-                self.urls.remove(url)
-        self.last_refresh = time.time()
+            for url in removed_urls:
+                if self.placeholders is not None:
+                    self.placeholders.forget(url)
+                if any(url in album.playlist for album in self.neighbours
+                       if album is not self and album.content_types is self.content_types):
+                    continue  # another album still plays it
+                self.content_types.pop(url, None)
+                if self.proxy is not None:
+                    self.proxy.forget(url)
+        if new_urls or removed_urls:
+            self._state_dirty = True
+            self.playlist_changes += 1
+            return True
+        return False
 
     async def _next_url(self):
         """Get the next url in the list of urls"""
-        self.current_index = self.current_index + 1
-
-        # shuffle the urls if we reached the end
-        if self.current_index >= len(self.urls):
-            self.current_index = 0
-            random.shuffle(self.urls)
-        return self.urls[self.current_index]
+        return self._skip_unmirrored(self.playlist.next(), self.playlist.next)
 
     async def _previous_url(self):
         """Get the previous url in the list of urls"""
-        self.current_index = (self.current_index - 1) % len(self.urls)
-        return self.urls[self.current_index]
-
-    async def _send_to_all(self, message):
-        """Send a message to all connected clients"""
-        if self.clients:
-            await asyncio.gather(*(client.send(message) for client in self.clients))
+        return self._skip_unmirrored(self.playlist.previous(), self.playlist.previous)
+
+    def _skip_unmirrored(self, url, step):
+        """While offline screens can only load mirrored photos, step past the others (if any photo is mirrored)"""
+        if self.mirror is None or not self.mirror.offline or not self.mirror.files:
+            return url
+        for _ in range(len(self.playlist)):
+            if self.mirror.has(url):
+                break
+            url = step()
+        return url
+
+    async def _send_to_all(self, message, key=None):
+        """Queue a message for all connected clients, replacing any undelivered message with the same key"""
+        t = time.perf_counter() if self.metrics is not None else 0
+        for client in self.clients.values():
+            client.send(message, key)
+        if self.metrics is not None:
+            self.metrics.broadcast.observe(time.perf_counter() - t)
+        await self._publish_state()
 
     async def _update_clients(self):
         """Send the next url to all connected clients"""
         if self.urls and not self.paused:
             current_url = await self._next_url()
-            await self._send_to_all(await self._url_package(current_url))
-            logger.debug(f"sleeping for {self.image_duration} seconds")
-            await asyncio.sleep(self.image_duration)
+            await self._send_slide(current_url)
 
-    async def _register(self, websocket):
-        """Register a new client to the list of clients"""
-        self.clients.add(websocket)
+    def _current_slide(self):
+        """The url on screen and the urls coming up, (None, []) while there is nothing to show"""
+        if self.role == 'follower':
+            return self.remote.get('url', None), self.remote.get('next', [])
         if not self.urls:
-            print("waiting for urls")
-            i = 0
-            while True:
-                if self.urls:
-                    break
-                await asyncio.sleep(0.1)
-                i += 1
-                if i > 100:
-                    raise TimeoutError("Failed to get urls")
-        current_url = self.urls[self.current_index]
-        await websocket.send(await self._url_package(current_url))
-        await websocket.send(json.dumps({'action': 'speed', 'speed': self.speed}))
-        if self.paused:
-            await websocket.send(json.dumps({'action': 'pause'}))
-        else:
-            await websocket.send(json.dumps({'action': 'play'}))
-        await websocket.send(json.dumps({'action': 'source', 'source': self.source}))
-        await websocket.send(json.dumps({'action': 'title', 'title': self.title}))
+            return None, []
+        return self.playlist.current, self.playlist.upcoming(self.lookahead)
+
+    async def _send_slide(self, url, clients=None):
+        """Send a slide to clients, each getting the variant sized for its display
+
+        A slide broadcast to everyone carries a show_at time so all screens flip together, a slide sent to particular
+        clients (e.g. one that just connected) is shown as soon as it loads.
+        """
+        t = time.perf_counter() if self.metrics is not None else 0
+        packages = {}
+        current, upcoming = self._current_slide()
+        if url != current:
+            upcoming = []
+        show_at = None
+        if clients is None:
+            if self.role == 'leader':
+                now = time.monotonic()
+                remote = [r for r in self.remote_loads.values() if now - r.at < self.remote_load_ttl]
+                self.show_at = self.sync.show_at([*self.clients.values(), *remote])
+            show_at = self.show_at
+        for client in (self.clients.values() if clients is None else clients):
+            if client.size not in packages:
+                packages[client.size] = await self._url_package(url, client.size, upcoming, show_at)
+            client.send(packages[client.size], key='slide')
+        if clients is None:
+            if self.metrics is not None:
+                self.metrics.broadcast.observe(time.perf_counter() - t)
+            await self._publish_state()
+
+    def _reschedule(self, shown_at=None):
+        """Wake the slide scheduler so it recomputes its deadline, optionally restarting the current slide's timer"""
+        if shown_at is not None:
+            self.slide_shown_at = shown_at
+        if self.scheduler is not None:
+            self.scheduler.reschedule(self)
+        self.schedule_changed.set()
+
+    def _deadline(self):
+        """The loop.time() the next slide is due, None while paused or empty"""
+        if self.paused or not self.urls:
+            return None
+        return self.slide_shown_at + self.image_duration
+
+    async def _advance(self, deadline):
+        """Show the next slide, due at deadline"""
+        # if we fell more than a whole slide behind (e.g. a very slow send) start over from now instead of
+        # firing a burst of slides to catch up
+        now = asyncio.get_running_loop().time()
+        if self.metrics is not None and self.slide_shown_at:
+            # the very first deadline counts from 0, not from a slide shown on time
+            self.metrics.lateness.observe(max(0.0, now - deadline))
+        self.slide_shown_at = deadline if now - deadline < self.image_duration else now
+        logger.debug(f"updating clients: {self.current_index}/{len(self.urls)}")
+        await self._update_clients()
+
+    async def _schedule_slides(self):
+        """Advance the slides on deadlines kept on loop.time()
+
+        Each deadline is computed from the previous deadline rather than from when the previous send finished, so slide
+        periods do not drift. Speed, pause, play, next and previous wake the scheduler through schedule_changed, so they
+        take effect immediately instead of after the current slide.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            self.schedule_changed.clear()
+            deadline = self._deadline()
+            if deadline is None:
+                await self.schedule_changed.wait()
+                continue
+            if loop.time() < deadline:
+                timer = loop.call_at(deadline, self.schedule_changed.set)
+                await self.schedule_changed.wait()
+                timer.cancel()
+                if loop.time() < deadline:
+                    # woken by a control event, recompute the deadline
+                    continue
+            await self._advance(deadline)
 
-    async def _url_package(self, url):
+    async def _register(self, websocket):
+        """Register a new client once there is a slide to show, and send it a snapshot of the slideshow"""
+        while self._current_slide()[0] is None:
+            logger.debug("waiting for urls")
+            self.ready.clear()
+            await self.ready.wait()
+        # nothing between joining the broadcasts and queueing the snapshot yields to the loop, so no slide is missed
+        client = Client(websocket, max_queue=self.client_queue_size, send_timeout=self.client_send_timeout,
+                        on_close=lambda c: self.clients.pop(websocket, None))
+        self.clients[websocket] = client
+        client.send(await self._snapshot(client.size), key='snapshot')
+
+    async def _snapshot(self, size=None):
+        """The slide, speed, play/pause state, source and title in one message for a screen that just connected.
+
+        Built once per variant size and reused until any of it changes, so a burst of reconnecting screens costs a
+        tuple comparison each.
+        """
+        url, upcoming = self._current_slide()
+        placeholder = self.placeholders.get(url) if self.placeholders is not None else None
+        offline = self.mirror is not None and self.mirror.offline
+        state = (url, tuple(upcoming), self.content_types.get(url, None), placeholder, offline, self.speed,
+                 self.paused, self.source, self.title)
+        if state != self._snapshot_state:
+            self._snapshot_state = state
+            self._snapshots = {}
+        message = self._snapshots.get(size, None)
+        if message is None:
+            slide = json.loads(await self._url_package(url, size, upcoming))
+            message = self._snapshots[size] = json.dumps({'action': 'snapshot', 'slide': slide, 'speed': self.speed,
+                                                          'paused': self.paused, 'source': self.source,
+                                                          'title': self.title})
+        return message
+
+    def _sized_url(self, url, size):
+        """The url of a variant of url whose longest side is size pixels, modes that can resize photos override this"""
+        return url
+
+    def _client_url(self, url, size=None):
+        """The url a client should load for a playlist url"""
+        if self.mirror is not None and self.mirror.offline:
+            local = self.mirror.url_for(url, self.base_path)
+            if local is not None:
+                return local
+        if size is not None:
+            url = self._sized_url(url, size)
+        if self.proxy is not None:
+            url = self.proxy.url_for(url)
+        return url
+
+    async def _url_package(self, url, size=None, upcoming=(), show_at=None):
+        """Build the slide message for a url without waiting on the network.
+
+        If the content type is not known yet it is resolved in the background and the message goes out without it.
+        size is the variant size the receiving client asked for, None for the original. upcoming are the urls that
+        will be shown next, sent along so the client can preload them. show_at is the server time in ms to show the
+        slide at, None to show it right away. The placeholder, a tiny preview the client shows until the photo has
+        downloaded, is also only included once it has been made in the background.
+        """
         if self.support_casting:
             content_type = self.content_types.get(url, None)
+            if self.metrics is not None:
+                if content_type is None:
+                    self.metrics.content_type_misses += 1
+                else:
+                    self.metrics.content_type_hits += 1
             if content_type is None:
-                content_type = await self._get_content_type(url)
-                self.content_types[url] = content_type
+                self.load_content_type(url)
+                content_type = self.content_types.get(url, None)
+            self._prefetch_content_types()
         else:
             content_type = None
-        return json.dumps({'url': url, 'content-type': content_type})
+        message = {'url': self._client_url(url, size), 'content-type': content_type,
+                   'next': [self._client_url(u, size) for u in upcoming], 'show_at': show_at}
+        if self.placeholders is not None:
+            message['placeholder'] = self.placeholders.get(url)
+            self._prefetch_placeholders(url)
+        return json.dumps(message)
+
+    def load_content_type(self, url):
+        """Resolve the content type of a url in a background task, shared with any other caller asking for the same url"""
+        if url not in self.content_types:
+            content_type = guess_content_type(url)
+            if content_type is not None:
+                self.content_types[url] = content_type
+        if url in self.content_types:
+            # return a future that is already done
+            f = asyncio.get_running_loop().create_future()
+            f.set_result(self.content_types[url])
+            return f
+        task = self.content_type_futures.get(url, None)
+        if task is None:
+            task = asyncio.create_task(self._load_content_type(url))
+            self.content_type_futures[url] = task
+            task.add_done_callback(lambda t: self.content_type_futures.pop(url, None))
+        return task
+
+    async def _load_content_type(self, url):
+        try:
+            content_type = await self._get_content_type(url)
+        except Exception as e:
+            logger.debug(f"Failed to get content type for {url}: {e!r}")
+            return None
+        if content_type is not None:
+            self.content_types[url] = content_type
+            self._state_dirty = True
+        return content_type
+
+    def _prefetch_content_types(self):
+        """Start resolving the content types of the next few slides so they are ready before they are shown"""
+        if not self.support_casting:
+            return
+        for url in self.playlist.upcoming(self.content_type_lookahead):
+            if url not in self.content_types:
+                self.load_content_type(url)
+
+    def _prefetch_placeholders(self, url):
+        """Start making the placeholders of a slide and the next few, so they are ready before they are shown"""
+        self.placeholders.load(url)
+        for u in self.playlist.upcoming(self.lookahead):
+            self.placeholders.load(u)
+
+    async def _placeholder_source(self, url):
+        """The image to make the placeholder of url from: a file path or the image's bytes, None if it is no image.
+
+        Uses the mirror's or the proxy's copy if there is one, otherwise downloads the photo (at placeholder_source_size
+        where the mode can resize photos on the fly) without caching it, up to placeholder_max_bytes. Modes with local
+        files override this.
+        """
+        content_type = self.content_types.get(url, None) or guess_content_type(url)
+        if content_type is not None and not content_type.startswith('image/'):
+            return None
+        if self.mirror is not None and self.mirror.has(url):
+            return str(self.mirror.path(url))
+        source_url = self._sized_url(url, self.placeholder_source_size)
+        if self.proxy is not None:
+            path = self.proxy.cached(source_url) or self.proxy.cached(url)
+            if path is not None:
+                return str(path)
+        async with self.session.get(source_url) as response:
+            response.raise_for_status()
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                body += chunk
+                if len(body) > self.placeholder_max_bytes:
+                    return None
+        return bytes(body)
+
+    @property
+    def session(self):
+        """A long lived, pooled aiohttp session shared by everything that makes http requests"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.http_connection_limit,
+                                             limit_per_host=self.http_connections_per_host)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.http_timeout))
+        return self._session
+
+    async def close(self):
+        """Stop the background tasks, disconnect the screens and shut our http server down"""
+        tasks = [task for task in (self.refresh_task, *self.bus_tasks, *self.content_type_futures.values())
+                 if task is not None]
+        self.refresh_task = None
+        self.bus_tasks = []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*(self._disconnect(client) for client in list(self.clients.values())))
+        self.clients.clear()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        if self.metrics is not None:
+            self.metrics.stop()
+        if self.placeholders is not None:
+            self.placeholders.close()
+        if self.mirror is not None:
+            self.mirror.close()
+        if self.bus is not None:
+            await self.bus.close()
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+
+    @staticmethod
+    async def _disconnect(client):
+        await client.close()
+        try:
+            await asyncio.wait_for(client.websocket.close(), 1)
+        except Exception:
+            pass
 
     async def _unregister(self, websocket):
         """Remove a client from the list of clients"""
-        self.clients.remove(websocket)
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            await client.close()
 
-    async def websocket_handler(self, websocket):
+    async def websocket_handler(self, websocket, admitted=False):
         """Handle incoming websocket connections"""
-        await self._register(websocket)
+        if not admitted:
+            await self.admission.admit()
         try:
+            await self._register(websocket)
             async for message in websocket:
                 data = json.loads(message)
-                if data['action'] == 'next':
-                    logger.info("next")
-                    current_url = await self._next_url()
-                    await self._send_to_all(await self._url_package(current_url))
-                elif data['action'] == 'previous':
-                    logger.info("previous")
-                    current_url = await self._previous_url()
-                    await self._send_to_all(await self._url_package(current_url))
-                elif data['action'] == 'pause':
-                    if not self.paused:
-                        self.paused = True
-                        logger.warning("pause")
-                        await self._send_to_all(json.dumps({'action': 'pause'}))
-                elif data['action'] == 'play':
-                    if self.paused:
-                        self.paused = False
-                        logger.warning("play")
-                        await self._send_to_all(json.dumps({'action': 'play'}))
-                elif data['action'] == 'speed':
-                    if self.speed != float(data['value']):
-                        self.image_duration = 4/float(data['value'])
-                        self.speed = float(data['value'])
-                        logger.warning(f"speed changed to {self.speed} ({self.image_duration}s)")
-                        await self._send_to_all(json.dumps({'action': 'speed', 'speed': self.speed}))
+                if self.role == 'follower' and data['action'] in self.leader_actions:
+                    try:
+                        await self.bus.publish(self._channel('control'), message)
+                    except Exception as e:
+                        logger.warning(f"Failed to pass {data['action']} on to the leader: {e!r}")
+                else:
+                    await self._handle_action(data, websocket)
         finally:
             await self._unregister(websocket)
         await asyncio.sleep(0.1)
 
+    async def _handle_action(self, data, websocket=None):
+        """Act on a message from a screen, or on one a follower passed on (websocket is None then)"""
+        if data['action'] == 'next':
+            logger.info("next")
+            current_url = await self._next_url()
+            self._reschedule(shown_at=asyncio.get_running_loop().time())
+            await self._send_slide(current_url)
+        elif data['action'] == 'previous':
+            logger.info("previous")
+            current_url = await self._previous_url()
+            self._reschedule(shown_at=asyncio.get_running_loop().time())
+            await self._send_slide(current_url)
+        elif data['action'] == 'pause':
+            if not self.paused:
+                self.paused = True
+                self._reschedule()
+                logger.warning("pause")
+                await self._send_to_all(json.dumps({'action': 'pause'}), key='play')
+        elif data['action'] == 'play':
+            if self.paused:
+                self.paused = False
+                # advance right away, like the old polling loop did
+                self._reschedule(shown_at=asyncio.get_running_loop().time() - self.image_duration)
+                logger.warning("play")
+                await self._send_to_all(json.dumps({'action': 'play'}), key='play')
+        elif data['action'] == 'viewport':
+            # the client reports its screen so it can be sent right-sized photos
+            v = data['value']
+            client = self.clients.get(websocket, None)
+            from .variants import variant_size
+            size = variant_size(float(v['width']), float(v['height']), float(v.get('dpr', 1)))
+            if client is not None and client.size != size:
+                client.size = size
+                current_url = self._current_slide()[0]
+                if current_url is not None:
+                    await self._send_slide(current_url, [client])
+        elif data['action'] == 'sync':
+            # clock sync handshake: echo the client's send time with ours, the client works out the offset
+            client = self.clients.get(websocket, None)
+            if client is not None:
+                client.send(json.dumps({'action': 'sync', 'client': data['value'], 'server': server_time()}))
+        elif data['action'] == 'shown':
+            client = self.clients.get(websocket, None)
+            if client is not None:
+                self.sync.report(client, data['value'])
+                if self.role == 'follower' and data['value'].get('show_at', None) != self._load_reported:
+                    # once per slide, tell the leader how slow our slowest screen is so it can set the lead
+                    self._load_reported = data['value'].get('show_at', None)
+                    load = max((c.load_time for c in self.clients.values() if c.load_time is not None), default=None)
+                    await self.bus.publish(self._channel('control'), json.dumps(
+                        {'action': 'load', 'value': {'follower': self.follower_id, 'load': load}}))
+        elif data['action'] == 'load':
+            v = data['value']
+            if v['load'] is None:
+                self.remote_loads.pop(v['follower'], None)
+            else:
+                self.remote_loads[v['follower']] = types.SimpleNamespace(load_time=v['load'], at=time.monotonic())
+        elif data['action'] == 'speed':
+            if self.speed != float(data['value']):
+                self.image_duration = 4/float(data['value'])
+                self.speed = float(data['value'])
+                self._reschedule()
+                logger.warning(f"speed changed to {self.speed} ({self.image_duration}s)")
+                await self._send_to_all(json.dumps({'action': 'speed', 'speed': self.speed}), key='speed')
+
+    async def websocket_route_handler(self, request):
+        """Handle a websocket connection on the http server, the same way as the standalone websocket server"""
+        # admitted before the handshake, so a reconnect storm doesn't do all its handshakes at once either
+        await self.admission.admit()
+        ws = web.WebSocketResponse(heartbeat=self.websocket_heartbeat, compress=self.websocket_compression)
+        await ws.prepare(request)
+        await self.websocket_handler(AiohttpWebSocket(ws), admitted=True)
+        return ws
+
+    def _channel(self, name):
+        return f"slideshow:{self.state_key}:{name}"
+
+    def _state_message(self):
+        """Everything a follower needs to serve screens exactly like the leader does"""
+        url, upcoming = self._current_slide()
+        content_types = {u: self.content_types[u] for u in [url, *upcoming] if u in self.content_types}
+        return json.dumps({'url': url, 'next': upcoming, 'show_at': self.show_at, 'speed': self.speed,
+                           'paused': self.paused, 'title': self.title, 'source': self.source,
+                           'content_types': content_types})
+
+    async def _publish_state(self):
+        """On a leader with a bus, publish the current state, retained so followers that join later get it at once"""
+        if self.bus is None or self.role != 'leader':
+            return
+        try:
+            await self.bus.publish(self._channel('state'), self._state_message(), retain=True)
+        except Exception as e:
+            logger.warning(f"Failed to publish state: {e!r}")
+
+    async def _lead(self):
+        """On a leader, act on the controls the followers pass on from their screens"""
+        async for message in self.bus.subscribe(self._channel('control')):
+            try:
+                await self._handle_action(json.loads(message))
+            except Exception as e:
+                logger.warning(f"Bad control message {message!r}: {e!r}")
+
+    async def _follow(self):
+        """On a follower, mirror the leader's state to our screens"""
+        async for message in self.bus.subscribe(self._channel('state')):
+            try:
+                await self._apply_state(json.loads(message))
+            except Exception as e:
+                logger.warning(f"Bad state message {message!r}: {e!r}")
+
+    async def _apply_state(self, state):
+        """Show a state the leader published"""
+        if not isinstance(state, dict):
+            raise ValueError("a state is a json object")
+        previous, self.remote = self.remote, state
+        self.ready.set()
+        self.content_types.update(state['content_types'])
+        self.show_at = state['show_at']
+        if state['url'] is not None and (state['url'], state['show_at']) != (previous.get('url', None),
+                                                                              previous.get('show_at', None)):
+            await self._send_slide(state['url'])
+        if state['speed'] != self.speed:
+            self.speed = state['speed']
+            self.image_duration = 4 / self.speed
+            await self._send_to_all(json.dumps({'action': 'speed', 'speed': self.speed}), key='speed')
+        if state['paused'] != self.paused:
+            self.paused = state['paused']
+            await self._send_to_all(json.dumps({'action': 'pause' if self.paused else 'play'}), key='play')
+        if state['title'] != self.title:
+            self.title = state['title']
+            await self._send_to_all(json.dumps({'action': 'title', 'title': self.title}), key='title')
+        if state['source'] != self.source:
+            self.source = state['source']
+            await self._send_to_all(json.dumps({'action': 'source', 'source': self.source}), key='source')
+
+    async def _refresh(self):
+        """Fetch the urls and hand the finished snapshot to the playlist, retrying with exponential backoff"""
+        changes = self.playlist_changes
+        for attempt in range(self.refresh_retries + 1):
+            t0 = time.perf_counter()
+            parse_seconds = getattr(self, 'parse_seconds', None)
+            try:
+                urls = await self._fetch_urls()
+            except Exception as e:
+                if attempt == self.refresh_retries:
+                    logger.warning(f"Failed to fetch urls after {attempt + 1} attempts: {e!r}")
+                    if self.mirror is not None and not self.mirror.offline:
+                        logger.warning(f"showing the {len(self.mirror.files)} mirrored photos until the album is back")
+                        self.mirror.offline = True
+                    break
+                delay = min(self.refresh_backoff * 2 ** attempt, self.refresh_interval)
+                delay *= random.uniform(0.5, 1)
+                logger.warning(f"Failed to fetch urls ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            t1 = time.perf_counter()
+            # the playlist takes the whole change in one step, so clients never see a half applied refresh
+            await self._record_urls(urls)
+            # sources may publish some urls while still fetching, so count every change since the refresh started
+            changed = self.playlist_changes != changes
+            self._prefetch_content_types()
+            if self.mirror is not None:
+                if self.mirror.offline:
+                    logger.warning("the album is back, showing it again")
+                self.mirror.offline = False
+                self.mirror.sync(self.playlist)
+            t2 = time.perf_counter()
+            self.last_refresh_duration = t2 - t0
+            if self.metrics is not None:
+                self.metrics.fetch.observe(t1 - t0)
+                self.metrics.record.observe(t2 - t1)
+                if parse_seconds is not None:
+                    self.metrics.parse.observe(self.parse_seconds - parse_seconds)
+            if changed:
+                self.poll_interval = self.refresh_interval
+            else:
+                self.poll_interval = min(self.poll_interval * self.quiet_refresh_factor,
+                                         max(self.max_refresh_interval, self.refresh_interval))
+            (logger.info if changed else logger.debug)(
+                f"refreshed {len(self.urls)} urls in {t2 - t0:.3f}s (fetch {t1 - t0:.3f}s, record {t2 - t1:.3f}s), "
+                f"next refresh in {self.poll_interval:.1f}s")
+            break
+        self.last_refresh = time.time()
+
+    async def _refresh_loop(self):
+        """Refresh the urls every poll_interval, independently of the slide loop"""
+        while True:
+            await asyncio.sleep(max(0, self.poll_interval - (time.time() - self.last_refresh)))
+            try:
+                await self._refresh()
+            except Exception:
+                logger.exception("refresh failed")
+                self.last_refresh = time.time()
+            await self._save_state()
+
+    async def _load_state(self):
+        """Restore the playlist from the state cache, returns whether anything was restored"""
+        if self.state is None:
+            return False
+        try:
+            await asyncio.to_thread(self.state.evict)
+            saved = await asyncio.to_thread(self.state.load)
+        except Exception as e:
+            logger.warning(f"Failed to load state from {self.state.path}: {e!r}")
+            return False
+        if not saved or not saved[1]:
+            return False
+        title, urls, cursor, content_types = saved
+        self.playlist.replace(urls)
+        self.current_index = cursor if 0 <= cursor < len(self.playlist) else 0
+        self.ready.set()
+        self.content_types.update(content_types)
+        if title:
+            self.title = title
+        self._saved_title = title
+        self._saved_cursor = self.current_index
+        return True
+
+    async def _save_state(self):
+        """Write the playlist to the state cache if it changed, the cursor otherwise"""
+        if self.state is None or not self.playlist:
+            return
+        if self._state_failed_at is not None and time.monotonic() - self._state_failed_at < self.state_retry_after:
+            return
+        try:
+            if self._state_dirty or self.title != self._saved_title:
+                self._state_dirty = False
+                # snapshot on the event loop, write in a thread. Only this album's content types: in a host the
+                # dict is shared by every album
+                urls = list(self.playlist)
+                types = self.content_types
+                snapshot = (self.title, urls, self.current_index, {url: types[url] for url in urls if url in types})
+                await asyncio.to_thread(self.state.save, *snapshot)
+                self._saved_title = self.title
+            elif self.current_index != self._saved_cursor:
+                await asyncio.to_thread(self.state.save_cursor, self.current_index)
+            self._saved_cursor = self.current_index
+        except Exception as e:
+            # an unwritable path fails on every refresh, warn once and try again every state_retry_after
+            if self._state_failed_at is None:
+                logger.warning(f"Failed to save state to {self.state.path}, trying again every "
+                               f"{self.state_retry_after}s: {e!r}")
+            else:
+                logger.debug(f"Failed to save state to {self.state.path}: {e!r}")
+            self._state_failed_at = time.monotonic()
+            self._state_dirty = True
+            return
+        if self._state_failed_at is not None:
+            logger.info(f"Saving state to {self.state.path} again")
+            self._state_failed_at = None
+
+    async def start(self):
+        """Load the playlist, from the state cache if possible, and keep refreshing it in the background"""
+        if self.metrics is not None:
+            self.metrics.start()
+        if await self._load_state():
+            # serve the cached playlist right away and reconcile with the live album in the background
+            logger.info(f"restored {len(self.urls)} urls from {self.state.path}")
+            self.last_refresh = 0
+            if self.mirror is not None:
+                # resume mirroring right away, the album may not be reachable
+                self.mirror.sync(self.playlist)
+        else:
+            await self._refresh()
+        logger.info(f"first slide ready {time.perf_counter() - self.started_at:.3f}s after startup")
+        await self._save_state()
+        self.refresh_task = asyncio.create_task(self._refresh_loop())
+
     async def run(self):
-        urls = await self._fetch_urls()
-        await self._record_urls(urls)
+        if self.role == 'follower':
+            # the leader owns the playlist and the timing, we only pass its state on to our screens
+            if self.metrics is not None:
+                self.metrics.start()
+            self.launch()
+            await self._follow()
+            return
+        await self.start()
+        if self.bus is not None:
+            await self._publish_state()
+            self.bus_tasks.append(asyncio.create_task(self._lead()))
         self.launch()
-        while True:
-            logger.debug(f"updating clients: {self.current_index}/{len(self.urls)}")
-            await self._update_clients()
-            # sleep
-            await asyncio.sleep(0.1)
-            if (time.time() - self.last_refresh) > self.refresh_interval:
-                try:
-                    urls = await self._fetch_urls()
-                    await self._record_urls(urls)
-                except:
-                    logger.warning(f"Failed to fetch urls")
+        await self._schedule_slides()
 
     def launch(self):
         p = platform.platform()
@@ -318,37 +1053,99 @@ class Slideshow(ABC):
             return
         subprocess.Popen(cmd, shell=True)
 
+    @property
+    def websocket_target(self):
+        """Where index.html connects its websocket: a path on this server, or another port on the same host"""
+        return self.base_path + self.websocket_route if self.single_port else f":{self.websocket_port}/"
+
     async def serve_index(self, request):
-        """Serve the index.html file."""
-        index_path = Path(__file__).parent / 'index.html'
-        return web.FileResponse(index_path)
+        """Serve index.html, rendered once for this slideshow and compressed, a 304 when the browser has it already"""
+        key = (self.websocket_target, self.support_casting)
+        if self._index is None or self._index[0] != key:
+            html = StaticAssets.shared().render_index(websocket=self.websocket_target,
+                                                      casting='true' if self.support_casting else 'false')
+            self._index = (key, html)
+        return self._index[1].response(request)
+
+    async def serve_static(self, request):
+        """Serve match_info['path'] from the static folders.
+
+        aiohttp's FileResponse answers If-None-Match / If-Modified-Since with a 304 and sends a file's .br or .gz
+        sibling (written by slideshow-precompress) to browsers that accept it.
+        """
+        path = '/' + request.match_info['path']
+        for route, folder in sorted(self.static_folders.items(), key=lambda kv: -len(kv[0])):
+            prefix = route.rstrip('/') + '/'
+            if path.startswith(prefix):
+                root = Path(folder).resolve()
+                file = (root / path[len(prefix):]).resolve()
+                if file.is_relative_to(root) and file.is_file():
+                    return web.FileResponse(file, headers={'Cache-Control': f"public, max-age={self.static_max_age}",
+                                                           'Vary': 'Accept-Encoding'})
+        raise web.HTTPNotFound()
+
+    async def serve_metrics(self, request):
+        """The timings and gauges in the prometheus text format"""
+        if self.metrics is None:
+            raise web.HTTPNotFound()
+        return web.Response(text=self.metrics.render(), content_type='text/plain', charset='utf-8',
+                            headers={'Cache-Control': 'no-store'})
+
+    async def serve_profile(self, request):
+        """Sample the event loop for ?seconds=N (default 5) and return the collapsed stacks, for flame graph tools"""
+        if not self.profiling:
+            raise web.HTTPNotFound()
+        try:
+            seconds = min(float(request.query.get('seconds', 5)), self.max_profile_seconds)
+        except ValueError:
+            raise web.HTTPBadRequest(text="seconds must be a number")
+        from .metrics import profile_event_loop
+        return web.Response(text=await profile_event_loop(seconds), content_type='text/plain')
 
     def setup_routes(self, app):
         app.router.add_get('/', self.serve_index)
-        # serve static folders
-        for k, v in self.static_folders.items():
-            app.router.add_static(k, v)
+        StaticAssets.shared().setup_routes(app)
+        if self.single_port:
+            app.router.add_get(self.websocket_route, self.websocket_route_handler)
+        if self.metrics is not None:
+            app.router.add_get('/metrics', self.serve_metrics)
+        if self.profiling:
+            app.router.add_get('/debug/profile', self.serve_profile)
+        if self.proxy is not None:
+            self.proxy.setup_routes(app)
+        if self.mirror is not None:
+            self.mirror.setup_routes(app)
+        # serve static folders, last as it matches every path
+        if self.static_folders:
+            app.router.add_get('/{path:.+}', self.serve_static)
 
     @property
     def server_url(self):
         p = f":{self.port}" if self.port != 80 else ""
         return f"http://{self.host}{p}"
 
+    @staticmethod
+    def local_ip():
+        return socket.gethostbyname(socket.gethostname())
+
     @property
     def server_ip_url(self):
-        local_ip = socket.gethostbyname(socket.gethostname())
+        # resolving the hostname blocks, so it is done once and refreshed by modes that depend on it
+        if self._local_ip is None:
+            self._local_ip = self.local_ip()
         p = f":{self.port}" if self.port != 80 else ""
-        return f"http://{local_ip}{p}"
+        return f"http://{self._local_ip}{p}"
 
     async def start_http_server(self):
         """Start the aiohttp server to serve the index.html."""
         app = web.Application()
         self.setup_routes(app)
-        runner = web.AppRunner(app)
+        self.runner = runner = web.AppRunner(app)
         await runner.setup()
         site = web.TCPSite(runner, self.host, self.port)
         print(f"Starting the slideshow...")
         await site.start()
+        logger.info(f"serving http {time.perf_counter() - self.started_at:.3f}s after startup")
 
         s = self.server_url.replace("0.0.0.0", "localhost")
         logger.warning(f"Open your browser and go to {s} if you are on this computer")
@@ -358,28 +1155,46 @@ class Slideshow(ABC):
         logger.warning(f"Ctrl + C to stop the server (or close the terminal)")
 
     async def run_servers(self):
-        # Start WebSocket server
-        async with websockets.serve(self.websocket_handler, self.host, self.websocket_port):
-            # Also start aiohttp and slideshow tasks
-            await asyncio.gather(
-                self.start_http_server(),
-                self.run(),
-            )
+        async with contextlib.AsyncExitStack() as stack:
+            if not self.single_port:
+                # Start WebSocket server
+                import websockets
+                await stack.enter_async_context(websockets.serve(
+                    self.websocket_handler, self.host, self.websocket_port,
+                    compression='deflate' if self.websocket_compression else None,
+                    ping_interval=self.websocket_heartbeat, ping_timeout=self.websocket_heartbeat))
+            # serve index.html before the first fetch, screens connect and wait for the first slide
+            try:
+                await self.start_http_server()
+                await self.run()
+            finally:
+                await self.close()
 
     def serve(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._main_task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
         # attach cleanup handler for graceful shutdown on Ctrl+C
-        signal.signal(signal.SIGINT, lambda s, f: self.cleanup())
-        signal.signal(signal.SIGTERM, lambda s, f: self.cleanup())
-        asyncio.run(self.run_servers())
+        signal.signal(signal.SIGINT, lambda s, f: loop.call_soon_threadsafe(self.cleanup))
+        signal.signal(signal.SIGTERM, lambda s, f: loop.call_soon_threadsafe(self.cleanup))
+        try:
+            await self.run_servers()
+        except asyncio.CancelledError:
+            pass
 
     def cleanup(self):
-        """Cleanup the servers"""
+        """Cleanup the servers: cancelling the main task runs close(), which stops everything else"""
         logger.warning("Cleaning up servers")
-        asyncio.get_event_loop().stop()
+        if self._main_task is not None:
+            self._main_task.cancel()
 
 
 class URLListSlideshow(Slideshow):
     mode = "urls"
+    persist_state = False  # the configured list is the source of truth
+    compact_threshold = 100_000  # lists at least this long are kept in a UrlStore rather than one str per url
     def __init__(self,
                  urls,
                  title=Slideshow.default_title,
@@ -394,21 +1209,36 @@ class URLListSlideshow(Slideshow):
                  static_folders=Slideshow.default_static_folders,
                  **extra
                  ):
-        if isinstance(urls, str) and Path(urls).exists():
-            urls = Path(urls).read_text().splitlines()
-            urls = [v.strip() for v in urls]
-        super().__init__(title=title, image_duration=image_duration, refresh_interval=refresh_interval,
+        if isinstance(urls, list) and len(urls) == 1 and Path(urls[0]).is_file():
+            urls = urls[0]  # --urls path/to/file
+        self.urls_file = None
+        if isinstance(urls, (str, Path)) and Path(urls).exists():
+            # loaded by the first refresh, in a worker thread
+            self.urls_file = Path(urls)
+            urls = []
+        super().__init__(source='', title=title, image_duration=image_duration, refresh_interval=refresh_interval,
                          host=host, websocket_port=websocket_port, port=port,
                          support_casting=support_casting,
                          static_folder=static_folder,
                          static_route=static_route,
-                         static_folders=static_folders)
-        if isinstance(urls, dict):
+                         static_folders=static_folders,
+                         **extra)
+        if len(urls) >= self.compact_threshold:
+            self._use_store(UrlStore.from_urls(list(urls), urls if isinstance(urls, dict) else None,
+                                               content_types_by_extension))
+        elif isinstance(urls, dict):
             self.urls = list(urls.keys())
-            self.content_types = urls
+            self.content_types.update(urls)
         else:
             self.urls = urls
-            self.content_types = {}
+
+    def _use_store(self, store):
+        """Play the urls of a UrlStore, compactly if there are many of them"""
+        if len(store) >= self.compact_threshold:
+            self.playlist = CompactPlaylist(store)
+            self.content_types = ContentTypes(store)
+        else:
+            self.urls = list(store)
 
     @classmethod
     def arg_parser(cls):
@@ -427,32 +1257,23 @@ class URLListSlideshow(Slideshow):
         s.serve()
 
     async def _fetch_urls(self):
-        pass
+        if self.urls_file is not None:
+            store = await asyncio.to_thread(UrlStore.from_file, self.urls_file, content_types_by_extension)
+            self.urls_file = None
+            self._use_store(store)
+            self.playlist_changes += 1
+            self._reschedule()
+            self.ready.set()
 
     async def _get_content_type(self, url):
-        # try to determine the content type from the url
-        url = url.lower()
-        if url.endswith('.jpg') or url.endswith('.jpeg'):
-            return 'image/jpeg'
-        elif url.endswith('.png'):
-            return 'image/png'
-        elif url.endswith('.gif'):
-            return 'image/gif'
-        elif url.endswith('.webp'):
-            return 'image/webp'
-        elif url.endswith('.mp4'):
-            return 'video/mp4'
-        elif url.endswith('.webm'):
-            return 'video/webm'
-        elif url.endswith('.ogg'):
-            return 'video/ogg'
-        else:
-            return None
+        return guess_content_type(url)
 
 
 class FolderSlideshow(Slideshow):
     mode = "folder"
     default_folder = Path.cwd()
+    default_recursive = False
+    default_variants_cache_size = 1024  # MB
 
     def __init__(self,
                  folder=default_folder,
@@ -464,10 +1285,19 @@ class FolderSlideshow(Slideshow):
                  port=Slideshow.default_port,
                  support_casting=Slideshow.default_support_casting,
                  static_folders=Slideshow.default_static_folders,
+                 variants_cache=default_variants_cache,
+                 variants_cache_size=default_variants_cache_size,
+                 recursive=default_recursive,
                  **extra):
         self.folder = Path(folder)
         if not self.folder.exists():
             raise FileNotFoundError(f"{self.folder} does not exist")
+        self.index = FolderIndex(self.folder, content_types_by_extension, recursive=recursive)
+        self.variants = None
+        if variants_cache:
+            from .variants import ImageVariants
+            if ImageVariants.available():
+                self.variants = ImageVariants(self.folder, variants_cache, variants_cache_size * 1024 ** 2)
         if title is None:
             title = self.folder.name
         super().__init__(source=f"http://{host}:{port}/" if port != 80 else f"http://{host}/",
@@ -476,40 +1306,71 @@ class FolderSlideshow(Slideshow):
                          support_casting=support_casting,
                          static_folder=folder,
                          static_route='/',
-                         static_folders=static_folders)
+                         static_folders=static_folders,
+                         **extra)
+    @property
+    def state_key(self):
+        return f"{self.mode}:{self.folder.resolve()}"
+
+    def _sized_url(self, url, size):
+        prefix = f"{self.server_ip_url}{self.base_path}/"
+        if self.variants is None or not url.startswith(prefix):
+            return url
+        name = url[len(prefix):]
+        if Path(name).suffix.lower() not in self.variants.resizable:
+            return url
+        return prefix + self.variants.url_for(name, size).lstrip('/')
+
+    async def _placeholder_source(self, url):
+        # straight from the photo on disk
+        prefix = f"{self.server_ip_url}{self.base_path}/"
+        if not url.startswith(prefix):
+            return None
+        from .variants import ImageVariants
+        path = self.folder / unquote(url[len(prefix):])
+        return str(path) if path.suffix.lower() in ImageVariants.resizable else None
+
+    def setup_routes(self, app):
+        # before the static folder route, which matches every path
+        if self.variants is not None:
+            self.variants.setup_routes(app)
+        super().setup_routes(app)
+
+    async def close(self):
+        await super().close()
+        if self.variants is not None:
+            self.variants.close()
+
     @classmethod
     def arg_parser(cls):
         parser = Slideshow.arg_parser()
         parser.add_argument("--folder", help="The folder to display", type=str, default=Default(FolderSlideshow.default_folder))
+        parser.add_argument("--variants-cache", type=str, default=Default(default_variants_cache),
+                            help="The folder to cache resized photos in ('' to always serve the originals)")
+        parser.add_argument("--variants-cache-size", type=int,
+                            default=Default(FolderSlideshow.default_variants_cache_size),
+                            help="The maximum size of the resized photos cache in MB")
+        parser.add_argument("--recursive", action="store_true", default=Default(FolderSlideshow.default_recursive),
+                            help="Include photos in subfolders")
         return parser
 
+    def _file_url(self, name):
+        return f"{self.server_ip_url}{self.base_path}/{quote(name)}"
+
     async def _fetch_urls(self):
-        """Fetch urls from the folder and store them in self.urls"""
-        paths = list(self.folder.glob('*'))
-        paths = [v for v in paths if v.is_file() and v.suffix.lower() in [".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp4", ".webm", ".ogg"]]
-        urls = [f"{self.server_ip_url}/{p.name}" for p in paths]
-        print(f"{urls=}")
-        return urls
+        """Rescan the folder in a worker thread and return what changed since the last scan"""
+        local_ip = await asyncio.to_thread(self.local_ip)
+        first_scan = self.index.scans == 0
+        added, removed = await asyncio.to_thread(self.index.scan)
+        if first_scan or local_ip != self._local_ip:
+            # every url changes with the host, and the first scan has to reconcile with any restored state
+            self._local_ip = local_ip
+            return [self._file_url(name) for name in self.index.files]
+        logger.debug(f"folder scan: {len(added)} added, {len(removed)} removed, {len(self.index.files)} files")
+        return UrlChanges([self._file_url(name) for name in added], [self._file_url(name) for name in removed])
 
     async def _get_content_type(self, url):
-        # try to determine the content type from the url
-        url = url.lower()
-        if url.endswith('.jpg') or url.endswith('.jpeg'):
-            return 'image/jpeg'
-        elif url.endswith('.png'):
-            return 'image/png'
-        elif url.endswith('.gif'):
-            return 'image/gif'
-        elif url.endswith('.webp'):
-            return 'image/webp'
-        elif url.endswith('.mp4'):
-            return 'video/mp4'
-        elif url.endswith('.webm'):
-            return 'video/webm'
-        elif url.endswith('.ogg'):
-            return 'video/ogg'
-        else:
-            return None
+        return guess_content_type(url)
 
 
 class RegexSlideshow(Slideshow):
@@ -517,6 +1378,7 @@ class RegexSlideshow(Slideshow):
     default_parse_title = True
     default_title_regex = r'<title>([^<]+)</title>'
     default_image_regex = f'<img src="([^"]+)"'
+    stream_chunk_size = 64 * 1024
 
     def __init__(self, url, regex=default_image_regex,
                  title=Slideshow.default_title,
@@ -537,13 +1399,21 @@ class RegexSlideshow(Slideshow):
         self.regex = regex
         self.parse_title = parse_title
         self.title_regex = title_regex
-        self.content_type_futures = {}
+        # validators from the last response, so unchanged pages can be skipped
+        self.etag = None
+        self.last_modified = None
+        self.body_hash = None
+        self.fetches = 0
+        self.unchanged_fetches = 0
+        self.bytes_fetched = 0
+        self.parse_seconds = 0.0
         super().__init__(source=url, title=title, image_duration=image_duration, refresh_interval=refresh_interval,
                          host=host, websocket_port=websocket_port, port=port,
                          support_casting=support_casting,
                          static_folder=static_folder,
                          static_route=static_route,
-                         static_folders=static_folders)
+                         static_folders=static_folders,
+                         **extra)
 
     @classmethod
     def arg_parser(cls):
@@ -563,49 +1433,87 @@ class RegexSlideshow(Slideshow):
         s.serve()
 
     async def _fetch_urls(self):
-        """Fetch urls from the google photos link and store them in self.urls"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.url) as response:
-                if response.status == 404:
-                    print("404 NOT FOUND: There was something wrong with the url")
-                    if self.url.startswith("http://photos.google.com/share/") and not "key=" in self.url:
-                        print("Somehow the url is missing the key= parameter which allows it to be shareable, try reloading your page or creating a public link")
-                    raise ValueError(f"404 NOT FOUND: {self.url}")
-                text = await response.text()
-                if self.parse_title:
-                    title = re.search(self.title_regex, text)
-                    if title:
-                        title = title.group(1)
-                        if title != self.title:
-                            logger.info(f"New Title: {title}")
-                            self.title = title
-                            await self._send_to_all(json.dumps({'action': 'title', 'title': self.title}))
-                urls = list(set(re.findall(self.regex, text)))
-                return urls
+        """Fetch urls from the google photos link, returns None if the page has not changed since the last fetch"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        self.fetches += 1
+        try:
+            urls, titles, body_hash = await self._fetch_page(headers)
+        except Exception:
+            # a truncated page must not leave validators behind that would turn every retry into a 304
+            self.etag = None
+            self.last_modified = None
+            raise
+        if urls is None:
+            return None
+        if titles and titles[0] != self.title:
+            logger.info(f"New Title: {titles[0]}")
+            self.title = titles[0]
+            await self._send_to_all(json.dumps({'action': 'title', 'title': self.title}), key='title')
+        self.body_hash = body_hash
+        return list(urls)
+
+    async def _fetch_page(self, headers):
+        """Download and scan the page, returns (urls, titles, body hash), urls is None if the page has not changed.
+
+        The page is scanned as it downloads, so on the first load the first urls are shown before the page is
+        complete. It is hashed along the way, and a page with the same hash as last time changes nothing.
+        """
+        async with self.session.get(self.url, headers=headers) as response:
+            if response.status == 304:
+                self.unchanged_fetches += 1
+                return None, [], None
+            if response.status == 404:
+                print("404 NOT FOUND: There was something wrong with the url")
+                if self.url.startswith("http://photos.google.com/share/") and not "key=" in self.url:
+                    print("Somehow the url is missing the key= parameter which allows it to be shareable, try reloading your page or creating a public link")
+                raise ValueError(f"404 NOT FOUND: {self.url}")
+            # an error page is not an album with no photos in it
+            response.raise_for_status()
+            decode = decoder(response.charset)
+            url_scanner = StreamScanner(self.regex)
+            title_scanner = StreamScanner(self.title_regex) if self.parse_title else None
+            titles = []
+            urls = set()
+
+            def scan(chunk, final=False):
+                nonlocal titles
+                t = time.perf_counter()
+                text = decode.decode(chunk, final=final)
+                found = url_scanner.feed(text) + (url_scanner.close() if final else [])
+                if title_scanner is not None and not titles:
+                    titles = title_scanner.feed(text) + (title_scanner.close() if final else [])
+                self.parse_seconds += time.perf_counter() - t
+                urls.update(found)
+                return found
+
+            # each chunk is hashed and scanned as it arrives and then dropped, so neither the memory nor the time
+            # spent between two awaits grows with the page
+            body_hash = hashlib.sha1()
+            async for chunk in response.content.iter_chunked(self.stream_chunk_size):
+                self.bytes_fetched += len(chunk)
+                body_hash.update(chunk)
+                found = scan(chunk)
+                if found and not self.playlist:
+                    # nothing to show yet, start with what we have instead of waiting for the whole page
+                    await self._record_urls(UrlChanges(found, []))
+            scan(b'', final=True)
+            # only a complete page may be revalidated later
+            self.etag = response.headers.get('ETag', None)
+            self.last_modified = response.headers.get('Last-Modified', None)
+        body_hash = body_hash.digest()
+        if body_hash == self.body_hash:
+            # the same page as last time, what was found in it is already in the playlist
+            self.unchanged_fetches += 1
+            return None, [], body_hash
+        return urls, titles, body_hash
 
     async def _get_content_type(self, url):
-        async with aiohttp.ClientSession() as session:
-            async with session.head(url) as response:
-                return response.headers.get('content-type', None)
-
-    async def load_content_type(self, url):
-        if url in self.content_types:
-            # return a future that is already done
-            f = asyncio.Future()
-            f.set_result(self.content_types[url])
-            return f
-        if url in self.content_type_futures:
-            # return the future
-            return self.content_type_futures[url]
-        # create a new future
-        future = asyncio.Future()
-        self.content_type_futures[url] = future
-        content_type = await self._get_content_type(url)
-        # set the result of the future
-        future.set_result(content_type)
-        self.content_types[url] = content_type
-        # remove the future from the dict
-        del self.content_type_futures[url]
+        async with self.session.head(url) as response:
+            return response.headers.get('content-type', None)
 
 
 class GooglePhotosSlideshow(RegexSlideshow):
@@ -635,7 +1543,8 @@ class GooglePhotosSlideshow(RegexSlideshow):
                          support_casting=support_casting,
                          static_folder=static_folder,
                          static_route=static_route,
-                         static_folders=static_folders)
+                         static_folders=static_folders,
+                         **extra)
 
     @classmethod
     def arg_parser(cls):
@@ -644,6 +1553,10 @@ class GooglePhotosSlideshow(RegexSlideshow):
         parser.add_argument("--regex", help="The regex to extract the image urls from the google photos album link", type=str, default=Default(GooglePhotosSlideshow.default_regex))
         return parser
 
+    def _sized_url(self, url, size):
+        # lh3.googleusercontent.com resizes on the fly, =s<n> limits the longest side to n pixels
+        return f"{url}=s{size}"
+
     @classmethod
     def main(cls):
         d, cfg = cls.get_args()
@@ -684,6 +1597,14 @@ class GooglePhotosSlideshow(RegexSlideshow):
 
 
 
+def saved_mode(cfg):
+    """The mode saved in a config, read without parsing the yaml, which only the chosen mode's args need"""
+    if not cfg.exists():
+        return None
+    match = re.search(r"^mode:\s*['\"]?([\w-]+)", cfg.read_text(), re.MULTILINE)
+    return match.group(1) if match else None
+
+
 def main(mode=None, support_tk=True):
     import sys
 
@@ -695,13 +1616,16 @@ def main(mode=None, support_tk=True):
         elif "--cli" in sys.argv:
             sys.argv.remove("--cli")
     if mode is None:
-        cfg = default_cfg
-        if cfg.exists():
-            mode = yaml.safe_load(cfg.read_text()).get('mode', None)
+        mode = saved_mode(default_cfg)
     if mode is None:
-        mode = input("Enter the mode to use (base, urls, folder, regex, google_photos): [google_photos]").strip()
+        mode = input("Enter the mode to use (base, urls, folder, regex, google_photos, host): [google_photos]").strip()
         if not mode:
             mode = "google_photos"
+    if mode == "host":
+        from .host import SlideshowHost
+        print(f"Starting {SlideshowHost.__name__}...")
+        SlideshowHost.main()
+        return
     if mode not in ["base", "urls", "folder", "regex", "google_photos"]:
         raise ValueError(f"Invalid mode: {mode}")
     classes = [Slideshow, GooglePhotosSlideshow, URLListSlideshow, FolderSlideshow, RegexSlideshow]
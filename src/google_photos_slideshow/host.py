@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import heapq
+import hmac
+import itertools
+import logging
+import signal
+from html import escape
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from .google_photos_slideshow import (Slideshow, GooglePhotosSlideshow, RegexSlideshow, FolderSlideshow,
+                                      URLListSlideshow, default_state, default_proxy_cache)
+from .assets import StaticAssets
+from .clients import Admission
+
+logger = logging.getLogger("slideshow")
+
+
+class SlideScheduler:
+    """Advances the slides of many slideshows from one task, keeping their deadlines in a heap.
+
+    A slideshow whose timing changes (new urls, pause, speed, next...) calls reschedule(), which queues it to have its
+    deadline recomputed; its old heap entry no longer matches and is skipped when it comes up. Each wakeup only touches
+    the slideshows that changed or are due, so the cost per slide does not grow with the number of albums.
+    """
+
+    def __init__(self):
+        self.heap = []  # (deadline, tiebreak, slideshow)
+        self.deadlines = {}  # slideshow -> its current deadline
+        self.changed = set()
+        self.wakeup = asyncio.Event()
+        self._ids = itertools.count()
+
+    def reschedule(self, slideshow):
+        self.changed.add(slideshow)
+        self.wakeup.set()
+
+    def add(self, slideshow):
+        slideshow.scheduler = self
+        self.reschedule(slideshow)
+
+    def remove(self, slideshow):
+        slideshow.scheduler = None
+        self.changed.discard(slideshow)
+        self.deadlines.pop(slideshow, None)
+
+    def _update(self):
+        for slideshow in self.changed:
+            deadline = slideshow._deadline()
+            if deadline is None:
+                self.deadlines.pop(slideshow, None)
+            elif self.deadlines.get(slideshow, None) != deadline:
+                self.deadlines[slideshow] = deadline
+                heapq.heappush(self.heap, (deadline, next(self._ids), slideshow))
+        self.changed.clear()
+        while self.heap and self.deadlines.get(self.heap[0][2], None) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self.wakeup.clear()
+            self._update()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            deadline, _, slideshow = self.heap[0]
+            if loop.time() < deadline:
+                timer = loop.call_at(deadline, self.wakeup.set)
+                await self.wakeup.wait()
+                timer.cancel()
+                continue
+            heapq.heappop(self.heap)
+            del self.deadlines[slideshow]
+            try:
+                await slideshow._advance(deadline)
+            except Exception as e:
+                logger.warning(f"Failed to advance {slideshow.base_path}: {e!r}")
+            self.reschedule(slideshow)
+
+
+class SlideshowHost:
+    """Many slideshows of any mode on one event loop and one http port, each album served under /albums/<name>/.
+
+    The albums share one http client session, one content type cache, one image proxy and one slide scheduler, and
+    their websockets are routes on the same server, so an album costs a playlist, a refresh task and its clients.
+    Albums can be added and removed while running, with add() and remove() or through the http api.
+    """
+    modes = {cls.mode: cls for cls in (GooglePhotosSlideshow, RegexSlideshow, FolderSlideshow, URLListSlideshow)}
+    route = '/albums'
+    default_host = Slideshow.default_host
+    default_port = Slideshow.default_port
+    default_api = False
+    default_api_token = None
+    # what POST /albums may set: albums of remote urls, nothing that reads or writes local files (folders, caches,
+    # state, mirrors), those only come from the --albums file
+    api_modes = (GooglePhotosSlideshow.mode, RegexSlideshow.mode, URLListSlideshow.mode)
+    api_options = {'name', 'mode', 'url', 'urls', 'regex', 'title', 'parse_title', 'title_regex', 'image_duration',
+                   'refresh_interval', 'support_casting'}
+
+    @classmethod
+    def arg_parser(cls):
+        parser = argparse.ArgumentParser(description="Host many slideshows on one port")
+        parser.add_argument("--albums", type=str, default=None,
+                            help="A yaml file mapping album names to their mode and options, e.g. "
+                                 "party: {mode: google_photos, url: ...}")
+        parser.add_argument("--host", default=cls.default_host, help="The host to serve the slideshows")
+        parser.add_argument("--port", type=int, default=cls.default_port, help="The port for the http server")
+        parser.add_argument("--state-path", type=str, default=Slideshow.default_state_path,
+                            help="Where to cache the album states for fast restarts ('' to disable)")
+        parser.add_argument("--proxy", action="store_true", default=Slideshow.default_proxy,
+                            help="Download each photo once and serve it to all screens from a local cache")
+        parser.add_argument("--proxy-cache", type=str, default=Slideshow.default_proxy_cache,
+                            help="The folder to cache proxied photos in")
+        parser.add_argument("--proxy-cache-size", type=int, default=Slideshow.default_proxy_cache_size,
+                            help="The maximum size of the proxy cache in MB")
+        parser.add_argument("--api", action="store_true", default=cls.default_api,
+                            help=f"Allow adding and removing albums with POST and DELETE on {cls.route}")
+        parser.add_argument("--api-token", type=str, default=cls.default_api_token,
+                            help="Require this token (Authorization: Bearer <token>) to add and remove albums")
+        parser.add_argument("--connect-rate", type=float, default=Slideshow.default_connect_rate,
+                            help="Admit at most this many new screens per second across all albums, off by default. "
+                                 "A limit delays the first slide of reconnecting screens")
+        parser.add_argument("--connect-burst", type=int, default=Slideshow.default_connect_burst,
+                            help="With --connect-rate, how many screens are admitted at once before the rate applies")
+        return parser
+
+    @classmethod
+    def main(cls):
+        args = vars(cls.arg_parser().parse_args())
+        albums = args.pop('albums')
+        if albums:
+            import yaml
+            albums = yaml.safe_load(Path(albums).read_text())
+        else:
+            albums = {}
+        s = cls(albums=albums, **args)
+        s.serve()
+
+    def __init__(self, albums=None, host=default_host, port=default_port, state_path=default_state, proxy=False,
+                 proxy_cache=default_proxy_cache, proxy_cache_size=Slideshow.default_proxy_cache_size,
+                 api=default_api, api_token=default_api_token, connect_rate=Slideshow.default_connect_rate,
+                 connect_burst=Slideshow.default_connect_burst):
+        self.host = host
+        self.port = port
+        self.state_path = state_path
+        self.api = api
+        self.api_token = api_token
+        self.initial_albums = albums or {}
+        self.albums = {}  # name -> slideshow
+        self.start_tasks = {}  # name -> task loading the album's first playlist
+        self.scheduler = SlideScheduler()
+        self.content_types = {}
+        self.admission = Admission(connect_rate, connect_burst)  # shared, a storm hits every album
+        self._session = None
+        self.runner = None
+        self.proxy = None
+        if proxy:
+            from .proxy import ImageProxy
+            self.proxy = ImageProxy(proxy_cache, lambda: self.session, proxy_cache_size * 1024 ** 2)
+
+    @property
+    def session(self):
+        """The pooled aiohttp session all albums make their requests with"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=Slideshow.http_connection_limit,
+                                             limit_per_host=Slideshow.http_connections_per_host)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=Slideshow.http_timeout))
+        return self._session
+
+    def create(self, name, mode, **options):
+        """Make a slideshow of the given mode that runs inside this host"""
+        if mode not in self.modes:
+            raise ValueError(f"Invalid mode: {mode}")
+        options.update(host=self.host, port=self.port, single_port=True, base_path=f"{self.route}/{name}",
+                       session=self.session, content_types=self.content_types, state_path=self.state_path)
+        slideshow = self.modes[mode](**options)
+        if self.proxy is not None:
+            slideshow.proxy = self.proxy
+        slideshow.admission = self.admission
+        slideshow.neighbours = self.albums.values()
+        return slideshow
+
+    async def add(self, name, mode, **options):
+        """Add an album and start loading it in the background, returns its slideshow"""
+        if name in self.albums:
+            raise ValueError(f"Album {name} already exists")
+        if not name or '/' in name:
+            raise ValueError(f"Invalid album name: {name!r}")
+        slideshow = self.create(name, mode, **options)
+        self.albums[name] = slideshow
+        self.start_tasks[name] = asyncio.create_task(self._start(name, slideshow))
+        logger.info(f"added album {name} ({mode})")
+        return slideshow
+
+    async def _start(self, name, slideshow):
+        try:
+            await slideshow.start()
+        except Exception as e:
+            logger.warning(f"Failed to load album {name}: {e!r}")
+        finally:
+            self.start_tasks.pop(name, None)
+        self.scheduler.add(slideshow)
+
+    async def remove(self, name):
+        """Stop an album and disconnect its screens"""
+        slideshow = self.albums.pop(name)
+        task = self.start_tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+        if slideshow.refresh_task is not None:
+            slideshow.refresh_task.cancel()
+        self.scheduler.remove(slideshow)
+        await slideshow._save_state()
+        await slideshow.close()
+        logger.info(f"removed album {name}")
+
+    def _album(self, request):
+        slideshow = self.albums.get(request.match_info['album'], None)
+        if slideshow is None:
+            raise web.HTTPNotFound()
+        return slideshow
+
+    async def serve_index(self, request):
+        """A list of the albums"""
+        links = "".join(f'<li><a href="{self.route}/{escape(name)}/">{escape(s.title)}</a></li>'
+                        for name, s in self.albums.items())
+        return web.Response(text=f"<!DOCTYPE html><html><body><ul>{links}</ul></body></html>", content_type='text/html')
+
+    async def serve_album(self, request):
+        return await self._album(request).serve_index(request)
+
+    async def album_redirect(self, request):
+        raise web.HTTPFound(f"{self.route}/{request.match_info['album']}/")
+
+    async def websocket_route_handler(self, request):
+        return await self._album(request).websocket_route_handler(request)
+
+    async def serve_variant(self, request):
+        slideshow = self._album(request)
+        if getattr(slideshow, 'variants', None) is None:
+            raise web.HTTPNotFound()
+        return await slideshow.variants.handle(request)
+
+    async def serve_static(self, request):
+        return await self._album(request).serve_static(request)
+
+    async def serve_metrics(self, request):
+        return await self._album(request).serve_metrics(request)
+
+    async def serve_mirror(self, request):
+        slideshow = self._album(request)
+        if slideshow.mirror is None:
+            raise web.HTTPNotFound()
+        return await slideshow.mirror.handle(request)
+
+    async def list_albums(self, request):
+        return web.json_response({name: {'mode': s.mode, 'title': s.title, 'urls': len(s.urls), 'clients': len(s.clients)}
+                                  for name, s in self.albums.items()})
+
+    def _authorize(self, request):
+        if self.api_token is None:
+            return
+        expected = f"Bearer {self.api_token}".encode()
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected):
+            raise web.HTTPUnauthorized(headers={'WWW-Authenticate': 'Bearer'})
+
+    async def add_album(self, request):
+        self._authorize(request)
+        try:
+            options = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="The body must be a json object")
+        if not isinstance(options, dict):
+            raise web.HTTPBadRequest(text="The body must be a json object")
+        unknown = set(options) - self.api_options
+        if unknown:
+            raise web.HTTPBadRequest(text=f"Options not allowed through the api: {', '.join(sorted(unknown))}")
+        mode = options.pop('mode', None)
+        if mode not in self.api_modes:
+            raise web.HTTPBadRequest(text=f"Invalid mode: {mode}, the api can add {', '.join(self.api_modes)} albums")
+        urls = options.get('urls', [])
+        # a single path would be read as a file of urls
+        if not isinstance(urls, list) or not all(isinstance(u, str) and u.startswith(('http://', 'https://'))
+                                                 for u in urls):
+            raise web.HTTPBadRequest(text="urls must be a list of http(s) urls")
+        try:
+            await self.add(options.pop('name', ''), mode, **options)
+        except (ValueError, TypeError, FileNotFoundError) as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response({'added': True}, status=201)
+
+    async def remove_album(self, request):
+        self._authorize(request)
+        name = request.match_info['album']
+        if name not in self.albums:
+            raise web.HTTPNotFound()
+        await self.remove(name)
+        return web.json_response({'removed': True})
+
+    def setup_routes(self, app):
+        app.router.add_get('/', self.serve_index)
+        app.router.add_get(self.route, self.list_albums)
+        # the albums' pages share the front-end assets
+        StaticAssets.shared().setup_routes(app)
+        if self.api:
+            if self.api_token is None:
+                logger.warning(f"--api without --api-token: anyone who can reach port {self.port} can add albums")
+            app.router.add_post(self.route, self.add_album)
+            app.router.add_delete(self.route + '/{album}', self.remove_album)
+        if self.proxy is not None:
+            self.proxy.setup_routes(app)
+        album = self.route + '/{album}'
+        app.router.add_get(album, self.album_redirect)
+        app.router.add_get(album + '/', self.serve_album)
+        app.router.add_get(album + Slideshow.websocket_route, self.websocket_route_handler)
+        app.router.add_get(album + '/variants/{size:\\d+}/{name:.+}', self.serve_variant)
+        app.router.add_get(album + '/metrics', self.serve_metrics)
+        app.router.add_get(album + '/mirror/{name}', self.serve_mirror)
+        app.router.add_get(album + '/{path:.+}', self.serve_static)
+
+    async def start_http_server(self):
+        app = web.Application()
+        self.setup_routes(app)
+        self.runner = runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        logger.warning(f"Serving {len(self.initial_albums)} albums on port {self.port}, "
+                       f"open http://localhost:{self.port}{self.route}/<name>/")
+
+    async def run(self):
+        await self.start_http_server()
+        for name, options in self.initial_albums.items():
+            options = dict(options)
+            await self.add(name, options.pop('mode', GooglePhotosSlideshow.mode), **options)
+        try:
+            await self.scheduler.run()
+        finally:
+            await self.close()
+
+    async def close(self):
+        for name in list(self.albums):
+            await self.remove(name)
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        if self._session is not None:
+            await self._session.close()
+
+    def serve(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        # cancelling the main task runs close()
+        signal.signal(signal.SIGINT, lambda s, f: loop.call_soon_threadsafe(task.cancel))
+        signal.signal(signal.SIGTERM, lambda s, f: loop.call_soon_threadsafe(task.cancel))
+        try:
+            await self.run()
+        except asyncio.CancelledError:
+            pass
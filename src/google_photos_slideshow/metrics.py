@@ -0,0 +1,136 @@
+import asyncio
+import collections
+import sys
+import threading
+import time
+
+# upper bounds in seconds, from sub-millisecond broadcasts to slow album fetches
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Counts of observations per bucket, rendered in the prometheus text format"""
+
+    def __init__(self, name, help, buckets=default_buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for le, count in zip([*self.buckets, '+Inf'], self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+def metric(name, kind, help, value):
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+
+class Metrics:
+    """Timings from a slideshow's hot paths, served on /metrics.
+
+    A slideshow without metrics has self.metrics = None and every instrumented spot is a single `is not None` check, so
+    it costs next to nothing when disabled. Gauges (clients, playlist size...) are read from the slideshow when
+    /metrics is scraped rather than tracked as they change.
+    """
+    lag_interval = 0.25  # seconds between event loop lag probes
+
+    def __init__(self, slideshow):
+        self.slideshow = slideshow
+        self.broadcast = Histogram("slideshow_broadcast_seconds", "Time to queue a message or slide for every client")
+        self.fetch = Histogram("slideshow_fetch_seconds", "Time to fetch the album's urls")
+        self.parse = Histogram("slideshow_parse_seconds", "Time spent parsing the album page per fetch")
+        self.record = Histogram("slideshow_record_seconds", "Time to apply a fetch to the playlist")
+        self.lateness = Histogram("slideshow_slide_lateness_seconds", "How late each slide fired after its deadline")
+        self.loop_lag = Histogram("slideshow_event_loop_lag_seconds", "How late the event loop ran a timer")
+        self.content_type_hits = 0
+        self.content_type_misses = 0
+        self._lag_task = None
+
+    def start(self):
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._probe_loop_lag())
+
+    def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+
+    async def _probe_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag.observe(max(0.0, loop.time() - t - self.lag_interval))
+
+    def render(self):
+        s = self.slideshow
+        lines = []
+        lines += metric("slideshow_clients", "gauge", "Connected screens", len(s.clients))
+        lines += metric("slideshow_client_dropped_messages", "gauge", "Messages dropped for slow connected screens",
+                        sum(c.dropped for c in s.clients.values()))
+        lines += metric("slideshow_playlist_size", "gauge", "Urls in the playlist", len(s.playlist))
+        lines += metric("slideshow_paused", "gauge", "1 while the slideshow is paused", int(s.paused))
+        lines += metric("slideshow_content_type_hits_total", "counter", "Slides whose content type was cached",
+                        self.content_type_hits)
+        lines += metric("slideshow_content_type_misses_total", "counter", "Slides whose content type had to be looked up",
+                        self.content_type_misses)
+        for name, attr, help in [("slideshow_fetches_total", "fetches", "Album page fetches"),
+                                 ("slideshow_unchanged_fetches_total", "unchanged_fetches", "Fetches with no changes"),
+                                 ("slideshow_fetched_bytes_total", "bytes_fetched", "Bytes of album pages fetched")]:
+            if hasattr(s, attr):
+                lines += metric(name, "counter", help, getattr(s, attr))
+        if s.proxy is not None:
+            lines += metric("slideshow_proxy_hits_total", "counter", "Photos served from the proxy cache", s.proxy.hits)
+            lines += metric("slideshow_proxy_misses_total", "counter", "Photos downloaded by the proxy", s.proxy.misses)
+        if s.mirror is not None:
+            lines += metric("slideshow_mirror_files", "gauge", "Photos mirrored to disk", len(s.mirror.files))
+            lines += metric("slideshow_mirror_bytes", "gauge", "Bytes of mirrored photos on disk", s.mirror.total_bytes)
+            lines += metric("slideshow_mirror_queued", "gauge", "Photos waiting to be mirrored", len(s.mirror.queued))
+            lines += metric("slideshow_mirror_failures_total", "counter", "Failed mirror downloads", s.mirror.failures)
+            lines += metric("slideshow_mirror_offline", "gauge", "1 while screens are shown the mirrored photos",
+                            int(s.mirror.offline))
+        for histogram in (self.broadcast, self.fetch, self.parse, self.record, self.lateness, self.loop_lag):
+            lines += histogram.render()
+        return "\n".join(lines) + "\n"
+
+
+def sample_profile(thread_id, seconds, interval=0.005):
+    """Sample the stack of a thread (the event loop's) for a while, returns collapsed stacks with their sample counts.
+
+    Blocks for `seconds`, run it in another thread. The output is the "folded" format flame graph tools read: one
+    line per distinct stack, frames separated by ';' from the outermost, then the number of samples.
+    """
+    stacks = collections.Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id, None)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+            frame = frame.f_back
+        if stack:
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {n}" for stack, n in stacks.most_common()) + "\n"
+
+
+async def profile_event_loop(seconds):
+    """Sample the running event loop's thread for `seconds` without blocking it"""
+    return await asyncio.to_thread(sample_profile, threading.get_ident(), seconds)
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger("slideshow")
+
+
+class AlbumMirror:
+    """A local copy of every photo in the album, so the slideshow keeps going when the uplink dies.
+
+    sync() is called with the album's urls after each refresh: urls without a copy are queued and downloaded by
+    `concurrency` workers over the slideshow's pooled session, copies of urls that left the album are deleted.
+    Downloads go to a .part file that a later attempt (or the next run) resumes with a Range request, and are renamed
+    into place once complete, so a copy is never half written. Downloading stops at max_bytes on disk, and rate
+    limits all downloads together to that many bytes per second (None for no limit).
+
+    While offline is set (the slideshow sets it when fetching the album still fails after its retries) screens are
+    sent the local copies. A photo that fails to download is only counted in failures and retried on the next sync.
+    """
+    route = '/mirror'
+    chunk_size = 64 * 1024
+    read_timeout = 60  # seconds without a byte before a download is given up, a whole video can take much longer
+
+    def __init__(self, directory, session, max_bytes=None, rate=None, concurrency=4):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.session = session  # callable returning the shared aiohttp ClientSession
+        self.max_bytes = max_bytes
+        self.rate = rate
+        self.concurrency = concurrency
+        self.offline = False
+        self.files = {}  # key -> complete copy
+        self.total_bytes = 0
+        self.wanted = {}  # key -> url, the album as of the last sync
+        self.queue = asyncio.Queue()
+        self.queued = set()
+        self.workers = []
+        self.downloaded = 0  # copies completed
+        self.downloaded_bytes = 0  # bytes received, resumed downloads only count their new bytes
+        self.failures = 0
+        self.full = False
+        self._allowance = 0.0
+        self._last = time.monotonic()
+        self._load_files()
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+    def _load_files(self):
+        """Pick up the copies made by a previous run, .part files are kept to be resumed"""
+        for path in self.directory.iterdir():
+            if path.is_file() and path.suffix != '.part':
+                self.files[path.stem] = path
+                self.total_bytes += path.stat().st_size
+
+    def has(self, url):
+        return self.key(url) in self.files
+
+    def path(self, url):
+        return self.files.get(self.key(url), None)
+
+    def url_for(self, url, base_path=''):
+        """The local url of the copy of url, None if there is no copy yet"""
+        path = self.files.get(self.key(url), None)
+        return None if path is None else f"{base_path}{self.route}/{path.name}"
+
+    def sync(self, urls):
+        """Mirror urls, deleting copies of anything else. Returns right away, the downloads run in the background"""
+        self.wanted = {self.key(url): url for url in urls}
+        for key in [key for key in self.files if key not in self.wanted]:
+            self._delete(self.files.pop(key))
+        for part in self.directory.glob('*.part'):
+            if part.stem not in self.wanted:
+                part.unlink(missing_ok=True)
+        for key in self.wanted:
+            if key not in self.files and key not in self.queued:
+                self.queued.add(key)
+                self.queue.put_nowait(key)
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    def _delete(self, path):
+        try:
+            self.total_bytes -= path.stat().st_size
+            path.unlink()
+        except OSError:
+            pass
+
+    async def _work(self):
+        while True:
+            key = await self.queue.get()
+            self.queued.discard(key)
+            url = self.wanted.get(key, None)
+            if url is None or key in self.files:
+                continue
+            if self.max_bytes is not None and self.total_bytes >= self.max_bytes:
+                if not self.full:
+                    logger.warning(f"mirror is full ({self.total_bytes / 1024 ** 2:.0f}MB), not downloading more")
+                self.full = True
+                continue
+            try:
+                await self._download(key, url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.debug(f"mirror failed to download {url}: {e!r}")
+
+    async def _download(self, key, url):
+        tmp = self.directory / f"{key}.part"
+        offset = tmp.stat().st_size if tmp.exists() else 0
+        headers = {'Range': f"bytes={offset}-"} if offset else {}
+        # the shared session's total timeout would cut off large photos and videos
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.read_timeout, sock_read=self.read_timeout)
+        async with self.session().get(url, headers=headers, timeout=timeout) as response:
+            if response.status == 416:
+                # the server can't resume from there, start over next time
+                tmp.unlink(missing_ok=True)
+                return
+            response.raise_for_status()
+            if response.status != 206:
+                offset = 0
+            if self.max_bytes is not None and response.content_length is not None \
+                    and self.total_bytes + offset + response.content_length > self.max_bytes:
+                self.full = True
+                logger.warning(f"mirror is full, {url} does not fit")
+                return
+            content_type = response.headers.get('content-type', '').split(';')[0].strip()
+            suffix = (mimetypes.guess_extension(content_type) or '') if content_type else ''
+            with open(tmp, 'ab' if offset else 'wb') as f:
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    # in a worker thread, so a slow disk doesn't hold up the slides
+                    await asyncio.to_thread(f.write, chunk)
+                    self.downloaded_bytes += len(chunk)
+                    await self._throttle(len(chunk))
+        path = self.directory / f"{key}{suffix}"
+        os.replace(tmp, path)
+        if key not in self.wanted:
+            # left the album while downloading
+            path.unlink(missing_ok=True)
+            return
+        self.files[key] = path
+        self.total_bytes += path.stat().st_size
+        self.downloaded += 1
+
+    async def _throttle(self, n):
+        """Spend n bytes of the shared budget, sleeping while it is overdrawn (bursts of up to a second's worth)"""
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate) - n
+        self._last = now
+        if self._allowance < 0:
+            await asyncio.sleep(-self._allowance / self.rate)
+
+    def setup_routes(self, app):
+        app.router.add_get(self.route + '/{name}', self.handle)
+
+    async def handle(self, request):
+        path = self.files.get(Path(request.match_info['name']).stem, None)
+        if path is None or path.name != request.match_info['name']:
+            raise web.HTTPNotFound()
+        return web.FileResponse(path, headers={'Cache-Control': 'public, max-age=86400, immutable'})
+
+    def close(self):
+        for task in self.workers:
+            task.cancel()
+        self.workers = []
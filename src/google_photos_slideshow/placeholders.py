@@ -0,0 +1,119 @@
+import asyncio
+import base64
+import importlib.util
+import io
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("slideshow")
+
+
+def make_placeholder(source, size=24, quality=50):
+    """A tiny JPEG of an image (a file path or the image's bytes) as a data: url, runs in a worker process"""
+    from PIL import Image, ImageOps
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as im:
+        # let the JPEG decoder downscale while decoding, a placeholder needs a fraction of the pixels
+        im.draft('RGB', (size * 4, size * 4))
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((size, size))
+        if im.mode not in ('RGB', 'L'):
+            im = im.convert('RGB')
+        out = io.BytesIO()
+        im.save(out, 'JPEG', quality=quality)
+    return 'data:image/jpeg;base64,' + base64.b64encode(out.getvalue()).decode()
+
+
+class Placeholders:
+    """Tiny previews of the slides (a ~1KB data: url each) that screens paint while the photo itself downloads.
+
+    get() never waits: a url without a placeholder yet returns None and load() starts making it in the background,
+    so the slideshow asks for the next few slides ahead of time and the placeholders are ready when they are shown.
+    source is an async callable returning a file path or the bytes of an image for a url (None for no placeholder),
+    the decoding and resizing runs in a worker process shared by every slideshow in this process. Needs Pillow, if it
+    is not installed available() is False.
+    """
+    default_max_entries = 10000
+    size = 24  # longest side in pixels
+    max_jobs = 2  # placeholders made at once, each may download a photo
+    max_workers = 1
+    retry_after = 300  # seconds before a placeholder that failed (a network error, say) is tried again
+    _pool = None
+    _users = 0  # open Placeholders sharing the pool
+
+    def __init__(self, source, max_entries=default_max_entries):
+        self.source = source
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # url -> data url, or None if it can't have one, least recently used first
+        self.jobs = {}  # url -> in-flight task
+        self.failed = OrderedDict()  # url -> time.monotonic() its placeholder failed at, oldest first
+        self._limit = None
+        self.closed = False
+        Placeholders._users += 1
+
+    @staticmethod
+    def available():
+        return importlib.util.find_spec("PIL") is not None
+
+    @classmethod
+    def pool(cls):
+        if cls._pool is None:
+            from .variants import process_pool
+            cls._pool = process_pool(cls.max_workers)
+        return cls._pool
+
+    def get(self, url):
+        placeholder = self.entries.get(url, None)
+        if placeholder is not None:
+            self.entries.move_to_end(url)
+        return placeholder
+
+    def load(self, url):
+        """Start making the placeholder of url unless it is made or being made"""
+        if url in self.entries or url in self.jobs:
+            return
+        failed_at = self.failed.get(url, None)
+        if failed_at is not None:
+            if time.monotonic() - failed_at < self.retry_after:
+                return
+            del self.failed[url]
+        task = asyncio.create_task(self._make(url))
+        self.jobs[url] = task
+        task.add_done_callback(lambda t: self.jobs.pop(url, None))
+
+    async def _make(self, url):
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_jobs)
+        async with self._limit:
+            try:
+                source = await self.source(url)
+                placeholder = None
+                if source is not None:
+                    loop = asyncio.get_running_loop()
+                    placeholder = await loop.run_in_executor(self.pool(), make_placeholder, source, self.size)
+            except Exception as e:
+                # not cached, it may well work next time
+                logger.debug(f"No placeholder for {url} for now: {e!r}")
+                self.failed[url] = time.monotonic()
+                while len(self.failed) > self.max_entries:
+                    self.failed.popitem(last=False)
+                return
+        self.entries[url] = placeholder
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def forget(self, url):
+        self.entries.pop(url, None)
+        self.failed.pop(url, None)
+
+    def close(self):
+        for task in list(self.jobs.values()):
+            task.cancel()
+        if self.closed:
+            return
+        self.closed = True
+        Placeholders._users -= 1
+        # the pool is shared with the other slideshows, the last one to close shuts it down so the process can exit
+        if Placeholders._users == 0 and Placeholders._pool is not None:
+            Placeholders._pool.shutdown(wait=False, cancel_futures=True)
+            Placeholders._pool = None
@@ -0,0 +1,334 @@
+import random
+from collections import namedtuple
+
+# what changed in an album since the last refresh, for sources that can tell without listing everything
+UrlChanges = namedtuple('UrlChanges', ['added', 'removed'])
+
+
+class _Fenwick:
+    """Prefix sums over chunk lengths so a position can be found in O(log n)"""
+    def __init__(self, sizes=()):
+        self.n = len(sizes)
+        self.tree = [0] * (self.n + 1)
+        for i, size in enumerate(sizes):
+            self.add(i, size)
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """Sum of the first i sizes"""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, pos):
+        """Return (chunk number, offset within the chunk) for an absolute position"""
+        i = 0
+        step = 1 << self.n.bit_length()
+        while step:
+            j = i + step
+            if j <= self.n and self.tree[j] <= pos:
+                i = j
+                pos -= self.tree[j]
+            step >>= 1
+        return i, pos
+
+
+class _LazyShuffle:
+    """Shuffles a playlist one Fisher-Yates step per slide instead of all at once when it wraps around.
+
+    Positions before `drawn` are the order of the current epoch (one pass over every url), the rest are not shuffled
+    yet: each slide swaps a random one of them into place, so wrapping around only resets `drawn` and costs no more
+    than any other slide. The first repeat_gap draws of an epoch skip the positions where the previous epoch ended,
+    so a photo can't come back right after it was shown. Subclasses provide __len__, __getitem__ and _swap(i, j).
+    """
+    repeat_gap = 10  # slides at the end of an epoch kept out of the start of the next
+
+    def _reset_order(self, drawn):
+        self.drawn = drawn  # positions [0, drawn) are the order of this epoch
+        self.ahead = 0  # positions [0, ahead) are already the order of the next epoch, looked ahead into
+        self.guarded = 0  # the first `guarded` draws of an epoch only pick positions before `limit`
+        self.limit = 0
+
+    def _guard(self):
+        """Keep the last slides of the epoch ending now out of the start of the next one"""
+        gap = min(self.repeat_gap, len(self) // 2)
+        self.guarded, self.limit = gap, len(self) - gap
+
+    def _pick(self, k):
+        """The position to swap into position k, uniformly among those not drawn yet"""
+        end = len(self)
+        if k < self.guarded:
+            end = max(k + 1, min(self.limit, end))
+        return random.randrange(k, end)
+
+    def _draw(self):
+        k = self.drawn
+        self._swap(k, self._pick(k))
+        self.drawn += 1
+
+    def _draw_ahead(self):
+        k = self.ahead
+        self._swap(k, random.randrange(k, self.limit))
+        self.ahead += 1
+
+    def _wrap(self):
+        self.cursor = 0
+        if not self.ahead:
+            self._guard()
+        self.drawn, self.ahead = self.ahead, 0
+        if not self.drawn:
+            self._draw()
+
+    def shuffle(self):
+        """Reshuffle the slides after the current one"""
+        self._reset_order(self.cursor + 1 if self else 0)
+
+    @property
+    def current(self):
+        return self[self.cursor] if self else None
+
+    def upcoming(self, n):
+        """The next n urls next() will return, drawing them now.
+
+        Near the end of an epoch this includes the start of the next one, as far as it can be drawn without the slides
+        still to come in this epoch: the list is shorter when more than repeat_gap slides are asked past the end.
+        """
+        size = len(self)
+        n = min(n, size - 1)
+        if n <= 0:
+            return []
+        end = min(self.cursor + 1 + n, size)
+        while self.drawn < end:
+            self._draw()
+        urls = [self[i] for i in range(self.cursor + 1, end)]
+        if len(urls) < n:
+            if not self.ahead:
+                self._guard()
+            if self.cursor >= self.limit:
+                # the rest of this epoch sits at positions from limit on, out of reach of the next epoch's draws
+                want = min(n - len(urls), self.guarded, self.limit)
+                while self.ahead < want:
+                    self._draw_ahead()
+                urls.extend(self[i] for i in range(want))
+        return urls
+
+    def next(self):
+        """Advance the cursor, drawing the next slide, and start a new epoch when it wraps around"""
+        if not self:
+            return None
+        self.cursor += 1
+        if self.cursor >= len(self):
+            self._wrap()
+        elif self.cursor >= self.drawn:
+            self._draw()
+        return self.current
+
+    def previous(self):
+        if not self:
+            return None
+        if self.cursor == 0:
+            # back into the previous epoch, what is left of its order plays again
+            self._reset_order(len(self))
+        self.cursor = (self.cursor - 1) % len(self)
+        return self.current
+
+
+class Playlist(_LazyShuffle):
+    """An ordered list of unique urls with a cursor, shuffled as it plays.
+
+    Urls are kept in chunks of roughly `load` items with a dict from url to its chunk, so membership is O(1) and
+    insert / remove / index are O(log n + load) instead of the O(n) of a plain list.
+
+    Urls added to a playlist that isn't empty are fresh uploads: they join the undrawn part of the current epoch, and
+    each slide is one of them with probability fresh_boost, so new photos show up within a few slides while the rest
+    of the album keeps its share (1 - fresh_boost) of the slides.
+    """
+    default_load = 512
+    default_fresh_boost = 0.5
+
+    def __init__(self, urls=(), load=default_load, fresh_boost=default_fresh_boost):
+        self.load = load
+        self.fresh_boost = fresh_boost
+        self.cursor = 0
+        self._fresh = []  # fresh urls not drawn yet
+        self._fresh_at = {}  # fresh url -> its index in _fresh
+        self._set(urls)
+        self._reset_order(len(self))
+
+    def _set(self, urls):
+        urls = list(dict.fromkeys(urls))
+        self._chunks = [urls[i:i + self.load] for i in range(0, len(urls), self.load)] or [[]]
+        self._where = {url: chunk for chunk in self._chunks for url in chunk}
+        self._renumber()
+
+    def _renumber(self):
+        """Rebuild the chunk lookups, called whenever chunks are added or removed"""
+        self._chunk_numbers = {id(chunk): i for i, chunk in enumerate(self._chunks)}
+        self._sizes = _Fenwick([len(chunk) for chunk in self._chunks])
+
+    def __len__(self):
+        return len(self._where)
+
+    def __bool__(self):
+        return bool(self._where)
+
+    def __contains__(self, url):
+        return url in self._where
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("playlist index out of range")
+        c, offset = self._sizes.find(i)
+        return self._chunks[c][offset]
+
+    def __repr__(self):
+        return f"Playlist({len(self)} urls, cursor={self.cursor})"
+
+    def index(self, url):
+        chunk = self._where[url]
+        c = self._chunk_numbers[id(chunk)]
+        return self._sizes.prefix(c) + chunk.index(url)
+
+    def _swap(self, i, j):
+        c, offset = self._sizes.find(i)
+        a = self._chunks[c]
+        c, other = self._sizes.find(j)
+        b = self._chunks[c]
+        a[offset], b[other] = b[other], a[offset]
+        self._where[a[offset]] = a
+        self._where[b[other]] = b
+
+    def _reset_order(self, drawn):
+        super()._reset_order(drawn)
+        if drawn == len(self):
+            # nothing left to draw, fresh urls are part of the order now
+            self._fresh = []
+            self._fresh_at = {}
+
+    def _pick(self, k):
+        if self._fresh and random.random() < self.fresh_boost:
+            return self.index(random.choice(self._fresh))
+        return super()._pick(k)
+
+    def _draw(self):
+        super()._draw()
+        if self._fresh:
+            self._unfresh(self[self.drawn - 1])
+
+    def _unfresh(self, url):
+        i = self._fresh_at.pop(url, None)
+        if i is None:
+            return
+        last = self._fresh.pop()
+        if i < len(self._fresh):
+            self._fresh[i] = last
+            self._fresh_at[last] = i
+
+    def insert(self, i, urls):
+        """Insert a block of urls before position i, skipping any already in the playlist"""
+        urls = [url for url in dict.fromkeys(urls) if url not in self._where]
+        if not urls:
+            return
+        i = max(0, min(i, len(self)))
+        if i < self.cursor:
+            self.cursor += len(urls)
+        if i < self.drawn:
+            self.drawn += len(urls)
+        if i < self.ahead:
+            self.ahead += len(urls)
+        if i < self.limit:
+            self.limit += len(urls)
+        if i == len(self):
+            c, offset = len(self._chunks) - 1, len(self._chunks[-1])
+        else:
+            c, offset = self._sizes.find(i)
+        chunk = self._chunks[c]
+        chunk[offset:offset] = urls
+        if len(chunk) > 2 * self.load:
+            pieces = [chunk[j:j + self.load] for j in range(0, len(chunk), self.load)]
+            self._chunks[c:c + 1] = pieces
+            for piece in pieces:
+                for url in piece:
+                    self._where[url] = piece
+            self._renumber()
+        else:
+            for url in urls:
+                self._where[url] = chunk
+            self._sizes.add(c, len(urls))
+
+    def remove(self, url):
+        """Remove a url, keeping the cursor on the same item when items before it disappear"""
+        i = self.index(url)
+        if i < self.cursor:
+            self.cursor -= 1
+        if i < self.drawn:
+            self.drawn -= 1
+        if i < self.ahead:
+            self.ahead -= 1
+        if i < self.limit:
+            self.limit -= 1
+        self._unfresh(url)
+        chunk = self._where.pop(url)
+        c = self._chunk_numbers[id(chunk)]
+        chunk.remove(url)
+        if not chunk and len(self._chunks) > 1:
+            del self._chunks[c]
+            self._renumber()
+        else:
+            self._sizes.add(c, -1)
+        if not self:
+            self.cursor = 0
+            self._reset_order(0)
+        elif self.cursor >= len(self):
+            self._wrap()
+        elif self.cursor >= self.drawn:
+            self._draw()
+
+    def diff(self, urls):
+        """Compare the playlist with a new set of urls, returns UrlChanges"""
+        urls = set(urls)
+        return UrlChanges([url for url in urls if url not in self._where],
+                          [url for url in self._where if url not in urls])
+
+    def apply(self, added, removed):
+        """Apply changes to the playlist.
+
+        New urls are added to the part of the epoch still to be drawn, as fresh uploads unless the playlist was empty,
+        removed urls are dropped. Returns the lists of urls that were actually added and removed.
+        """
+        new_urls = [url for url in dict.fromkeys(added) if url not in self._where]
+        removed_urls = [url for url in removed if url in self._where]
+        if self:
+            for url in new_urls:
+                self._fresh_at[url] = len(self._fresh)
+                self._fresh.append(url)
+        self.insert(len(self), new_urls)
+        for url in removed_urls:
+            self.remove(url)
+        if self and self.cursor >= self.drawn:
+            self._draw()
+        return new_urls, removed_urls
+
+    def update(self, urls):
+        """Make the playlist match a new set of urls, returns the lists of added and removed urls"""
+        return self.apply(*self.diff(urls))
+
+    def replace(self, urls):
+        """Replace the contents of the playlist, resetting the cursor. The urls play in this order until the wrap"""
+        self._set(urls)
+        self.cursor = 0
+        self._reset_order(len(self))
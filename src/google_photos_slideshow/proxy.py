@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger("slideshow")
+
+
+class ImageProxy:
+    """Fetch each photo from upstream once and serve it to every screen from a size bounded LRU disk cache.
+
+    Only urls registered through url_for are served, so this is not an open proxy. Concurrent requests for a photo that
+    is still downloading share the same download. Files are served with aiohttp's FileResponse, which handles ETag /
+    If-None-Match and Range requests (so videos can be scrubbed).
+    """
+    route = '/proxy'
+    default_max_bytes = 1024 ** 3
+    chunk_size = 64 * 1024
+    read_timeout = 60  # seconds without a byte before a download is given up, a whole video can take much longer
+
+    def __init__(self, cache_dir, session, max_bytes=default_max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.session = session  # callable returning the shared aiohttp ClientSession
+        self.max_bytes = max_bytes
+        self.urls = {}  # key -> upstream url
+        self.entries = OrderedDict()  # key -> cached file, least recently used first
+        self.total_bytes = 0
+        self.downloads = {}  # key -> in-flight download task
+        self.hits = 0
+        self.misses = 0
+        self._load_entries()
+
+    def _load_entries(self):
+        """Pick up files cached by a previous run, oldest first"""
+        for tmp in self.cache_dir.glob('*.part'):
+            tmp.unlink(missing_ok=True)
+        files = sorted(self.cache_dir.iterdir(), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            self.entries[path.stem] = path
+            self.total_bytes += path.stat().st_size
+        self._evict()
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+    def url_for(self, url):
+        """Register an upstream url and return the local url it is served from"""
+        key = self.key(url)
+        self.urls[key] = url
+        return f"{self.route}/{key}"
+
+    def forget(self, url):
+        self.urls.pop(self.key(url), None)
+
+    def setup_routes(self, app):
+        app.router.add_get(self.route + '/{key}', self.handle)
+
+    async def handle(self, request):
+        key = request.match_info['key']
+        path = self.entries.get(key, None)
+        if path is not None and path.exists():
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            url = self.urls.get(key, None)
+            if url is None:
+                raise web.HTTPNotFound()
+            self.misses += 1
+            try:
+                path = await self.fetch(key, url)
+            except Exception as e:
+                logger.warning(f"proxy failed to fetch {url}: {e!r}")
+                raise web.HTTPBadGateway()
+        return web.FileResponse(path, headers={'Cache-Control': 'public, max-age=86400, immutable'})
+
+    def cached(self, url):
+        """The cached file of an upstream url, None if it isn't cached"""
+        path = self.entries.get(self.key(url), None)
+        return path if path is not None and path.exists() else None
+
+    def fetch(self, key, url):
+        """Download a url into the cache, sharing the download with any concurrent request for it"""
+        task = self.downloads.get(key, None)
+        if task is None:
+            task = asyncio.create_task(self._download(key, url))
+            self.downloads[key] = task
+            task.add_done_callback(lambda t: self.downloads.pop(key, None))
+        # shield so one client disconnecting does not cancel the download for everyone else
+        return asyncio.shield(task)
+
+    async def _download(self, key, url):
+        # the shared session's total timeout would cut off large photos and videos
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.read_timeout, sock_read=self.read_timeout)
+        async with self.session().get(url, timeout=timeout) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('content-type', '').split(';')[0].strip()
+            suffix = (mimetypes.guess_extension(content_type) or '') if content_type else ''
+            path = self.cache_dir / f"{key}{suffix}"
+            tmp = self.cache_dir / f"{key}.part"
+            size = 0
+            try:
+                with open(tmp, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        # in a worker thread, so a slow disk doesn't hold up the slides
+                        await asyncio.to_thread(f.write, chunk)
+                        size += len(chunk)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+        # written under a temporary name and renamed, so a half downloaded photo is never served
+        os.replace(tmp, path)
+        self.entries[key] = path
+        self.total_bytes += size
+        self._evict()
+        return path
+
+    def _evict(self):
+        """Delete least recently used files until the cache fits in max_bytes"""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, path = self.entries.popitem(last=False)
+            try:
+                self.total_bytes -= path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,48 @@
+import codecs
+import re
+
+
+class StreamScanner:
+    """Find regex matches in text that arrives in chunks, including matches that span chunk boundaries.
+
+    Only the unmatched tail of the text is kept between chunks (at most max_match characters, the longest match
+    expected), so memory stays bounded however large the document is. A match that runs into the end of the text seen
+    so far might continue in the next chunk, so it is held back until more text arrives or the stream ends.
+    """
+    default_max_match = 8192
+
+    def __init__(self, pattern, max_match=default_max_match):
+        self.regex = re.compile(pattern)
+        self.max_match = max_match
+        self.tail = ''
+
+    def _value(self, m):
+        return m.group(1) if self.regex.groups else m.group(0)
+
+    def feed(self, text):
+        """Scan the next chunk of text, returns the matches completed in it"""
+        text = self.tail + text
+        found = []
+        keep = max(0, len(text) - self.max_match)
+        for m in self.regex.finditer(text):
+            if m.end() >= len(text):
+                keep = min(keep, m.start())
+                break
+            found.append(self._value(m))
+            keep = max(keep, m.end())
+        self.tail = text[keep:]
+        return found
+
+    def close(self):
+        """Scan whatever is left at the end of the stream"""
+        found = [self._value(m) for m in self.regex.finditer(self.tail)]
+        self.tail = ''
+        return found
+
+
+def decoder(encoding):
+    """An incremental decoder for a response's charset, falling back to utf-8"""
+    try:
+        return codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
@@ -0,0 +1,78 @@
+import logging
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+logger = logging.getLogger("slideshow")
+
+schema = """
+CREATE TABLE IF NOT EXISTS albums (
+    key TEXT PRIMARY KEY,
+    title TEXT,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS urls (
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    content_type TEXT,
+    PRIMARY KEY (key, position)
+);
+"""
+
+
+class AlbumState:
+    """The last known state of an album (urls in playlist order, cursor, content types and title) stored in sqlite.
+
+    Lets a restarted slideshow serve slides immediately while the live album is fetched in the background.
+    Albums that have not been saved for max_age seconds are evicted.
+    """
+    default_max_age = 30 * 24 * 3600
+
+    def __init__(self, path, key, max_age=default_max_age):
+        self.path = path
+        self.key = key
+        self.max_age = max_age
+
+    def _connect(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.executescript(schema)
+        return db
+
+    def load(self):
+        """Return (title, urls, cursor, content_types) or None if nothing was saved for this album"""
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT title, cursor FROM albums WHERE key = ?", (self.key,)).fetchone()
+            if row is None:
+                return None
+            title, cursor = row
+            rows = db.execute("SELECT url, content_type FROM urls WHERE key = ? ORDER BY position", (self.key,)).fetchall()
+        urls = [url for url, _ in rows]
+        content_types = {url: content_type for url, content_type in rows if content_type is not None}
+        return title, urls, cursor, content_types
+
+    def save(self, title, urls, cursor, content_types):
+        with closing(self._connect()) as db, db:
+            db.execute("DELETE FROM urls WHERE key = ?", (self.key,))
+            db.executemany("INSERT INTO urls (key, position, url, content_type) VALUES (?, ?, ?, ?)",
+                           ((self.key, i, url, content_types.get(url, None)) for i, url in enumerate(urls)))
+            db.execute("INSERT OR REPLACE INTO albums (key, title, cursor, updated) VALUES (?, ?, ?, ?)",
+                       (self.key, title, cursor, time.time()))
+
+    def save_cursor(self, cursor):
+        with closing(self._connect()) as db, db:
+            db.execute("UPDATE albums SET cursor = ?, updated = ? WHERE key = ?", (cursor, time.time(), self.key))
+
+    def evict(self):
+        """Delete albums that have not been saved for max_age seconds"""
+        with closing(self._connect()) as db, db:
+            stale = [key for key, in db.execute("SELECT key FROM albums WHERE updated < ?",
+                                                (time.time() - self.max_age,))]
+            for key in stale:
+                db.execute("DELETE FROM urls WHERE key = ?", (key,))
+                db.execute("DELETE FROM albums WHERE key = ?", (key,))
+        if stale:
+            logger.info(f"evicted {len(stale)} stale albums from {self.path}")
@@ -0,0 +1,341 @@
+// The Cast SDK can't be self-hosted (Google serves it), so it loads async and only where it can work:
+// when the server supports casting and the browser is Chrome
+window.__onGCastApiAvailable = function(isAvailable) {
+    if (isAvailable) {
+        initializeCastApi();
+    }
+};
+if (document.querySelector('meta[name="slideshow-casting"]').content === 'true' && window.chrome) {
+    const castSdk = document.createElement('script');
+    castSdk.src = 'https://www.gstatic.com/cv/js/sender/v1/cast_sender.js?loadCastFramework=1';
+    castSdk.async = true;
+    document.head.appendChild(castSdk);
+}
+
+function initializeCastApi() {
+    window.cast.framework.CastContext.getInstance().setOptions({
+        receiverApplicationId: chrome.cast.media.DEFAULT_MEDIA_RECEIVER_APP_ID,
+        autoJoinPolicy: chrome.cast.AutoJoinPolicy.ORIGIN_SCOPED
+    });
+
+    const castButton = document.getElementById('castButton');
+    if (castButton) {
+        castButton.addEventListener('click', function() {
+            const castSession = window.cast.framework.CastContext.getInstance().getCurrentSession();
+            if (!castSession) {
+                window.cast.framework.CastContext.getInstance().requestSession().catch(function(error) {
+                    console.error('Error requesting cast session:', error);
+                });
+            }
+        });
+    } else {
+        console.error('Cast button not found');
+    }
+}
+
+
+class Slideshow{
+    constructor(ws){
+        this.ws = ws;
+        this.previousEl = document.getElementById('previous');
+        this.pauseEl = document.getElementById('pause');
+        this.playEl = document.getElementById('play');
+        this.nextEl = document.getElementById('next');
+        this.speedSelectEl = document.getElementById('speed-select');
+        this.speedDropdownEl = document.getElementById('speed-dropdown');
+        this.slideshowEl = document.getElementById('slideshow');
+        this.backEl = document.getElementById('slideshow-back');
+        this.placeholderEl = document.getElementById('placeholder');
+        this.preloaded = new Map(); // url -> promise resolving once the image is downloaded and decoded
+        this.urlToken = 0;
+        this.clockSamples = []; // [round trip, offset] of recent clock sync handshakes
+        this.clockOffset = 0; // server time minus local time, in ms
+        this.sourceEl = document.getElementById('source');
+        this.containerEl = document.getElementById('container');
+        this.fullscreenToggleEl = document.getElementById('fullscreen-toggle');
+        this.castButtonEl = document.getElementById('castButton');
+
+
+        let faviconLink = document.querySelector('link[rel="icon"]');
+        if (!faviconLink) {
+            faviconLink = document.createElement('link');
+            faviconLink.rel = 'icon';
+            document.head.appendChild(faviconLink);
+        }
+        this.faviconEl = faviconLink;
+
+        this.updateFavicon = this.updateFavicon.bind(this);
+        this.action = this.action.bind(this);
+        this.pause = this.pause.bind(this);
+        this.play = this.play.bind(this);
+        this.next = this.next.bind(this);
+        this.previous = this.previous.bind(this);
+        this.setSpeed = this.setSpeed.bind(this);
+        this.toggleSpeedDropdown = this.toggleSpeedDropdown.bind(this);
+        this.closeDropdown = this.closeDropdown.bind(this);
+        this.setUrl = this.setUrl.bind(this);
+        this.load = this.load.bind(this);
+        this.preload = this.preload.bind(this);
+        this.toggleFullscreen = this.toggleFullscreen.bind(this);
+        this.onFullscreenChange = this.onFullscreenChange.bind(this);
+        this.onKeydown = this.onKeydown.bind(this);
+        this.castMedia = this.castMedia.bind(this);
+
+
+        this.fullscreenToggleEl.addEventListener('click', this.toggleFullscreen);
+
+        document.addEventListener('fullscreenchange', this.onFullscreenChange);
+        document.addEventListener('keydown', this.onKeydown);
+
+        this.ws.onmessage = this.onmessage.bind(this);
+        this.sendViewport = this.sendViewport.bind(this);
+        this.ws.addEventListener('open', this.sendViewport);
+        this.syncClock = this.syncClock.bind(this);
+        this.ws.addEventListener('open', this.syncClock);
+        setInterval(this.syncClock, 60000);
+        window.addEventListener('resize', () => {
+            clearTimeout(this.viewportTimeout);
+            this.viewportTimeout = setTimeout(this.sendViewport, 500);
+        });
+
+        window.addEventListener('click', this.closeDropdown);
+    }
+    onmessage (event) {
+        var data = JSON.parse(event.data);
+        if (data.action === 'speed') {
+            this.setSpeed(data.speed);
+        }else if (data.action === 'pause') {
+            this.pause(false);
+        }else if (data.action === 'play') {
+            this.play(false);
+        } else if (data.action === 'title') {
+            this.setTitle(data.title);
+        } else if (data.action === 'source'){
+            this.sourceEl.href = data.source;
+        } else if (data.action === 'sync'){
+            this.onSync(data);
+        } else if (data.action === 'snapshot'){
+            /* everything a screen needs on connect, in one message */
+            this.showSlide(data.slide);
+            this.setSpeed(data.speed);
+            if (data.paused) {
+                this.pause(false);
+            } else {
+                this.play(false);
+            }
+            this.sourceEl.href = data.source;
+            this.setTitle(data.title);
+        }else{
+            this.showSlide(data);
+        }
+    }
+    showSlide(data) {
+        this.setUrl(data.url, data['content-type'], data.show_at, data.placeholder);
+        this.preload([data.url].concat(data.next || []));
+    }
+    setTitle(title) {
+        document.title = title;
+        this.sourceEl.innerHTML = title;
+    }
+    sendViewport() {
+        /* Tell the server how big this screen is so it can send right-sized photos */
+        this.action('viewport', {
+            width: Math.max(window.innerWidth, screen.width),
+            height: Math.max(window.innerHeight, screen.height),
+            dpr: window.devicePixelRatio || 1,
+        });
+    }
+    localNow() {
+        return performance.timeOrigin + performance.now();
+    }
+    serverNow() {
+        return this.localNow() + this.clockOffset;
+    }
+    syncClock() {
+        /* A few NTP-style round trips, the one with the shortest round trip gives the best offset */
+        for (let i = 0; i < 5; i++) {
+            setTimeout(() => this.action('sync', this.localNow()), i * 200);
+        }
+    }
+    onSync(data) {
+        const now = this.localNow();
+        const rtt = now - data.client;
+        this.clockSamples.push([rtt, data.server + rtt / 2 - now]);
+        this.clockSamples = this.clockSamples.slice(-10);
+        this.clockOffset = this.clockSamples.reduce((best, s) => s[0] < best[0] ? s : best)[1];
+    }
+    updateFavicon(imageUrl) {
+        /* Update the favicon (tab icon) to the current image */
+        this.faviconEl.href = imageUrl;
+    }
+    action(action, value = null) {
+        this.ws.send(JSON.stringify({action, value}));
+    }
+    pause(send = true) {
+        if (send){
+            this.action('pause');
+        }
+        this.pauseEl.classList.add('hidden');
+        this.playEl.classList.remove('hidden');
+    }
+    play(send = true) {
+        if (send){
+            this.action('play');
+        }
+        this.playEl.classList.add('hidden');
+        this.pauseEl.classList.remove('hidden');
+    }
+    next() {
+        this.action('next');
+    }
+    previous() {
+        this.action('previous');
+    }
+    setSpeed(speed) {
+        this.action('speed', speed);
+        this.speedSelectEl.childNodes[0].nodeValue = speed + 'x'; // Update the display to the selected speed
+        // Update dropdown options to show a checkmark next to the selected speed
+        const options = this.speedDropdownEl.children;
+        for (let i = 0; i < options.length; i++) {
+            if (options[i].innerHTML == speed + 'x') {
+                options[i].innerHTML += ' <i class="fas fa-check"></i>'; // Add checkmark next to selected speed
+            }else{
+                options[i].innerHTML = options[i].innerHTML.replace(' <i class="fas fa-check"></i>', ''); // Remove checkmark from other speeds
+            }
+        }
+        this.closeDropdown(); // Close the dropdown after selection
+    }
+    toggleSpeedDropdown() {
+        this.speedDropdownEl.style.display = this.speedDropdownEl.style.display === "block" ? "none" : "block";
+    }
+    closeDropdown(event) {
+        if ((event===undefined) || (!event.target.matches('#speed-select'))) {
+            this.speedDropdownEl.style.display = "none";
+        }
+    }
+
+    load(url) {
+        /* Download and decode an image once, however many times it is asked for */
+        let loaded = this.preloaded.get(url);
+        if (!loaded) {
+            const img = new Image();
+            img.src = url;
+            loaded = img.decode().catch(() => {}).then(() => img);
+            this.preloaded.set(url, loaded);
+        }
+        return loaded;
+    }
+    preload(urls) {
+        /* Start loading the upcoming slides and forget any that are no longer coming up */
+        urls.forEach(this.load);
+        for (const url of this.preloaded.keys()) {
+            if (!urls.includes(url)) {
+                this.preloaded.delete(url);
+            }
+        }
+    }
+    setUrl(url, contentType = null, showAt = null, placeholder = null) {
+        const token = ++this.urlToken;
+        const received = this.localNow();
+        this.castMedia(url, contentType);
+        this.updateFavicon(url);
+        const current = () => token === this.urlToken; // false once a newer slide has arrived
+        let loaded = false;
+        if (placeholder) {
+            // if the photo is still downloading when it is due, show its placeholder instead of the previous photo
+            setTimeout(() => {
+                if (current() && !loaded) {
+                    this.showPlaceholder(placeholder);
+                }
+            }, Math.max(0, showAt == null ? 0 : showAt - this.serverNow()));
+        }
+        this.load(url).then(() => {
+            loaded = true;
+            if (current()) {
+                this.backEl.src = url;
+                return this.backEl.decode().catch(() => {});
+            }
+        }).then(() => {
+            // wait for show_at so all screens flip together, or flip right away if loading took too long
+            const wait = showAt == null ? 0 : showAt - this.serverNow();
+            const load = this.localNow() - received;
+            return new Promise(resolve => setTimeout(resolve, Math.max(0, wait))).then(() => load);
+        }).then((load) => {
+            if (!current()) {
+                return;
+            }
+            if (showAt != null) {
+                this.action('shown', {show_at: showAt, shown: this.serverNow(), load});
+            }
+            // cross-fade to the image that is now ready, then use the old one for the next slide
+            this.backEl.style.opacity = 1;
+            this.slideshowEl.style.opacity = 0;
+            this.placeholderEl.style.opacity = 0;
+            [this.slideshowEl, this.backEl] = [this.backEl, this.slideshowEl];
+        });
+    }
+    showPlaceholder(placeholder) {
+        /* Paint a slide's tiny preview right away, the photo cross-fades over it once it has loaded */
+        this.placeholderEl.src = placeholder;
+        this.placeholderEl.style.opacity = 1;
+        this.slideshowEl.style.opacity = 0;
+    }
+    castMedia(url, contentType = null) {
+        if (!window.cast){
+            this.castButtonEl.classList.add('hidden');
+            return;
+        }
+        this.castButtonEl.classList.remove('hidden');
+
+        const castSession = cast.framework.CastContext.getInstance().getCurrentSession();
+        if (castSession) {
+            url = new URL(url, location.href).href; // proxied urls are relative to this server
+            console.warn('casting', url, contentType);
+            const mediaInfo = new chrome.cast.media.MediaInfo(url, contentType || 'image/jpeg');
+            const request = new chrome.cast.media.LoadRequest(mediaInfo);
+            castSession.loadMedia(request).then(
+                () => console.log('Media loaded successfully'),
+                (error) => console.error('Error loading media:', error)
+            );
+
+        }
+    }
+
+    toggleFullscreen() {
+        if (!document.fullscreenElement) {
+            this.containerEl.requestFullscreen().catch(err => {
+                console.error(`Error attempting to enable fullscreen mode: ${err.message} (${err.name})`);
+            });
+        } else if (document.exitFullscreen) {
+            document.exitFullscreen();
+        }
+    }
+    onFullscreenChange() {
+        if (document.fullscreenElement) {
+            this.fullscreenToggleEl.innerHTML = '<i class="fas fa-compress"></i>'; // Change to compress icon when in fullscreen
+        } else {
+            this.fullscreenToggleEl.innerHTML = '<i class="fas fa-expand"></i>'; // Change back to expand icon when not in fullscreen
+        }
+    }
+
+    onKeydown(event) {
+        if (event.key === "Escape" && document.fullscreenElement) {
+            document.exitFullscreen();
+        }
+    }
+
+
+}
+
+function websocketUrl() {
+    let target = document.querySelector('meta[name="slideshow-websocket"]').content;
+    if (target.startsWith('{{')) {
+        target = ":6789/";
+    }
+    let scheme = location.protocol === "https:" ? "wss://" : "ws://";
+    // a path shares the page's host and port, so it works behind reverse proxies and TLS termination
+    return scheme + (target.startsWith(':') ? location.hostname + target : location.host + target);
+}
+
+let ws = new WebSocket(websocketUrl());
+let slideshow = new Slideshow(ws);
@@ -0,0 +1,79 @@
+import collections
+import logging
+import statistics
+import time
+
+logger = logging.getLogger("slideshow")
+
+
+def server_time():
+    """The clock clients synchronise to, in milliseconds"""
+    return time.time() * 1000
+
+
+class DisplaySync:
+    """Schedules slides to flip at the same instant on every screen and measures how well that worked.
+
+    Clients estimate their offset to server_time() NTP-style over the websocket (the sync action), so a slide can carry
+    a show_at time in server milliseconds: each screen loads the photo, then flips at show_at on its own clock. The lead
+    between sending and show_at follows the slowest screen's recent load time. Screens report when they actually flipped,
+    and the spread between the first and the last screen is kept per slide.
+    """
+    min_lead = 0.25  # seconds
+    max_lead = 5
+    lead_margin = 1.5  # the lead is this many times the slowest client's load time
+    load_smoothing = 0.3  # weight of the newest load time in each client's moving average
+    report_every = 100  # log a summary of the display spread every this many slides
+
+    def __init__(self, history=500):
+        self.displays = {}  # show_at -> server times the screens reported showing it
+        self.spreads = collections.deque(maxlen=history)  # ms between the first and last screen, per slide
+        self.lateness = collections.deque(maxlen=history)  # ms the last screen was behind show_at, per slide
+        self.slides = 0
+
+    def lead(self, clients):
+        """Seconds between sending a slide and showing it, enough for the slowest client to load it"""
+        load_times = [c.load_time for c in clients if c.load_time is not None]
+        lead = max(load_times, default=0) * self.lead_margin
+        return min(self.max_lead, max(self.min_lead, lead))
+
+    def show_at(self, clients):
+        """The server time a slide sent now should be shown at"""
+        self._finish()
+        show_at = round(server_time() + self.lead(clients) * 1000)
+        self.displays[show_at] = []
+        return show_at
+
+    def report(self, client, value):
+        """A client showed a slide, value holds its show_at, when it was shown and how long it took to load (ms)"""
+        load = value.get('load', None)
+        if load is not None:
+            load = float(load) / 1000
+            if client.load_time is None:
+                client.load_time = load
+            else:
+                client.load_time += self.load_smoothing * (load - client.load_time)
+        shown = self.displays.get(value.get('show_at', None), None)
+        if shown is not None:
+            shown.append(float(value['shown']))
+
+    def _finish(self):
+        """Record the spread of the slides whose reports are in, the newest slide is still collecting them"""
+        for show_at in list(self.displays)[:-1]:
+            shown = self.displays.pop(show_at)
+            if not shown:
+                continue
+            self.slides += 1
+            self.spreads.append(max(shown) - min(shown))
+            self.lateness.append(max(shown) - show_at)
+            logger.debug(f"slide shown on {len(shown)} screens, spread {self.spreads[-1]:.0f}ms, "
+                         f"last {self.lateness[-1]:.0f}ms after show_at")
+            if self.slides % self.report_every == 0:
+                logger.info(f"display spread over the last {len(self.spreads)} slides: {self.summary()}")
+
+    def summary(self):
+        if not self.spreads:
+            return {}
+        spreads = sorted(self.spreads)
+        return {'p50': statistics.median(spreads), 'p95': spreads[int(len(spreads) * 0.95)], 'max': spreads[-1],
+                'late_p50': statistics.median(self.lateness)}
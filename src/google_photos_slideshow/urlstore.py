@@ -0,0 +1,378 @@
+import bisect
+import gc
+import itertools
+import mmap
+from array import array
+from collections import namedtuple
+
+from .playlist import UrlChanges, _LazyShuffle
+
+# changes to a CompactPlaylist worked out off the event loop by prepare(), for commit() to put in place
+StagedChanges = namedtuple('StagedChanges', ['added', 'removed', 'gone', 'runs', 'staged', 'positions', 'order',
+                                             'swaps'])
+
+
+class UrlStore:
+    """Millions of urls in a few flat buffers instead of one python str each.
+
+    Each url is split at its last '/': the part before it is interned in a table of prefixes (a CDN archive has few
+    distinct folders), the rest is appended to one bytes buffer indexed by end offsets. Content types are one byte per
+    url indexing a small table of names. Urls are only built back into strings when they are looked at.
+    """
+    chunk_size = 1024 ** 2  # bytes of a file loaded at a time, what a chunk's lines cost is all loading adds on top
+    extend_slice = 10000  # urls encoded at a time by extend
+    recent_size = 256
+
+    def __init__(self):
+        self.prefixes = []
+        self._prefix_ids = {}  # prefix (bytes, with its trailing '/') -> index in prefixes
+        self.prefix_of = array('I')  # prefix id of each url
+        self.data = bytearray()  # what follows the prefix, for all urls back to back
+        self.ends = array('Q', [0])  # url i is data[ends[i]:ends[i + 1]]
+        self.types = bytearray()  # content type code of each url, 0 when unknown
+        self.type_names = [None]
+        self._type_codes = {None: 0}
+        self._recent = {}  # url -> index of the urls looked at lately, to find their content types
+
+    @classmethod
+    def from_file(cls, path, types_by_extension=None):
+        """Load a file with one url per line, memory mapped and a chunk of lines at a time.
+
+        types_by_extension maps extensions ('.jpg') to content types, to fill in the content types without a request.
+        """
+        store = cls()
+        with open(path, 'rb') as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                return store
+            # millions of short lived bytes objects would trigger full garbage collections over and over
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                with mm:
+                    start, size = 0, len(mm)
+                    while start < size:
+                        end = min(start + store.chunk_size, size)
+                        if end < size:
+                            # end the chunk after its last complete line
+                            end = mm.rfind(b'\n', start, end) + 1 or end
+                        store._extend_lines(mm[start:end].split(b'\n'), types_by_extension)
+                        start = end
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+        return store
+
+    @classmethod
+    def from_urls(cls, urls, content_types=None, types_by_extension=None):
+        store = cls()
+        store.extend(urls, content_types, types_by_extension)
+        return store
+
+    def extend(self, urls, content_types=None, types_by_extension=None):
+        """Append urls (strs), blank ones are skipped like blank lines in a file"""
+        urls = iter(urls)
+        # a slice at a time, a list of millions of urls never has an encoded copy next to it
+        while chunk := list(itertools.islice(urls, self.extend_slice)):
+            chunk = [url for url in chunk if url.strip()]
+            start = len(self)
+            self._extend_lines([url.encode() for url in chunk], types_by_extension)
+            if content_types:
+                for i, url in enumerate(chunk, start):
+                    if content_types.get(url, None):
+                        self.types[i] = self._type_code(content_types[url])
+
+    def delete(self, indexes):
+        """Remove the urls at some indexes, copying the buffers once. The urls after them move down"""
+        runs = self.runs(sorted(set(indexes)))
+        if len(runs) != 1 or runs[0] != (0, len(self)):
+            self.adopt(self.without(runs), runs)
+
+    def runs(self, indexes):
+        """The (start, stop) runs of urls between some sorted indexes"""
+        bounds = zip([-1] + indexes, indexes + [len(self)])
+        return [(start + 1, stop) for start, stop in bounds if start + 1 < stop]
+
+    def without(self, runs):
+        """A new store holding only the urls in runs, this one is only read (a worker thread can make it)"""
+        store = UrlStore()
+        store.prefixes, store._prefix_ids = list(self.prefixes), dict(self._prefix_ids)
+        store.prefix_of = array(self.prefix_of.typecode)
+        for start, stop in runs:
+            # a run of urls that stay, moved to where the previous run ends
+            shift = len(store.data) - self.ends[start]
+            store.data += self.data[self.ends[start]:self.ends[stop]]
+            store.ends.extend(end + shift for end in self.ends[start + 1:stop + 1])
+            store.prefix_of += self.prefix_of[start:stop]
+        store.types = bytearray(len(store))
+        return store
+
+    def adopt(self, store, runs):
+        """Take over the urls of a store made by without(runs) (and maybe extended), keeping our content types"""
+        types = bytearray().join(self.types[start:stop] for start, stop in runs)
+        types += bytes(len(store) - len(types))  # the urls added to it, not looked up yet
+        self.prefixes, self._prefix_ids = store.prefixes, store._prefix_ids
+        self.data, self.ends, self.prefix_of, self.types = store.data, store.ends, store.prefix_of, types
+        self._recent = {}
+
+    def _type_code(self, content_type):
+        code = self._type_codes.get(content_type, None)
+        if code is None:
+            if len(self.type_names) == 256:
+                return 0
+            code = self._type_codes[content_type] = len(self.type_names)
+            self.type_names.append(content_type)
+        return code
+
+    def _extend_lines(self, lines, types_by_extension=None):
+        parts = [line.strip().rpartition(b'/') for line in lines]
+        prefixes = [head + sep for head, sep, tail in parts if head or tail]
+        tails = [tail for head, _, tail in parts if head or tail]
+        del parts
+        ids = self._prefix_ids
+        for prefix in set(prefixes).difference(ids):
+            ids[prefix] = len(self.prefixes)
+            self.prefixes.append(prefix.decode())
+        self.prefix_of.extend(map(ids.__getitem__, prefixes))
+        ends = itertools.accumulate(map(len, tails), initial=len(self.data))
+        next(ends)  # the starting offset is already the previous url's end
+        self.ends.extend(ends)
+        self.data += b''.join(tails)
+        if types_by_extension is None:
+            self.types += bytes(len(tails))
+        else:
+            extensions = [tail.partition(b'?')[0].rpartition(b'.')[2].lower() for tail in tails]
+            codes = {ext: self._type_code(types_by_extension.get('.' + ext.decode(errors='replace'), None))
+                     for ext in set(extensions)}
+            self.types += bytes(map(codes.__getitem__, extensions))
+
+    def __len__(self):
+        return len(self.prefix_of)
+
+    def __getitem__(self, i):
+        url = self.prefixes[self.prefix_of[i]] + self.data[self.ends[i]:self.ends[i + 1]].decode()
+        if len(self._recent) >= self.recent_size:
+            del self._recent[next(iter(self._recent))]
+        self._recent[url] = i
+        return url
+
+    def __iter__(self):
+        # not remembered in _recent, a pass over every url would only flush it
+        prefixes, prefix_of, data, ends = self.prefixes, self.prefix_of, self.data, self.ends
+        for i in range(len(self)):
+            yield prefixes[prefix_of[i]] + data[ends[i]:ends[i + 1]].decode()
+
+    def find(self, url):
+        """The index of a url, fast for urls looked at lately and a full scan otherwise, -1 if missing"""
+        i = self._recent.get(url, None)
+        if i is not None:
+            return i
+        head, sep, tail = url.encode().rpartition(b'/')
+        prefix_id = self._prefix_ids.get(head + sep, None)
+        if prefix_id is None:
+            return -1
+        start = 0
+        while (pos := self.data.find(tail, start)) >= 0:
+            i = bisect.bisect_right(self.ends, pos) - 1
+            if self.ends[i] == pos and self.ends[i + 1] == pos + len(tail) and self.prefix_of[i] == prefix_id:
+                return i
+            start = pos + 1
+        return -1
+
+    def content_type(self, url):
+        i = self.find(url)
+        return self.type_names[self.types[i]] if i >= 0 else None
+
+    def set_content_type(self, url, content_type):
+        i = self.find(url)
+        if i >= 0:
+            self.types[i] = self._type_code(content_type)
+
+    def nbytes(self):
+        """Roughly how much memory the buffers take"""
+        return (len(self.data) + len(self.types) + self.prefix_of.itemsize * len(self.prefix_of)
+                + self.ends.itemsize * len(self.ends) + sum(len(p) + 49 for p in self.prefixes))
+
+
+class ContentTypes:
+    """The dict interface Slideshow uses for content types, over the type codes of a UrlStore"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, url, default=None):
+        content_type = self.store.content_type(url)
+        return default if content_type is None else content_type
+
+    def __getitem__(self, url):
+        content_type = self.store.content_type(url)
+        if content_type is None:
+            raise KeyError(url)
+        return content_type
+
+    def __contains__(self, url):
+        return self.store.content_type(url) is not None
+
+    def __setitem__(self, url, content_type):
+        self.store.set_content_type(url, content_type)
+
+    def pop(self, url, default=None):
+        # a url's content type is stored with it and goes when the playlist removes the url
+        return self.get(url, default)
+
+    def update(self, other):
+        for url, content_type in other.items():
+            self[url] = content_type
+
+    def __iter__(self):
+        return iter(())
+
+    def items(self):
+        return iter(())
+
+
+class CompactPlaylist(_LazyShuffle):
+    """The Playlist interface over a UrlStore for long url lists: the playing order is a permutation of indexes.
+
+    It plays the urls in file order first, then shuffles the permutation in place one step per slide like Playlist.
+    apply() edits the store in place (so a ContentTypes over it stays valid), replace() swaps in a whole new list.
+    """
+
+    diff_slice = 10000
+
+    def __init__(self, store):
+        self.store = store
+        self.cursor = 0
+        self.order = self._identity()  # position -> index in the store
+        self.swaps = 0  # changes to the order so far, tells prepare() if slides were drawn while it ran
+        self._reset_order(len(store))
+
+    def _identity(self):
+        return array('I' if len(self.store) < 2 ** 32 else 'Q', range(len(self.store)))
+
+    def _swap(self, i, j):
+        order = self.order
+        order[i], order[j] = order[j], order[i]
+        self.swaps += 1
+
+    def __len__(self):
+        return len(self.store)
+
+    def __bool__(self):
+        return len(self.store) > 0
+
+    def __contains__(self, url):
+        return self.store.find(url) >= 0
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("playlist index out of range")
+        return self.store[self.order[i]]
+
+    def __repr__(self):
+        return f"CompactPlaylist({len(self)} urls, cursor={self.cursor})"
+
+    def index(self, url):
+        i = self.store.find(url)
+        if i < 0:
+            raise ValueError(f"{url} is not in the playlist")
+        return self.order.index(i)
+
+    def diff(self, urls):
+        """Compare the playlist with a new set of urls, returns UrlChanges"""
+        # runs in a worker thread on long lists, so nothing here may hold the GIL (and the event loop) for long: the
+        # new urls are taken a slice at a time, and no set of the store's urls is built (freeing it would take ~0.1s)
+        found, it = {}, iter(urls)  # url -> whether the store has it
+        while chunk := list(itertools.islice(it, self.diff_slice)):
+            found.update(dict.fromkeys(chunk, False))
+        removed = {}
+        for url in self.store:
+            if url in found:
+                found[url] = True
+            else:
+                removed[url] = None
+        return UrlChanges([url for url, has in found.items() if not has], list(removed))
+
+    def apply(self, added, removed):
+        """Apply changes to the store in place, returns the lists of urls that were actually added and removed.
+
+        The urls that stay keep their place in the playing order and new urls join the part of the epoch still to be
+        drawn, like Playlist (without the fresh upload boost).
+        """
+        return self.commit(self.prepare(added, removed))
+
+    def prepare(self, added, removed):
+        """The slow part of apply(): a pass over the store, and a copy of its buffers and order when urls go.
+
+        The playlist is only read, so this can run in a worker thread while the slides go on (but not alongside
+        another change to the playlist). commit() puts the result in place.
+        """
+        swaps = self.swaps
+        new_urls = dict.fromkeys(url for url in added if url.strip())
+        removed = set(removed)
+        gone, removed_urls = [], []
+        for i, url in enumerate(self.store):
+            if url in removed:
+                gone.append(i)
+                removed_urls.append(url)
+            new_urls.pop(url, None)
+        new_urls = list(new_urls)
+        if not gone:
+            # adding a few urls is quick, commit() appends them to the store as it is
+            return StagedChanges(new_urls, removed_urls, gone, None, None, None, None, swaps)
+        runs = self.store.runs(gone)
+        staged = self.store.without(runs)
+        staged.extend(new_urls)
+        positions, order = self._reorder(gone)
+        return StagedChanges(new_urls, removed_urls, gone, runs, staged, positions, order, swaps)
+
+    def _reorder(self, gone):
+        """The positions of the urls at the indexes in gone, and the order without them"""
+        gone_set = set(gone)
+        positions = [position for position, i in enumerate(self.order) if i in gone_set]
+        order = array(self.order.typecode, [i - bisect.bisect_left(gone, i) for i in self.order if i not in gone_set])
+        return positions, order
+
+    def commit(self, changes):
+        """Put changes from prepare() in place, returns the lists of urls that were actually added and removed"""
+        if changes.gone:
+            positions, order = changes.positions, changes.order
+            if changes.swaps != self.swaps:
+                # slides were drawn while the changes were prepared, the order they were worked out from is stale
+                positions, order = self._reorder(changes.gone)
+            # like Playlist.remove, the positions before a removed url move down
+            self.cursor -= bisect.bisect_left(positions, self.cursor)
+            self.drawn -= bisect.bisect_left(positions, self.drawn)
+            self.ahead -= bisect.bisect_left(positions, self.ahead)
+            self.limit -= bisect.bisect_left(positions, self.limit)
+            self.order = order
+            self.store.adopt(changes.staged, changes.runs)
+        else:
+            self.store.extend(changes.added)
+        self.order.extend(range(len(self.order), len(self.store)))
+        if not self:
+            self.cursor = 0
+            self._reset_order(0)
+        elif self.cursor >= len(self):
+            self._wrap()
+        elif self.cursor >= self.drawn:
+            self._draw()
+        return changes.added, changes.removed
+
+    def update(self, urls):
+        """Make the playlist match a new set of urls, returns the lists of added and removed urls"""
+        return self.apply(*self.diff(urls))
+
+    def replace(self, urls):
+        self.store = urls if isinstance(urls, UrlStore) else UrlStore.from_urls(list(urls))
+        self.cursor = 0
+        self.order = self._identity()
+        self._reset_order(len(self.store))
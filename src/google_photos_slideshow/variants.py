@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from aiohttp import web
+
+logger = logging.getLogger("slideshow")
+
+# longest side, in device pixels, of the variants clients can ask for
+variant_sizes = (640, 1024, 1280, 1920, 2560, 3840)
+
+
+def variant_size(width, height, dpr=1):
+    """The smallest variant size that covers a display, or None if it needs the original"""
+    longest = max(width, height) * (dpr or 1)
+    for size in variant_sizes:
+        if size >= longest:
+            return size
+    return None
+
+
+def process_pool(max_workers):
+    """A process pool for the image work, its workers don't inherit our listening sockets or the bus hub's lock"""
+    # a forked worker would keep both if we died, holding the port and keeping another process from being the hub
+    context = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(context))
+
+
+def resize_image(src, dst, size, quality=85):
+    """Write a JPEG copy of src that fits in a size x size box, runs in a worker process"""
+    from PIL import Image, ImageOps
+    with Image.open(src) as im:
+        # let the JPEG decoder downscale while decoding, much cheaper than decoding the full image
+        im.draft('RGB', (size, size))
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((size, size))
+        if im.mode not in ('RGB', 'L'):
+            im = im.convert('RGB')
+        tmp = Path(dst).with_suffix('.part')
+        im.save(tmp, 'JPEG', quality=quality, optimize=True, progressive=True)
+    os.replace(tmp, dst)
+
+
+class ImageVariants:
+    """Resized copies of the photos in a folder, made in a process pool and cached on disk by (file, mtime, size).
+
+    The cache is bounded by max_bytes, least recently used variants are deleted first. When a photo changes, its
+    variants for the older mtime are deleted as soon as a variant of the new one is written.
+    Needs Pillow, if it is not installed available() is False and the originals are served instead.
+    """
+    route = '/variants'
+    resizable = {".jpg", ".jpeg", ".png", ".webp"}
+    default_max_bytes = 1024 ** 3
+
+    def __init__(self, folder, cache_dir, max_bytes=default_max_bytes, max_workers=None):
+        self.folder = Path(folder).resolve()
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self._pool = None
+        self.jobs = {}  # cache path -> in-flight resize future
+        self.entries = OrderedDict()  # cache path -> size in bytes, least recently used first
+        self.sources = {}  # photo digest -> its cached variant paths
+        self.total_bytes = 0
+        self._load_entries()
+
+    def _load_entries(self):
+        """Pick up variants cached by a previous run, oldest first"""
+        for tmp in self.cache_dir.glob('*.part'):
+            tmp.unlink(missing_ok=True)
+        files = [(path, path.stat()) for path in self.cache_dir.glob('*.jpg')]
+        for path, st in sorted(files, key=lambda f: f[1].st_mtime):
+            self._add(path, st.st_size)
+        self._evict()
+
+    @staticmethod
+    def available():
+        return importlib.util.find_spec("PIL") is not None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = process_pool(self.max_workers)
+        return self._pool
+
+    def url_for(self, name, size):
+        return f"{self.route}/{size}/{name}"
+
+    def cache_path(self, src, size):
+        st = src.stat()
+        digest = hashlib.sha256(str(src).encode()).hexdigest()[:16]
+        return self.cache_dir / f"{digest}-{st.st_mtime_ns:x}-{size}.jpg"
+
+    async def get(self, src, size):
+        """Return the path of the size variant of src, making it if needed"""
+        dst = self.cache_path(src, size)
+        if dst.exists():
+            if dst in self.entries:
+                self.entries.move_to_end(dst)
+            else:
+                self._written(dst)  # by another slideshow sharing the cache folder
+            return dst
+        future = self.jobs.get(dst, None)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.pool, resize_image, str(src), str(dst), size)
+            self.jobs[dst] = future
+            future.add_done_callback(lambda f: self._done(dst, f))
+        await asyncio.shield(future)
+        return dst
+
+    def _done(self, dst, future):
+        self.jobs.pop(dst, None)
+        if not future.cancelled() and future.exception() is None:
+            self._written(dst)
+
+    def _written(self, dst):
+        """Account for a new variant, deleting the variants of older versions of its photo"""
+        digest, mtime, _ = dst.stem.split('-')
+        for path in list(self.sources.get(digest, ())):
+            if path.stem.split('-')[1] != mtime:
+                self._delete(path)
+        self._add(dst, dst.stat().st_size)
+        self._evict()
+
+    def _add(self, path, size):
+        self.total_bytes += size - self.entries.pop(path, 0)
+        self.entries[path] = size
+        self.sources.setdefault(path.stem.split('-')[0], set()).add(path)
+
+    def _delete(self, path):
+        self.total_bytes -= self.entries.pop(path)
+        digest = path.stem.split('-')[0]
+        self.sources[digest].discard(path)
+        if not self.sources[digest]:
+            del self.sources[digest]
+        path.unlink(missing_ok=True)
+
+    def _evict(self):
+        """Delete least recently used variants until the cache fits in max_bytes"""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self._delete(next(iter(self.entries)))
+
+    def setup_routes(self, app):
+        app.router.add_get(self.route + '/{size:\\d+}/{name:.+}', self.handle)
+
+    async def handle(self, request):
+        size = int(request.match_info['size'])
+        src = (self.folder / request.match_info['name']).resolve()
+        if size not in variant_sizes or not src.is_relative_to(self.folder) or not src.is_file():
+            raise web.HTTPNotFound()
+        try:
+            path = await self.get(src, size)
+        except Exception as e:
+            logger.warning(f"Failed to resize {src}: {e!r}")
+            path = src
+        return web.FileResponse(path, headers={'Cache-Control': 'public, max-age=86400'})
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
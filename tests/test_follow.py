@@ -0,0 +1,39 @@
+"""A follower keeps mirroring the leader's state after a bad state message"""
+import asyncio
+import json
+
+from google_photos_slideshow import RegexSlideshow
+
+
+class Bus:
+    """Delivers some state messages, then ends the subscription"""
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def subscribe(self, channel):
+        for message in self.messages:
+            yield message
+
+    async def publish(self, channel, message, retain=False):
+        pass
+
+    async def close(self):
+        pass
+
+
+def test_bad_state_messages_dont_stop_the_follower():
+    state = {'url': 'http://127.0.0.1/1.jpg', 'next': [], 'show_at': 0, 'speed': 1, 'paused': False,
+             'title': 'Album', 'source': '', 'content_types': {}}
+
+    async def main():
+        s = RegexSlideshow("http://127.0.0.1/", state_path='', support_casting=False)
+        s.bus = Bus(['{not json', 'null', json.dumps({'url': 'missing the rest'}), json.dumps(state)])
+        try:
+            await s._follow()
+            assert s.remote == state
+            assert s.title == 'Album'
+        finally:
+            await s.close()
+
+    asyncio.run(main())
@@ -0,0 +1,25 @@
+"""Albums of a host share content types: a url dropped by one album keeps its type while another still plays it"""
+import asyncio
+
+from google_photos_slideshow import SlideshowHost, URLListSlideshow
+from google_photos_slideshow.playlist import UrlChanges
+
+
+def test_shared_content_types_outlive_one_album():
+    shared, only_a, only_b = (f"http://127.0.0.1/{name}.jpg" for name in ('shared', 'a', 'b'))
+
+    async def main():
+        host = SlideshowHost(state_path='')
+        a = await host.add('a', URLListSlideshow.mode, urls={shared: 'image/jpeg', only_a: 'image/jpeg'})
+        b = await host.add('b', URLListSlideshow.mode, urls={shared: 'image/jpeg', only_b: 'image/jpeg'})
+        await asyncio.gather(*host.start_tasks.values())
+        try:
+            await a._record_urls(UrlChanges([], [shared, only_a]))
+            assert host.content_types.get(shared) == 'image/jpeg'
+            assert only_a not in host.content_types
+            await b._record_urls(UrlChanges([], [shared]))
+            assert shared not in host.content_types
+        finally:
+            await host.close()
+
+    asyncio.run(main())
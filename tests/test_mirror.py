@@ -0,0 +1,108 @@
+"""Album mirror failover: a slideshow whose album goes away shows its mirrored copies, and goes back when it returns"""
+import asyncio
+import os
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import unused_port
+
+from google_photos_slideshow import RegexSlideshow
+from google_photos_slideshow.mirror import AlbumMirror
+
+PHOTOS = 20
+
+
+class Album:
+    """An album page whose odd photos drop the connection, like the uplink flapping"""
+
+    def __init__(self, port):
+        self.port = port
+        self.photo = os.urandom(16 * 1024)
+        self.urls = [f"http://127.0.0.1:{port}/photos/{i:06d}.jpg" for i in range(PHOTOS)]
+        self.app = web.Application()
+        self.app.router.add_get('/album', self.page)
+        self.app.router.add_get('/photos/{name}', self.photos)
+        self.runner = None
+
+    async def page(self, request):
+        return web.Response(text="".join(f'<img src="{url}">' for url in self.urls), content_type='text/html')
+
+    async def photos(self, request):
+        if int(request.match_info['name'].split('.')[0]) % 2:
+            request.transport.close()
+            raise web.HTTPServiceUnavailable()
+        return web.Response(body=self.photo, content_type='image/jpeg')
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', self.port).start()
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+@pytest.fixture
+def mirrored(tmp_path):
+    """Run test(album, slideshow, mirrored urls) once the slideshow mirrored what it could of the album"""
+    def run(test):
+        async def main():
+            album = Album(unused_port())
+            await album.start()
+            s = RegexSlideshow(f"http://127.0.0.1:{album.port}/album", state_path='', support_casting=False,
+                               mirror=tmp_path / 'mirror')
+            s.refresh_retries = 1
+            s.refresh_backoff = 0.01
+            mirror = s.mirror
+            await s._refresh()
+            for _ in range(500):
+                if not mirror.queued and mirror.queue.empty() and len(mirror.files) + mirror.failures >= PHOTOS:
+                    break
+                await asyncio.sleep(0.01)
+            try:
+                await test(album, s, [url for url in album.urls if mirror.has(url)])
+            finally:
+                await s.close()
+                await album.stop()
+
+        asyncio.run(main())
+
+    return run
+
+
+def test_failed_downloads_keep_the_slideshow_online(mirrored):
+    async def test(album, s, urls):
+        assert len(urls) == PHOTOS // 2
+        assert s.mirror.failures == PHOTOS - PHOTOS // 2
+        assert not s.mirror.offline
+        assert s._client_url(urls[0]) == urls[0]
+
+    mirrored(test)
+
+
+def test_failed_refresh_shows_the_mirrored_copies(mirrored):
+    async def test(album, s, urls):
+        await album.stop()
+        await s._refresh()
+        assert s.mirror.offline
+        assert s._client_url(urls[0]).startswith(f"{s.base_path}{AlbumMirror.route}/")
+        # photos without a copy are skipped
+        shown = [await s._next_url() for _ in range(2 * PHOTOS)]
+        assert all(s.mirror.has(url) for url in shown)
+        await album.start()
+
+    mirrored(test)
+
+
+def test_successful_refresh_goes_back_to_the_album(mirrored):
+    async def test(album, s, urls):
+        await album.stop()
+        await s._refresh()
+        await album.start()
+        await s._refresh()
+        assert not s.mirror.offline
+        assert s._client_url(urls[0]) == urls[0]
+        shown = [await s._next_url() for _ in range(2 * PHOTOS)]
+        assert set(album.urls) - set(urls) <= set(shown)
+
+    mirrored(test)
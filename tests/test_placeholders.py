@@ -0,0 +1,72 @@
+"""Placeholders: a failed source fetch is retried after retry_after instead of being cached"""
+import asyncio
+import io
+
+import pytest
+
+from google_photos_slideshow.placeholders import Placeholders
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def jpeg():
+    out = io.BytesIO()
+    Image.new('RGB', (200, 150), (40, 120, 200)).save(out, 'JPEG')
+    return out.getvalue()
+
+
+async def settle(placeholders):
+    while placeholders.jobs:
+        await asyncio.gather(*placeholders.jobs.values(), return_exceptions=True)
+
+
+def test_a_failed_fetch_is_retried_later():
+    photo = jpeg()
+    fetches = []
+
+    async def source(url):
+        fetches.append(url)
+        if len(fetches) == 1:
+            raise ConnectionError("the network blinked")
+        return photo
+
+    async def main():
+        placeholders = Placeholders(source)
+        try:
+            placeholders.load('a')
+            await settle(placeholders)
+            assert placeholders.get('a') is None
+            placeholders.load('a')
+            await settle(placeholders)
+            assert len(fetches) == 1  # not before retry_after
+            placeholders.retry_after = 0
+            placeholders.load('a')
+            await settle(placeholders)
+            assert len(fetches) == 2
+            assert placeholders.get('a').startswith('data:image/jpeg;base64,')
+        finally:
+            placeholders.close()
+
+    asyncio.run(main())
+
+
+def test_no_placeholder_from_the_source_is_kept():
+    fetches = []
+
+    async def source(url):
+        fetches.append(url)
+        return None
+
+    async def main():
+        placeholders = Placeholders(source)
+        placeholders.retry_after = 0
+        try:
+            for _ in range(3):
+                placeholders.load('a')
+                await settle(placeholders)
+            assert fetches == ['a']
+            assert placeholders.get('a') is None
+        finally:
+            placeholders.close()
+
+    asyncio.run(main())
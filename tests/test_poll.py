@@ -0,0 +1,168 @@
+"""Conditional polling against a fixture album: 304s, unchanged pages, truncated pages, backoff and jitter"""
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import unused_port
+
+from google_photos_slideshow import RegexSlideshow
+from google_photos_slideshow.scanner import StreamScanner
+
+PHOTOS = 300
+
+
+class Album:
+    """The fixture album's page and how it answers"""
+
+    def __init__(self, port):
+        self.port = port
+        self.version = 0
+        self.etags = True
+        self.truncate = 0  # responses to cut off mid-body
+        self.fail = 0  # requests to answer with a 503
+        self.requests = []  # loop.time() of each request
+        self.not_modified = 0
+
+    def urls(self):
+        return [f"http://127.0.0.1:{self.port}/p/{self.version}-{i}.jpg" for i in range(PHOTOS)]
+
+    def body(self):
+        return ("<title>Poll Album</title>" + "".join(f'<img src="{url}">' for url in self.urls())).encode()
+
+    async def handle(self, request):
+        self.requests.append(asyncio.get_running_loop().time())
+        if self.fail:
+            self.fail -= 1
+            raise web.HTTPServiceUnavailable()
+        etag = f'"v{self.version}"'
+        headers = {'ETag': etag} if self.etags else {}
+        if self.etags and request.headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers=headers)
+        body = self.body()
+        if self.truncate:
+            self.truncate -= 1
+            response = web.StreamResponse(headers={**headers, 'Content-Length': str(len(body)),
+                                                   'Content-Type': 'text/html'})
+            await response.prepare(request)
+            await response.write(body[:len(body) // 20])
+            request.transport.close()
+            return response
+        return web.Response(body=body, headers=headers, content_type='text/html')
+
+
+@pytest.fixture
+def feeds(monkeypatch):
+    """Counts StreamScanner.feed calls"""
+    calls = [0]
+    feed = StreamScanner.feed
+
+    def counted(self, text):
+        calls[0] += 1
+        return feed(self, text)
+
+    monkeypatch.setattr(StreamScanner, 'feed', counted)
+    return calls
+
+
+def run(test):
+    """Run test(album, slideshow) against a fresh fixture album"""
+    async def main():
+        album = Album(unused_port())
+        app = web.Application()
+        app.router.add_get('/', album.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', album.port).start()
+        s = RegexSlideshow(f"http://127.0.0.1:{album.port}/", state_path='', support_casting=False)
+        s.refresh_backoff = 0.05
+        try:
+            await test(album, s)
+        finally:
+            await s.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+
+
+def test_etag_unchanged_page_is_not_parsed(feeds):
+    async def test(album, s):
+        await s._refresh()
+        assert set(s.playlist) == set(album.urls())
+        before, not_modified = feeds[0], album.not_modified
+        await s._refresh()
+        assert album.not_modified == not_modified + 1
+        assert feeds[0] == before
+        album.version += 1
+        await s._refresh()
+        assert feeds[0] > before
+        assert set(s.playlist) == set(album.urls())
+
+    run(test)
+
+
+def test_unchanged_page_recognised_by_its_hash(feeds):
+    async def test(album, s):
+        album.etags = False
+        await s._refresh()
+        assert set(s.playlist) == set(album.urls())
+        unchanged, changes = s.unchanged_fetches, s.playlist_changes
+        await s._refresh()
+        # scanned chunk by chunk as it downloads, what it found is dropped when the hash matches
+        assert s.unchanged_fetches == unchanged + 1
+        assert s.playlist_changes == changes
+        album.version += 1
+        before = feeds[0]
+        await s._refresh()
+        assert feeds[0] > before
+        assert set(s.playlist) == set(album.urls())
+
+    run(test)
+
+
+def test_truncated_page_is_fetched_whole_next_time():
+    async def test(album, s):
+        s.refresh_retries = 0
+        album.truncate = 1
+        await s._refresh()
+        assert len(s.playlist) < PHOTOS
+        await s._refresh()
+        # not revalidated to a 304 with the ETag of the cut off response
+        assert set(s.playlist) == set(album.urls())
+
+    run(test)
+
+
+def test_retries_back_off_with_jitter():
+    async def test(album, s):
+        s.refresh_retries = 4
+        gaps = []
+        for _ in range(5):
+            album.fail = 4
+            album.requests = []
+            await s._refresh()
+            gaps.append([b - a for a, b in zip(album.requests, album.requests[1:])])
+        assert set(s.playlist) == set(album.urls())
+        assert all(len(run) == 4 for run in gaps)
+        for attempt in range(4):
+            delay = s.refresh_backoff * 2 ** attempt
+            # jittered down to half of it, the request itself takes a little time on top of the delay
+            assert all(delay * 0.5 <= run[attempt] <= delay + 0.05 for run in gaps)
+        assert len({round(run[0], 3) for run in gaps}) > 1
+
+    run(test)
+
+
+def test_poll_interval_grows_while_quiet():
+    async def test(album, s):
+        intervals = []
+        for _ in range(6):
+            await s._refresh()
+            intervals.append(s.poll_interval)
+        assert all(a <= b for a, b in zip(intervals, intervals[1:]))
+        assert s.refresh_interval < intervals[-1] <= max(s.max_refresh_interval, s.refresh_interval)
+        album.version += 1
+        await s._refresh()
+        assert s.poll_interval == s.refresh_interval
+
+    run(test)
@@ -0,0 +1,150 @@
+"""Image proxy against a fake upstream: cache hits, Range and If-None-Match, shared downloads and LRU eviction"""
+import asyncio
+import os
+from collections import Counter
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import unused_port
+
+from google_photos_slideshow.proxy import ImageProxy
+
+SIZE = 64 * 1024
+
+
+class Upstream:
+    """The photo host behind the proxy"""
+
+    def __init__(self, port):
+        self.port = port
+        self.photo = os.urandom(SIZE)
+        self.requests = Counter()  # path -> requests
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.port}/photos/{name}.jpg"
+
+    async def photos(self, request):
+        self.requests[request.path] += 1
+        await asyncio.sleep(0.02)
+        return web.Response(body=self.photo, content_type='image/jpeg')
+
+    async def video(self, request):
+        """Sent in 10 pieces over 1.5s"""
+        self.requests[request.path] += 1
+        response = web.StreamResponse(headers={'Content-Type': 'video/mp4'})
+        await response.prepare(request)
+        for _ in range(10):
+            await asyncio.sleep(0.15)
+            await response.write(self.photo)
+        await response.write_eof()
+        return response
+
+
+async def serve(app, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+class Screens:
+    """Fetches photos through the proxy, like screens do"""
+
+    def __init__(self, proxy, port, client):
+        self.proxy = proxy
+        self.base = f"http://127.0.0.1:{port}"
+        self.client = client
+
+    async def get(self, url, headers=None):
+        async with self.client.get(self.base + self.proxy.url_for(url), headers=headers) as response:
+            return response.status, await response.read(), response.headers
+
+
+def run(test, tmp_path):
+    """Run test(upstream, proxy, screens) with a budget of 4 photos and a bit, and a short session total timeout"""
+    async def main():
+        upstream = Upstream(unused_port())
+        app = web.Application()
+        app.router.add_get('/photos/{name}', upstream.photos)
+        app.router.add_get('/video', upstream.video)
+        upstream_runner = await serve(app, upstream.port)
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1))
+        proxy = ImageProxy(Path(tmp_path) / 'cache', lambda: session, max_bytes=int(4.5 * SIZE))
+        app = web.Application()
+        proxy.setup_routes(app)
+        port = unused_port()
+        proxy_runner = await serve(app, port)
+        try:
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as client:
+                await test(upstream, proxy, Screens(proxy, port, client))
+        finally:
+            await proxy_runner.cleanup()
+            await session.close()
+            await upstream_runner.cleanup()
+
+    asyncio.run(main())
+
+
+def test_hits_are_served_from_the_cache(tmp_path):
+    async def test(upstream, proxy, screens):
+        for _ in range(6):
+            for i in range(3):
+                status, body, _ = await screens.get(upstream.url(i))
+                assert status == 200 and body == upstream.photo
+        assert all(upstream.requests[f"/photos/{i}.jpg"] == 1 for i in range(3))
+        assert proxy.hits == 15 and proxy.misses == 3
+
+    run(test, tmp_path)
+
+
+def test_range_and_if_none_match(tmp_path):
+    async def test(upstream, proxy, screens):
+        await screens.get(upstream.url(0))
+        status, body, headers = await screens.get(upstream.url(0), {'Range': 'bytes=100-1099'})
+        assert status == 206
+        assert body == upstream.photo[100:1100]
+        etag = headers.get('ETag')
+        assert etag is not None
+        status, body, _ = await screens.get(upstream.url(0), {'If-None-Match': etag})
+        assert status == 304
+        assert body == b''
+        assert upstream.requests['/photos/0.jpg'] == 1
+
+    run(test, tmp_path)
+
+
+def test_concurrent_screens_share_one_download(tmp_path):
+    async def test(upstream, proxy, screens):
+        results = await asyncio.gather(*[screens.get(upstream.url('shared')) for _ in range(50)])
+        assert upstream.requests['/photos/shared.jpg'] == 1
+        assert all(status == 200 and body == upstream.photo for status, body, _ in results)
+
+    run(test, tmp_path)
+
+
+def test_least_recently_used_photo_is_evicted(tmp_path):
+    async def test(upstream, proxy, screens):
+        for name in ('shared', 0, 1, 2):
+            await screens.get(upstream.url(name))
+        # 0, 1, 2 and shared fill the cache, a 5th photo evicts shared, the least recently used
+        await screens.get(upstream.url(3))
+        cached = {path.name for path in proxy.cache_dir.iterdir()}
+        assert proxy.total_bytes <= proxy.max_bytes
+        assert len(cached) == len(proxy.entries) == 4
+        assert proxy.key(upstream.url('shared')) not in proxy.entries
+        assert all(proxy.key(upstream.url(i)) in proxy.entries for i in range(4))
+        await screens.get(upstream.url('shared'))
+        assert upstream.requests['/photos/shared.jpg'] == 2
+
+    run(test, tmp_path)
+
+
+def test_slow_download_is_not_cut_off_by_the_session_timeout(tmp_path):
+    async def test(upstream, proxy, screens):
+        proxy.max_bytes = 1024 ** 3
+        status, body, _ = await screens.get(f"http://127.0.0.1:{upstream.port}/video")
+        assert status == 200
+        assert body == upstream.photo * 10
+
+    run(test, tmp_path)
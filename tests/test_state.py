@@ -0,0 +1,37 @@
+"""Saving the album state: an unwritable state path is warned about once, then retried every state_retry_after"""
+import asyncio
+import logging
+
+from google_photos_slideshow import RegexSlideshow
+
+
+def test_unwritable_state_path_warns_once(tmp_path, caplog):
+    path = tmp_path / 'state.sqlite'
+    urls = [f"http://127.0.0.1/{i}.jpg" for i in range(5)]
+
+    async def main():
+        s = RegexSlideshow("http://127.0.0.1/", state_path=str(path), support_casting=False)
+        saves = []
+
+        def save(*args):
+            saves.append(args)
+            raise PermissionError("read-only file system")
+
+        s.state.save = save
+        try:
+            s.playlist.apply(urls, [])
+            for _ in range(3):
+                s._state_dirty = True
+                await s._save_state()
+            assert len(saves) == 1
+            s.state_retry_after = 0
+            s.state.save = lambda *args: saves.append(args)
+            await s._save_state()
+            assert len(saves) == 2
+            assert s._state_failed_at is None
+        finally:
+            await s.close()
+
+    with caplog.at_level(logging.DEBUG, logger="slideshow"):
+        asyncio.run(main())
+    assert sum(r.levelno == logging.WARNING and 'Failed to save state' in r.getMessage() for r in caplog.records) == 1
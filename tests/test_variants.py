@@ -0,0 +1,76 @@
+"""Resized photo variants of a folder: cache hits, stale variants deleted and the cache staying within its budget"""
+import asyncio
+import os
+
+import pytest
+
+from google_photos_slideshow.variants import ImageVariants
+
+Image = pytest.importorskip("PIL.Image")
+
+PHOTOS = 8
+
+
+def write_photos(folder, version):
+    photos = []
+    for i in range(PHOTOS):
+        path = folder / f"{i}.jpg"
+        Image.new('RGB', (1200, 900), ((i * 37 + version * 50) % 256, 80, 160)).save(path, quality=90)
+        # a distinct mtime for every version, even on filesystems with a coarse clock
+        os.utime(path, ns=(version * 10 ** 9, version * 10 ** 9))
+        photos.append(path)
+    return photos
+
+
+def cached(variants):
+    return sorted(p.name for p in variants.cache_dir.glob('*.jpg'))
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'photos'
+    folder.mkdir()
+    return folder
+
+
+@pytest.fixture
+def variants(folder, tmp_path):
+    variants = ImageVariants(folder, tmp_path / 'cache')
+    yield variants
+    variants.close()
+
+
+async def get_all(variants, photos, *sizes):
+    for photo in photos:
+        for size in sizes:
+            await variants.get(photo, size)
+
+
+def test_a_variant_is_made_once(folder, variants):
+    photos = write_photos(folder, 1)
+    asyncio.run(get_all(variants, photos, 1024, 1024))
+    assert len(cached(variants)) == PHOTOS == len(variants.entries)
+
+
+def test_variants_of_changed_photos_are_deleted(folder, variants):
+    photos = write_photos(folder, 1)
+    for version in (2, 3, 4):
+        write_photos(folder, version)
+        asyncio.run(get_all(variants, photos, 1024, 640))
+    files = cached(variants)
+    assert len(files) == 2 * PHOTOS
+    assert all(f"-{4 * 10 ** 9:x}-" in name for name in files)
+    assert variants.total_bytes == sum(p.stat().st_size for p in variants.cache_dir.glob('*.jpg'))
+
+
+def test_cache_stays_within_its_budget(folder, variants):
+    photos = write_photos(folder, 1)
+    asyncio.run(get_all(variants, photos, 1024, 640))
+    # a budget of about 5 variants, the first photo is asked for again last so it is the most recently used
+    variants.max_bytes = sum(sorted(variants.entries.values())[-5:])
+    asyncio.run(variants.get(photos[0], 1024))
+    variants._evict()
+    files = cached(variants)
+    assert variants.total_bytes <= variants.max_bytes
+    assert len(files) == len(variants.entries) < 2 * PHOTOS
+    assert variants.cache_path(photos[0], 1024).exists()